@@ -0,0 +1,202 @@
+import asyncio
+import email.utils
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Annotated, Any, Awaitable, Callable, Dict, FrozenSet, Mapping, Optional, Tuple
+
+import httpx
+from fastapi import Depends, Header, HTTPException
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+DEFAULT_CERTS_LIFETIME = 300
+
+CertsFetcher = Callable[[str], Awaitable[Tuple[Dict[str, str], Mapping[str, str]]]]
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+def cache_lifetime(headers: Mapping[str, str], default: float = DEFAULT_CERTS_LIFETIME) -> float:
+    """Seconds a response may be reused for, from its Cache-Control (or Expires) headers."""
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    max_age = re.search(r"max-age=(\d+)", cache_control)
+    if max_age:
+        return max(int(max_age.group(1)) - int(headers.get("age", 0) or 0), 0)
+    if headers.get("expires"):
+        try:
+            return max(email.utils.parsedate_to_datetime(headers["expires"]).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return 0
+    return default
+
+
+async def fetch_certs(url: str) -> Tuple[Dict[str, str], Mapping[str, str]]:
+    async with httpx.AsyncClient(timeout=10) as client:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.json(), response.headers
+
+
+@dataclass
+class CertificateCache:
+    """Google's token signing certificates (key id -> PEM), kept until their Cache-Control max-age.
+
+    An unknown key id triggers an early refresh, since Google rotates keys,
+    but at most once per `min_refresh_interval` seconds so forged key ids
+    can't be used to hammer the certs endpoint.
+    """
+    url: str = GOOGLE_CERTS_URL
+    min_refresh_interval: float = 60
+    fetch: CertsFetcher = fetch_certs
+
+    def __post_init__(self):
+        self._certs: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _fresh(self, key_id: Optional[str]) -> bool:
+        now = time.time()
+        if now >= self._expires_at:
+            return False
+        return key_id is None or key_id in self._certs or now - self._fetched_at < self.min_refresh_interval
+
+    async def get(self, key_id: str = None) -> Dict[str, str]:
+        if self._fresh(key_id):
+            return self._certs
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another request may have refreshed them while this one waited.
+            if not self._fresh(key_id):
+                try:
+                    certs, headers = await self.fetch(self.url)
+                except (httpx.HTTPError, ValueError) as exc:
+                    if not self._certs:
+                        raise AuthenticationError(f"Could not fetch signing certificates: {exc}")
+                    # Keep verifying with the certificates we have rather than failing every request.
+                    print(f"Could not refresh signing certificates, keeping the cached ones: {exc}")
+                    self._expires_at = time.time() + self.min_refresh_interval
+                else:
+                    self._certs = dict(certs)
+                    self._fetched_at = time.time()
+                    self._expires_at = self._fetched_at + cache_lifetime(headers)
+        return self._certs
+
+
+@dataclass
+class TokenVerifier:
+    """Verifies Google ID tokens against cached certificates and caches their claims until `exp`.
+
+    Signature checks run in a worker thread; a token seen before is
+    answered from the claims cache without any crypto. Without an
+    `audience` every token is refused, since any Google client's tokens
+    would otherwise be accepted.
+    """
+    certificates: CertificateCache
+    audience: Optional[str] = None
+    issuers: Tuple[str, ...] = GOOGLE_ISSUERS
+    max_cached_tokens: int = 10000
+    clock_skew: int = 10
+
+    def __post_init__(self):
+        self._claims: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def check_configured(self) -> None:
+        """Raise at startup rather than refusing every request later."""
+        if not self.audience:
+            raise RuntimeError("GOOGLE_CLIENT_ID must be set to verify ID tokens")
+
+    @staticmethod
+    def _cache_key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        claims = self._claims.get(key)
+        if claims is None:
+            return None
+        if claims["exp"] + self.clock_skew <= time.time():
+            del self._claims[key]
+            return None
+        self._claims.move_to_end(key)
+        return claims
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        from google.auth import jwt
+        from google.auth.exceptions import GoogleAuthError
+
+        if not self.audience:
+            raise AuthenticationError("No audience configured to verify ID tokens against")
+        key = self._cache_key(token)
+        claims = self._cached(key)
+        if claims is not None:
+            self.hits += 1
+            return claims
+        self.misses += 1
+        try:
+            key_id = jwt.decode_header(token).get("kid")
+            certs = await self.certificates.get(key_id)
+            claims = await asyncio.to_thread(
+                jwt.decode, token, certs=certs, audience=self.audience, clock_skew_in_seconds=self.clock_skew
+            )
+        except (GoogleAuthError, ValueError) as exc:
+            raise AuthenticationError(str(exc))
+        if claims.get("iss") not in self.issuers:
+            raise AuthenticationError(f"Wrong issuer: {claims.get('iss')}")
+        if "exp" not in claims:
+            raise AuthenticationError("Token has no expiry")
+        self._claims[key] = claims
+        while len(self._claims) > self.max_cached_tokens:
+            self._claims.popitem(last=False)
+        return claims
+
+
+def get_admin_emails() -> FrozenSet[str]:
+    """`ADMIN_EMAILS` (comma separated): the accounts allowed to reload or rebuild the index."""
+    return frozenset(address.strip().lower() for address in os.getenv("ADMIN_EMAILS", "").split(",") if address.strip())
+
+
+ADMIN_EMAILS = get_admin_emails()
+
+
+VERIFIER = TokenVerifier(
+    certificates=CertificateCache(url=os.getenv("GOOGLE_CERTS_URL", GOOGLE_CERTS_URL)),
+    audience=os.getenv("GOOGLE_CLIENT_ID") or None,
+    max_cached_tokens=int(os.getenv("AUTH_MAX_CACHED_TOKENS", "10000")),
+)
+
+
+async def get_current_user(
+    token: Annotated[str | None, Header()] = None,
+    authorization: Annotated[str | None, Header()] = None,
+) -> Dict[str, Any]:
+    """FastAPI dependency returning the verified claims of the caller's Google ID token.
+
+    The token is read from the `token` header or an `Authorization: Bearer` header.
+    """
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):].strip()
+    if not token:
+        raise HTTPException(401, "Missing ID token", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return await VERIFIER.verify(token)
+    except AuthenticationError as auth_error:
+        raise HTTPException(401, str(auth_error), headers={"WWW-Authenticate": "Bearer"})
+
+
+async def get_admin_user(user: Annotated[Dict[str, Any], Depends(get_current_user)]) -> Dict[str, Any]:
+    """`get_current_user`, refused with 403 unless the caller's verified email is in `ADMIN_EMAILS`."""
+    email_address = (user.get("email") or "").lower()
+    if user.get("email_verified") not in (True, "true") or email_address not in ADMIN_EMAILS:
+        raise HTTPException(403, "Administrator access required")
+    return user
@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+from .reporting import write_results
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HEAVY_MODULES = ["langchain", "chromadb", "torch", "sentence_transformers", "onnxruntime", "googleapiclient"]
+PROBE = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start_time
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module: str = "main", repeats: int = 3, env: Dict[str, str] = None) -> Dict[str, Any]:
+    """Import `module` in `repeats` fresh interpreters; reports the time and which heavy packages came with it."""
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=REPO_ROOT,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    seconds = [sample["seconds"] for sample in samples]
+    return {
+        "module": module,
+        "seconds_median": statistics.median(seconds),
+        "seconds_min": min(seconds),
+        "heavy_modules_loaded": samples[-1]["loaded"],
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Measure how long importing the API takes in a fresh process.")
+    parser.add_argument("--modules", nargs="+", default=["main", "doc_gpt.json_gpt"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="bench_cold_start.json")
+    args = parser.parse_args(argv)
+
+    write_results(args.output, {"imports": [measure_import(module, args.repeats) for module in args.modules]})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from .reporting import latency_summary, peak_rss_mb, percentile, write_results
+from .synthetic import generate_queries, generate_tickets
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BASELINE = "torch"
+
+
+def run_worker(backend: str, directory: str) -> None:
+    """Embed the chunks and queries in `directory` with one backend, in a fresh process."""
+    os.environ["EMBEDDINGS_BACKEND"] = backend
+    os.environ["EMBEDDINGS_CACHE_DIR"] = ""
+    from doc_gpt.document_parser.embeddings import get_embedding_service
+
+    with open(os.path.join(directory, "chunks.json")) as chunks_file:
+        texts = json.load(chunks_file)
+    with open(os.path.join(directory, "queries.json")) as queries_file:
+        questions = [question for question, _ in json.load(queries_file)]
+
+    start_time = time.perf_counter()
+    embedding_function = get_embedding_service(directory)
+    load_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    chunk_vectors = np.asarray(embedding_function.embed_documents(texts), dtype=np.float32)
+    index_seconds = time.perf_counter() - start_time
+    query_latencies = []
+    query_vectors = []
+    for question in questions:
+        start_time = time.perf_counter()
+        query_vectors.append(embedding_function.embed_query(question))
+        query_latencies.append(time.perf_counter() - start_time)
+    embedding_function.close()
+
+    np.save(os.path.join(directory, f"{backend}-chunks.npy"), chunk_vectors)
+    np.save(os.path.join(directory, f"{backend}-queries.npy"), np.asarray(query_vectors, dtype=np.float32))
+    with open(os.path.join(directory, f"{backend}.json"), "w") as stats_file:
+        json.dump({
+            "identity": embedding_function.identity,
+            "model_load_seconds": load_seconds,
+            "chunks_per_second": len(texts) / index_seconds if index_seconds else 0.0,
+            "query_latency": latency_summary(query_latencies),
+            "peak_rss_mb": peak_rss_mb(),
+            "torch_loaded": "torch" in sys.modules,
+        }, stats_file)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def compare(directory: str, backend: str, chunk_ticket_ids: List[int], queries: List[List[Any]], k: int) -> Dict[str, Any]:
+    baseline_chunks = _normalize(np.load(os.path.join(directory, f"{BASELINE}-chunks.npy")))
+    baseline_queries = _normalize(np.load(os.path.join(directory, f"{BASELINE}-queries.npy")))
+    chunks = _normalize(np.load(os.path.join(directory, f"{backend}-chunks.npy")))
+    query_vectors = _normalize(np.load(os.path.join(directory, f"{backend}-queries.npy")))
+
+    cosine = np.sum(baseline_chunks * chunks, axis=1)
+    baseline_top = np.argsort(-(baseline_queries @ baseline_chunks.T), axis=1)[:, :k]
+    top = np.argsort(-(query_vectors @ chunks.T), axis=1)[:, :k]
+    overlap = [len(set(expected) & set(found)) / k for expected, found in zip(baseline_top, top)]
+    hits = [
+        ticket_id in {chunk_ticket_ids[index] for index in found}
+        for (_, ticket_id), found in zip(queries, top)
+    ]
+    return {
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "cosine_p1": float(percentile(cosine.tolist(), 1)),
+        "overlap_with_baseline_at_k": float(np.mean(overlap)),
+        "recall_at_k": float(np.mean(hits)),
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare embedding backends against the PyTorch baseline.")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--tickets", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_embeddings.json")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.worker, args.directory)
+        return
+
+    from doc_gpt.document_parser.json_coversational_retriver import get_document_from_json_dict, get_text_splitter
+
+    backends = [BASELINE] + [backend for backend in args.backends if backend != BASELINE]
+    tickets = list(generate_tickets(args.tickets, args.seed))
+    queries = generate_queries(tickets, args.queries, args.seed)
+    splitter = get_text_splitter()
+    chunks = [chunk for ticket in tickets for chunk in splitter.split_documents([get_document_from_json_dict(ticket)])]
+
+    results = {"tickets": len(tickets), "chunks": len(chunks), "queries": len(queries), "k": args.k, "backends": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "chunks.json"), "w") as chunks_file:
+            json.dump([chunk.page_content for chunk in chunks], chunks_file)
+        with open(os.path.join(directory, "queries.json"), "w") as queries_file:
+            json.dump(queries, queries_file)
+        for backend in backends:
+            # A process per backend keeps model memory and imports separate.
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.embedding_parity", "--worker", backend, "--directory", directory],
+                cwd=REPO_ROOT,
+                check=True,
+            )
+            with open(os.path.join(directory, f"{backend}.json")) as stats_file:
+                results["backends"][backend] = json.load(stats_file)
+        chunk_ticket_ids = [chunk.metadata.get("id") for chunk in chunks]
+        for backend in backends:
+            results["backends"][backend]["parity"] = compare(
+                directory, backend, chunk_ticket_ids, [list(query) for query in queries], args.k
+            )
+
+    write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+ANSWER = (
+    "Based on the tickets, the customer reported that the 2fa code is rejected in the mobile app "
+    "and the issue was escalated to the authentication team for a fix."
+)
+
+
+@dataclass
+class FakeOllama:
+    """Stand-in for the Ollama HTTP API that streams a canned answer at a fixed pace.
+
+    `/api/generate` streams `tokens` newline-delimited JSON chunks, waiting
+    `first_token_latency` seconds before the first and `token_latency`
+    seconds between the rest, so generation cost is known and repeatable.
+    """
+    host: str = "127.0.0.1"
+    port: int = 0
+    tokens: int = 32
+    token_latency: float = 0.02
+    first_token_latency: float = 0.05
+
+    def __post_init__(self):
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self.requests = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def answer_tokens(self) -> List[str]:
+        words = ANSWER.split()
+        return [f"{words[index % len(words)]} " for index in range(self.tokens)]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, body: dict) -> None:
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/api/tags":
+                    self._send_json({"models": [{"name": "mistral:latest"}]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/api/generate":
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                fake.requests += 1
+                tokens = fake.answer_tokens()
+                if request.get("stream") is False:
+                    time.sleep(fake.first_token_latency + fake.token_latency * (len(tokens) - 1))
+                    self._send_json({"model": request.get("model"), "response": "".join(tokens), "done": True})
+                    return
+                # HTTP/1.0: the body ends when the connection closes, like a streamed Ollama response.
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                try:
+                    for index, token in enumerate(tokens):
+                        time.sleep(fake.first_token_latency if index == 0 else fake.token_latency)
+                        chunk = {"model": request.get("model"), "response": token, "done": False}
+                        self.wfile.write(json.dumps(chunk).encode() + b"\n")
+                        self.wfile.flush()
+                    done = {"model": request.get("model"), "response": "", "done": True}
+                    self.wfile.write(json.dumps(done).encode() + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up, e.g. the losing copy of a hedged request.
+                    pass
+
+        return Handler
+
+    def start(self) -> "FakeOllama":
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake Ollama API with configurable token latency.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--token-latency-ms", type=float, default=20)
+    parser.add_argument("--first-token-latency-ms", type=float, default=50)
+    args = parser.parse_args(argv)
+
+    fake = FakeOllama(
+        port=args.port,
+        tokens=args.tokens,
+        token_latency=args.token_latency_ms / 1000,
+        first_token_latency=args.first_token_latency_ms / 1000,
+    ).start()
+    print(f"Fake Ollama listening on {fake.base_url}")
+    try:
+        fake._thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
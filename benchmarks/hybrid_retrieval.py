@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+from doc_gpt.document_parser.json_coversational_retriver import get_embedding_function, load_json_dict_list_to_db
+from doc_gpt.document_parser.lexical_index import BM25Index, HybridRetriever, get_lexical_index_path
+
+from .reporting import percentile, write_results
+from .synthetic import generate_queries, generate_tickets, write_jsonl
+
+
+def evaluate(search: Callable[[str], List[int]], queries: List[Tuple[str, int]]) -> Dict[str, float]:
+    latencies, hits = [], 0
+    for question, ticket_id in queries:
+        start_time = time.perf_counter()
+        ticket_ids = search(question)
+        latencies.append(time.perf_counter() - start_time)
+        hits += ticket_id in ticket_ids
+    return {
+        "recall": hits / len(queries),
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare hybrid BM25 + vector retrieval with vector-only retrieval.")
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_file = os.path.join(directory, "zendesk.jsonl")
+        write_jsonl(source_file, generate_tickets(args.tickets, args.seed))
+        persist_directory = os.path.join(directory, "chroma_db")
+        lexical_index = BM25Index.load(get_lexical_index_path(persist_directory))
+        start_time = time.perf_counter()
+        db, report = load_json_dict_list_to_db(
+            source_file, get_embedding_function(), persist_directory, lexical_index=lexical_index
+        )
+        index_seconds = time.perf_counter() - start_time
+
+        with open(source_file) as jsonl_file:
+            tickets = [json.loads(line) for line in jsonl_file]
+        queries = generate_queries(tickets, args.queries, args.seed)
+        hybrid = HybridRetriever(vectorstore=db, lexical_index=lexical_index, k=args.k)
+        results = {
+            "tickets": args.tickets,
+            "chunks": report.chunks_upserted,
+            "queries": len(queries),
+            "k": args.k,
+            "index_seconds": index_seconds,
+            "vector": evaluate(
+                lambda question: [document.metadata.get("id") for document in db.similarity_search(question, k=args.k)],
+                queries,
+            ),
+            "hybrid": evaluate(
+                lambda question: [document.metadata.get("id") for document in hybrid.get_relevant_documents(question)],
+                queries,
+            ),
+        }
+
+    write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from .cold_start import measure_import
+from .fake_ollama import FakeOllama
+from .reporting import latency_summary, peak_rss_mb, write_results
+from .synthetic import generate_queries, generate_tickets, write_jsonl
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HEADERS = {"token": "load-test"}
+
+
+def _free_port() -> int:
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+async def wait_until_ready(
+    session: aiohttp.ClientSession, base_url: str, server: subprocess.Popen, timeout: float
+) -> Dict[str, Any]:
+    """Seconds until the API answers at all and until `GET /ready` reports warmed-up retrieval."""
+    start_time = time.perf_counter()
+    startup = {}
+    while time.perf_counter() - start_time < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"API exited during startup with code {server.returncode}")
+        try:
+            async with session.get(f"{base_url}/ready") as response:
+                status = await response.json()
+                startup.setdefault("seconds_to_serve", time.perf_counter() - start_time)
+                if response.status == 200:
+                    return {**startup, "seconds_to_ready": time.perf_counter() - start_time, "warmup": status["timings"]}
+                if status.get("error"):
+                    raise RuntimeError(f"API warm-up failed: {status['error']}")
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"API not ready after {timeout} seconds")
+
+
+async def query_and_poll(
+    session: aiohttp.ClientSession, base_url: str, prompt: str, poll_interval: float
+) -> Dict[str, Any]:
+    start_time = time.perf_counter()
+    async with session.post(f"{base_url}/", json={"prompt": prompt}, headers=HEADERS) as response:
+        body = await response.json()
+        if response.status != 200:
+            return {"status": response.status, "latency": time.perf_counter() - start_time}
+    query_id, pending = body.get("_id") or body.get("id"), body.get("response")
+    while True:
+        async with session.get(f"{base_url}/tasks/{query_id}", headers=HEADERS) as response:
+            task = await response.json()
+        if task.get("error"):
+            return {"status": "error", "latency": time.perf_counter() - start_time}
+        if task.get("response") != pending:
+            return {"status": 200, "latency": time.perf_counter() - start_time}
+        await asyncio.sleep(poll_interval)
+
+
+async def query_and_stream(session: aiohttp.ClientSession, base_url: str, prompt: str) -> Dict[str, Any]:
+    start_time = time.perf_counter()
+    first_token: Optional[float] = None
+    async with session.post(f"{base_url}/stream", json={"prompt": prompt}, headers=HEADERS) as response:
+        if response.status != 200:
+            return {"status": response.status, "latency": time.perf_counter() - start_time}
+        event = None
+        async for line in response.content:
+            line = line.decode().strip()
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                if event == "error":
+                    return {"status": "error", "latency": time.perf_counter() - start_time}
+                if event is None and first_token is None:
+                    first_token = time.perf_counter() - start_time
+            elif not line:
+                event = None
+    return {"status": 200, "latency": time.perf_counter() - start_time, "first_token": first_token}
+
+
+async def run_load(
+    base_url: str,
+    server: subprocess.Popen,
+    prompts: List[str],
+    concurrency: int,
+    mode: str,
+    poll_interval: float,
+    startup_timeout: float,
+) -> Dict[str, Any]:
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        startup = await wait_until_ready(session, base_url, server, startup_timeout)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(prompt: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    if mode == "stream":
+                        return await query_and_stream(session, base_url, prompt)
+                    return await query_and_poll(session, base_url, prompt, poll_interval)
+                except aiohttp.ClientError as exc:
+                    return {"status": type(exc).__name__, "latency": 0.0}
+
+        start_time = time.perf_counter()
+        outcomes = await asyncio.gather(*(one(prompt) for prompt in prompts))
+        wall_seconds = time.perf_counter() - start_time
+
+    succeeded = [outcome for outcome in outcomes if outcome["status"] == 200]
+    return {
+        "startup": startup,
+        "wall_seconds": wall_seconds,
+        "requests": len(outcomes),
+        "succeeded": len(succeeded),
+        "throughput_per_second": len(succeeded) / wall_seconds if wall_seconds else 0.0,
+        "statuses": {str(status): count for status, count in Counter(outcome["status"] for outcome in outcomes).items()},
+        "latency": latency_summary([outcome["latency"] for outcome in succeeded]),
+        "first_token_latency": latency_summary(
+            [outcome["first_token"] for outcome in succeeded if outcome.get("first_token") is not None]
+        ),
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load test of the API against a fake Ollama server.")
+    parser.add_argument("--tickets", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mode", choices=("poll", "stream"), default="poll")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per fake answer")
+    parser.add_argument("--token-latency-ms", type=float, default=20)
+    parser.add_argument("--first-token-latency-ms", type=float, default=50)
+    parser.add_argument("--backends", type=int, default=1, help="fake Ollama servers behind OLLAMA_URLS")
+    parser.add_argument(
+        "--slow-backend-first-token-ms", type=float, help="make the last backend this slow, e.g. to exercise hedging"
+    )
+    parser.add_argument("--mongo-uri", help="MongoDB to use instead of an in-memory mongomock")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache enabled")
+    parser.add_argument("--poll-interval-ms", type=float, default=50)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_load.json")
+    args = parser.parse_args(argv)
+
+    fake_ollamas = [
+        FakeOllama(
+            tokens=args.tokens,
+            token_latency=args.token_latency_ms / 1000,
+            first_token_latency=args.first_token_latency_ms / 1000,
+        ).start()
+        for _ in range(args.backends)
+    ]
+    if args.slow_backend_first_token_ms is not None:
+        fake_ollamas[-1].first_token_latency = args.slow_backend_first_token_ms / 1000
+    with tempfile.TemporaryDirectory() as directory:
+        source_file = os.path.join(directory, "zendesk.jsonl")
+        write_jsonl(source_file, generate_tickets(args.tickets, args.seed))
+        with open(source_file) as jsonl_file:
+            tickets = [json.loads(line) for line in jsonl_file]
+        queries = generate_queries(tickets, args.requests, args.seed)
+        prompts = [queries[index % len(queries)][0] for index in range(args.requests)]
+
+        port = _free_port()
+        env = {
+            **os.environ,
+            "SOURCE_FILE_PATH": source_file,
+            "CHROMA_DB_PATH": os.path.join(directory, "chroma_db"),
+            "OLLAMA_URLS": ",".join(fake_ollama.base_url for fake_ollama in fake_ollamas),
+            "OLLAMA_BASE_URL": fake_ollamas[0].base_url,
+        }
+        if args.mongo_uri:
+            env["MONGO_URI"] = args.mongo_uri
+        if not args.answer_cache:
+            env["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+        import_time = measure_import("main", env=env)
+        command = [sys.executable, "-m", "benchmarks.serve", "--port", str(port)]
+        server = subprocess.Popen(command + ([] if args.mongo_uri else ["--mongomock"]), cwd=REPO_ROOT, env=env)
+        try:
+            results = asyncio.run(run_load(
+                f"http://127.0.0.1:{port}",
+                server,
+                prompts,
+                args.concurrency,
+                args.mode,
+                args.poll_interval_ms / 1000,
+                args.startup_timeout,
+            ))
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+            for fake_ollama in fake_ollamas:
+                fake_ollama.stop()
+
+    write_results(args.output, {
+        "tickets": args.tickets,
+        "concurrency": args.concurrency,
+        "mode": args.mode,
+        "mongo": "mongod" if args.mongo_uri else "mongomock",
+        "fake_ollama": {
+            "requests": [fake_ollama.requests for fake_ollama in fake_ollamas],
+            "tokens": args.tokens,
+            "token_latency_ms": args.token_latency_ms,
+            "first_token_latency_ms": args.first_token_latency_ms,
+            "slow_backend_first_token_ms": args.slow_backend_first_token_ms,
+        },
+        "import": import_time,
+        **results,
+        "server_peak_rss_mb": peak_rss_mb(children=True),
+    })
+
+
+if __name__ == "__main__":
+    main()
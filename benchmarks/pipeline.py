@@ -0,0 +1,96 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from doc_gpt.document_parser.embeddings import get_embedding_service
+from doc_gpt.document_parser.json_coversational_retriver import (
+    get_document_from_json_dict,
+    get_text_splitter,
+    iter_json_dicts,
+    load_json_dict_list_to_db,
+)
+
+from .reporting import latency_summary, peak_rss_mb, write_results
+from .synthetic import generate_queries, generate_tickets, write_jsonl
+
+
+def timed(function: Callable[[], Any], items: int = None) -> Tuple[Any, Dict[str, float]]:
+    start_time = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start_time
+    count = items if items is not None else len(result)
+    return result, {"seconds": seconds, "items": count, "items_per_second": count / seconds if seconds else 0.0}
+
+
+def per_call(function: Callable[[str], Any], questions: List[str]) -> Dict[str, float]:
+    latencies = []
+    for question in questions:
+        start_time = time.perf_counter()
+        function(question)
+        latencies.append(time.perf_counter() - start_time)
+    return latency_summary(latencies)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for loading, splitting, embedding, indexing and retrieval.")
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_file = os.path.join(directory, "zendesk.jsonl")
+        persist_directory = os.path.join(directory, "chroma_db")
+        write_jsonl(source_file, generate_tickets(args.tickets, args.seed))
+        stages = {}
+
+        tickets, stages["load"] = timed(lambda: list(iter_json_dicts(source_file)))
+        splitter = get_text_splitter()
+        chunks, stages["split"] = timed(
+            lambda: [chunk for ticket in tickets for chunk in splitter.split_documents([get_document_from_json_dict(ticket)])]
+        )
+        texts = [chunk.page_content for chunk in chunks]
+
+        embedding_function, stages["embedding_model_load"] = timed(
+            lambda: get_embedding_service(persist_directory), items=1
+        )
+        _, stages["embed_cold"] = timed(lambda: embedding_function.embed_documents(texts))
+        _, stages["embed_cached"] = timed(lambda: embedding_function.embed_documents(texts))
+
+        # Chunk embeddings are cached by now, so these measure Chroma and the manifest.
+        (db, report), stages["index_full"] = timed(
+            lambda: load_json_dict_list_to_db(source_file, embedding_function, persist_directory), items=len(texts)
+        )
+        _, stages["index_unchanged"] = timed(
+            lambda: load_json_dict_list_to_db(source_file, embedding_function, persist_directory), items=len(tickets)
+        )
+
+        questions = [question for question, _ in generate_queries(tickets, args.queries, args.seed)]
+        _, stages["embed_queries_batch"] = timed(lambda: embedding_function.embed_queries(questions))
+        _, stages["retrieve_batch"] = timed(
+            lambda: db._collection.query(
+                query_embeddings=embedding_function.embed_queries(questions), n_results=args.k
+            )["ids"]
+        )
+        results = {
+            "tickets": len(tickets),
+            "chunks": len(texts),
+            "queries": len(questions),
+            "k": args.k,
+            "index_report": report.dict(),
+            "stages": stages,
+            "embed_query_latency": per_call(embedding_function.embed_query, questions),
+            "retrieve_latency": per_call(lambda question: db.similarity_search(question, k=args.k), questions),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        embedding_function.close()
+
+    write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+
+def percentile(values: List[float], percentile: float) -> float:
+    return statistics.quantiles(values, n=100)[int(percentile) - 1] if len(values) > 1 else values[0]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 and mean of `latencies` (seconds), in milliseconds."""
+    if not latencies:
+        return {}
+    return {
+        "count": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """Peak resident set size of this process (or of its waited-for children)."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def write_results(path: str, results: Dict[str, Any]) -> None:
+    """Print `results` and write them, with a little environment context, as JSON to `path`."""
+    results = {
+        **results,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    with open(path, "w") as output_file:
+        json.dump(results, output_file, indent=2)
@@ -0,0 +1,37 @@
+import argparse
+from typing import List
+
+
+def use_mongomock() -> None:
+    """Point `database.MongoDB` at an in-memory mongomock client instead of a real server."""
+    from mongomock_motor import AsyncMongoMockClient
+
+    import database
+
+    database.AsyncIOMotorClient = lambda uri, **kwargs: AsyncMongoMockClient()
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the API for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mongomock", action="store_true", help="use an in-memory MongoDB instead of MONGO_URI")
+    args = parser.parse_args(argv)
+
+    if args.mongomock:
+        use_mongomock()
+
+    import uvicorn
+
+    import main as api
+
+    # Every request runs as the same user, so a token quota would soon reject the load test.
+    api.JOB_QUEUE.user_token_quota = 0
+    # Load test clients have no Google ID token; every request runs as one test user.
+    api.app.dependency_overrides[api.get_current_user] = lambda: {"email": "load-test@example.com"}
+    api.VERIFIER.audience = api.VERIFIER.audience or "load-test"
+    uvicorn.run(api.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+PRODUCTS = ["mobile app", "web dashboard", "billing portal", "public API", "SSO login", "data export", "webhooks"]
+PROBLEMS = [
+    ("2fa code is rejected", "two factor authentication keeps failing"),
+    ("password reset email never arrives", "cannot recover account access"),
+    ("invoice shows the wrong amount", "charged incorrectly on the last bill"),
+    ("export times out", "download of reports never finishes"),
+    ("webhook deliveries are delayed", "events reach our server hours late"),
+    ("page loads are very slow", "everything takes ages to open"),
+    ("users are logged out randomly", "sessions expire unexpectedly"),
+]
+FIRST_NAMES = ["Ada", "Grace", "Alan", "Linus", "Barbara", "Ken", "Margaret", "Dennis", "Radia", "Edsger"]
+LAST_NAMES = ["Lovelace", "Hopper", "Turing", "Torvalds", "Liskov", "Thompson", "Hamilton", "Ritchie", "Perlman"]
+STATUSES = ["new", "open", "pending", "hold", "solved", "closed"]
+PRIORITIES = ["low", "normal", "high", "urgent"]
+
+
+def _timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def generate_ticket(ticket_id: int, rng: random.Random, now: datetime) -> Dict[str, Any]:
+    product = rng.choice(PRODUCTS)
+    problem, paraphrase = rng.choice(PROBLEMS)
+    customer = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    error_code = f"E-{rng.randint(10000, 99999)}"
+    created_at = now - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86400))
+    updated_at = created_at + timedelta(hours=rng.randint(0, 240))
+    description = (
+        f"Hi, this is {customer}. In the {product} the {problem} and we see error {error_code}. "
+        f"{paraphrase.capitalize()}. " + " ".join(rng.choice(PROBLEMS)[1] for _ in range(rng.randint(1, 6)))
+    )
+    return {
+        "id": ticket_id,
+        "url": f"https://example.zendesk.com/api/v2/tickets/{ticket_id}.json",
+        "external_id": None,
+        "type": rng.choice(["question", "incident", "problem", "task"]),
+        "subject": f"{product}: {problem}",
+        "raw_subject": f"{product}: {problem}",
+        "description": description,
+        "priority": rng.choice(PRIORITIES),
+        "status": rng.choice(STATUSES),
+        "recipient": "support@example.com",
+        "requester_id": rng.randint(1000, 9999),
+        "submitter_id": rng.randint(1000, 9999),
+        "assignee_id": rng.randint(100, 199),
+        "organization_id": rng.randint(1, 50),
+        "group_id": rng.randint(1, 10),
+        "brand_id": rng.randint(1, 5),
+        "collaborator_ids": [],
+        "follower_ids": [],
+        "email_cc_ids": [],
+        "has_incidents": False,
+        "is_public": True,
+        "due_at": None,
+        "tags": [product.replace(" ", "_")],
+        "custom_fields": [],
+        "sharing_agreement_ids": [],
+        "followup_ids": [],
+        "allow_channelback": False,
+        "allow_attachments": True,
+        "from_messaging_channel": False,
+        "via": {"channel": rng.choice(["email", "web", "api"])},
+        "created_at": _timestamp(created_at),
+        "updated_at": _timestamp(updated_at),
+    }
+
+
+def generate_tickets(count: int, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    for ticket_id in range(1, count + 1):
+        yield generate_ticket(ticket_id, rng, now)
+
+
+def generate_queries(tickets: List[Dict[str, Any]], count: int, seed: int = 0) -> List[Tuple[str, int]]:
+    """(question, expected ticket id) pairs: half keyword-style, half paraphrased."""
+    rng = random.Random(seed + 1)
+    queries = []
+    for ticket in rng.sample(tickets, min(count, len(tickets))):
+        error_code = next(word for word in ticket["description"].split() if word.startswith("E-")).rstrip(".")
+        if len(queries) % 2:
+            queries.append((f"tickets mentioning error {error_code}", ticket["id"]))
+        else:
+            customer = ticket["description"].split("this is ")[1].split(".")[0]
+            queries.append((f"what did {customer} report about {ticket['subject']}", ticket["id"]))
+    return queries
+
+
+def write_jsonl(path: str, tickets: Iterator[Dict[str, Any]]) -> int:
+    written = 0
+    with open(path, "w") as jsonl_file:
+        for ticket in tickets:
+            jsonl_file.write(json.dumps(ticket) + "\n")
+            written += 1
+    return written
@@ -1,24 +1,66 @@
 import asyncio
 import os
 import traceback
-from asyncio import Future, get_running_loop
-from dataclasses import dataclass
-from typing import List, Any, Dict
+import weakref
+from asyncio import get_running_loop
+from dataclasses import dataclass, field
+from typing import List, Any, Dict, Optional, Set, Tuple, Union
 
 from bson import ObjectId
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import IndexModel
-from pymongo.errors import OperationFailure, CollectionInvalid
-from pymongo.results import UpdateResult, InsertManyResult, InsertOneResult
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import IndexModel, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, CollectionInvalid
+from pymongo.results import BulkWriteResult, UpdateResult, InsertManyResult, InsertOneResult
+
+from doc_gpt.metrics import METRICS
+
+DATABASE_NAME = "GPTTest"
+# Collections and the single-field indexes they need, set up once at startup.
+COLLECTIONS = {
+    "queries": [],
+    "users": ["email"],
+    "credentials": ["email"],
+    "sessions": ["last_active"],
+}
+
+
+@dataclass
+class _LoopConnection:
+    client: AsyncIOMotorClient
+    db: AsyncIOMotorDatabase
+    collections: Dict[str, AsyncIOMotorCollection] = field(default_factory=dict)
+
+
+# Motor clients are bound to the event loop they are first used on, so one
+# pooled client is kept per loop and shared by every MongoDB instance.
+_connections: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, _LoopConnection]]" = (
+    weakref.WeakKeyDictionary()
+)
 
 
 @dataclass
 class MongoDB:
     _mongodb_uri: str = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+    max_pool_size: int = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+    min_pool_size: int = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    database_name: str = DATABASE_NAME
 
-    def __post_init__(self):
-        self._client = AsyncIOMotorClient(self._mongodb_uri)
-        self._db = self._client["GPTTest"]
+    def _connection(self) -> _LoopConnection:
+        loop_connections = _connections.setdefault(get_running_loop(), {})
+        key = (self._mongodb_uri, self.max_pool_size, self.min_pool_size, self.database_name)
+        connection = loop_connections.get(key)
+        if connection is None:
+            client = AsyncIOMotorClient(
+                self._mongodb_uri,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+            )
+            connection = loop_connections[key] = _LoopConnection(client=client, db=client[self.database_name])
+        return connection
+
+    @property
+    def _db(self) -> AsyncIOMotorDatabase:
+        return self._connection().db
 
     def set_mongo_ids(self, documents: List[Dict[str, Any]]) -> None:
         for document in documents:
@@ -26,18 +68,11 @@ class MongoDB:
                 document["_id"] = document["id"] if isinstance(document["id"], ObjectId) else ObjectId(document["id"])
                 del document["id"]
 
-    async def validate_collection(self, collection_name: str):
-        print(id(get_running_loop()))
-        print("Checking if collection exists")
-        try:
-            # Try to validate a collection
-            await self._db.validate_collection(collection_name)
-        except OperationFailure as operational_failure:  # If the collection doesn't exist
-            print(f"{collection_name} collection doesn't exist")
-            raise operational_failure
-        except TimeoutError as timeout_error:
-            print(traceback.format_exc())
-            raise timeout_error
+    async def setup(self, collections: Dict[str, List[str]] = None) -> None:
+        for collection_name, index_keys in (collections or COLLECTIONS).items():
+            await self.create_collection(collection_name)
+            if index_keys:
+                await self.create_indexes(collection_name, index_keys)
 
     async def create_collection(self, collection_name: str):
         try:
@@ -47,13 +82,17 @@ class MongoDB:
                 return
             raise invalid_collection_error
 
-    async def get_collection(self, collection_name: str):
-        await self.validate_collection(collection_name)
-        return self._db[collection_name]
+    async def get_collection(self, collection_name: str) -> AsyncIOMotorCollection:
+        connection = self._connection()
+        collection = connection.collections.get(collection_name)
+        if collection is None:
+            collection = connection.collections[collection_name] = connection.db[collection_name]
+        return collection
 
     async def create_indexes(self, collection_name: str, index_keys: List[str]):
         indexes = [IndexModel([index_key]) for index_key in index_keys]
-        return self._db.get_collection(collection_name).create_indexes(indexes)
+        collection = await self.get_collection(collection_name)
+        return await collection.create_indexes(indexes)
 
     async def insert_documents(self, collection_name: str, documents: List[Dict[str, Any]]) -> InsertManyResult:
         self.set_mongo_ids(documents)
@@ -74,21 +113,135 @@ class MongoDB:
         exclude_fields: tuple = (),
         find_one: bool = False,
         sort: list = None
-    ) -> list | Future:
+    ) -> list | Optional[dict]:
         collection = await self.get_collection(collection_name)
         fields = {field: False for field in exclude_fields}
         match find_one:
             case True:
-                return collection.find_one(query, fields or None, sort=sort)
+                return await collection.find_one(query, fields or None, sort=sort)
             case False:
                 return [
                     document async for document in collection.find(query, fields or None, sort=sort)
                 ]
 
-    async def update(self, collection_name: str, query: dict, data: dict, upsert: bool = False) -> None | UpdateResult:
+    async def update(self, collection_name: str, query: dict, data: dict, upsert: bool = False) -> UpdateResult:
         collection = await self.get_collection(collection_name)
-        return collection.update_one(
+        return await collection.update_one(
             query,
             {"$set": data},
             upsert=upsert,
         )
+
+
+@dataclass
+class BulkWriter:
+    """Write-behind buffer that groups inserts and `$set` updates into `bulk_write` calls.
+
+    Operations are buffered per collection and flushed when a collection has
+    `max_batch_size` pending operations or `max_delay` seconds after the
+    first buffered one. Every operation returns a future that resolves to
+    its batch's `BulkWriteResult` once acknowledged, so callers needing
+    read-your-writes await it. A collection's batches are written one at a
+    time, in order, so later updates to a document win; a failed operation
+    fails only its own future and the rest of its batch is still written.
+    """
+    db: MongoDB
+    max_batch_size: int = int(os.getenv("MONGO_BULK_MAX_BATCH_SIZE", "500"))
+    max_delay: float = float(os.getenv("MONGO_BULK_MAX_DELAY_MS", "20")) / 1000
+
+    def __post_init__(self):
+        self._pending: Dict[str, List[Tuple[Union[InsertOne, UpdateOne], asyncio.Future]]] = {}
+        self._timer: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+        # asyncio locks are FIFO, so a collection's batches are written in the order they were taken.
+        self._write_locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(batch) for batch in self._pending.values())
+
+    def _enqueue(self, collection_name: str, operation: Union[InsertOne, UpdateOne]) -> asyncio.Future:
+        future = get_running_loop().create_future()
+        batch = self._pending.setdefault(collection_name, [])
+        batch.append((operation, future))
+        if len(batch) >= self.max_batch_size:
+            self._start_flush(collection_name)
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+        return future
+
+    def insert(self, collection_name: str, **document: Any) -> asyncio.Future:
+        self.db.set_mongo_ids([document])
+        return self._enqueue(collection_name, InsertOne(document))
+
+    def update(self, collection_name: str, query: dict, data: dict, upsert: bool = False) -> asyncio.Future:
+        return self._enqueue(collection_name, UpdateOne(query, {"$set": data}, upsert=upsert))
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        # Operations buffered while this flush runs get a timer of their own.
+        self._timer = None
+        await self.flush()
+
+    def _start_flush(self, collection_name: str) -> asyncio.Task:
+        # Every flush is tracked, however it was started, so `close` can wait for it.
+        flush = asyncio.create_task(self._flush_collection(collection_name))
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+        return flush
+
+    async def flush(self) -> None:
+        await asyncio.gather(*(self._start_flush(collection_name) for collection_name in list(self._pending)))
+
+    @staticmethod
+    def _resolve(batch: List[Tuple[Union[InsertOne, UpdateOne], asyncio.Future]], result: Any) -> None:
+        for _, future in batch:
+            if not future.done():
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def _flush_collection(self, collection_name: str) -> None:
+        batch = self._pending.pop(collection_name, [])
+        if not batch:
+            return
+        METRICS.increment("db_write_operations_total", len(batch), help="Operations written through the bulk writer.")
+        async with self._write_locks.setdefault(collection_name, asyncio.Lock()):
+            await self._write_batch(collection_name, batch)
+
+    async def _write_batch(
+        self, collection_name: str, batch: List[Tuple[Union[InsertOne, UpdateOne], asyncio.Future]]
+    ) -> None:
+        while batch:
+            try:
+                collection = await self.db.get_collection(collection_name)
+                with METRICS.span("db_write"):
+                    result = await collection.bulk_write([operation for operation, _ in batch], ordered=True)
+            except BulkWriteError as bulk_write_error:
+                write_errors = bulk_write_error.details.get("writeErrors")
+                if not write_errors:
+                    # e.g. a write concern error: the writes may or may not have been applied.
+                    self._resolve(batch, bulk_write_error)
+                    return
+                # An ordered write stops at its first error; what came before it was applied.
+                error = write_errors[0]
+                failed = error["index"]
+                self._resolve(batch[:failed], BulkWriteResult(bulk_write_error.details, True))
+                self._resolve(batch[failed:failed + 1], OperationFailure(error.get("errmsg"), error.get("code")))
+                batch = batch[failed + 1:]
+                continue
+            except Exception as exc:
+                print(traceback.format_exc())
+                self._resolve(batch, exc)
+                return
+            self._resolve(batch, result)
+            return
+
+    async def close(self) -> None:
+        """Flush everything still buffered and wait for flushes in flight; called on shutdown."""
+        if self._timer is not None:
+            self._timer.cancel()
+        await self.flush()
+        while self._flushes:
+            await asyncio.gather(*list(self._flushes), return_exceptions=True)
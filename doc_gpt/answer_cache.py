@@ -0,0 +1,100 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    embedding: Optional[np.ndarray]
+    created_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class AnswerCache:
+    """LRU cache of LLM answers keyed by normalized prompt, with TTL and semantic near hits.
+
+    A lookup first tries the normalized prompt, then the cached entry whose
+    query embedding has the highest cosine similarity, if it is at least
+    `similarity_threshold`. Everything is dropped when the index version
+    changes.
+    """
+    max_entries: int = 512
+    ttl_seconds: float = 3600
+    similarity_threshold: float = 0.95
+
+    def __post_init__(self):
+        self._entries: OrderedDict[str, CachedAnswer] = OrderedDict()
+        self._lock = threading.Lock()
+        self._index_version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(prompt: str) -> str:
+        return re.sub(r"\s+", " ", prompt).strip().rstrip("?.!").strip().lower()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, index_version) -> None:
+        if index_version != self._index_version:
+            self._entries.clear()
+            self._index_version = index_version
+
+    def _evict_expired(self) -> None:
+        expires_before = time.time() - self.ttl_seconds
+        for key in [key for key, entry in self._entries.items() if entry.created_at < expires_before]:
+            del self._entries[key]
+
+    def get_exact(self, prompt: str, index_version) -> Optional[str]:
+        with self._lock:
+            self._check_version(index_version)
+            self._evict_expired()
+            key = self.normalize(prompt)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.answer
+
+    def get_similar(self, embedding: List[float], index_version) -> Optional[str]:
+        with self._lock:
+            self._check_version(index_version)
+            self._evict_expired()
+            keys = [key for key, entry in self._entries.items() if entry.embedding is not None]
+            if not keys or self.similarity_threshold <= 0:
+                self.misses += 1
+                return None
+            matrix = np.stack([self._entries[key].embedding for key in keys])
+            query = np.asarray(embedding, dtype=np.float32)
+            similarities = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(keys[best])
+            self.hits += 1
+            return self._entries[keys[best]].answer
+
+    def put(self, prompt: str, answer: str, index_version, embedding: List[float] = None) -> None:
+        with self._lock:
+            self._check_version(index_version)
+            key = self.normalize(prompt)
+            self._entries[key] = CachedAnswer(
+                answer=answer,
+                embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,136 @@
+import asyncio
+import traceback
+from dataclasses import dataclass, field
+from typing import List, Optional, Set, Tuple
+
+from langchain.docstore.document import Document
+
+from .engine import RetrievalEngine, get_engine
+from .llm_pool import TokenUsage
+from .sessions import merge_documents
+
+
+@dataclass
+class _QueryRequest:
+    question: str
+    future: asyncio.Future
+    chat_history: List[Tuple[str, str]] = field(default_factory=list)
+    history_summary: str = ""
+    documents: Optional[List[Document]] = None
+    usage: Optional[TokenUsage] = None
+    embedding: Optional[List[float]] = None
+    previous_documents: List[Document] = field(default_factory=list)
+
+
+@dataclass
+class QueryBatcher:
+    """Coalesces questions arriving within `max_wait` seconds into one retrieval batch.
+
+    A batch of up to `max_batch_size` questions is embedded in one forward
+    pass and searched in one vector store query. Generation then fans out per
+    question on the event loop, with at most `max_concurrent_generations`
+    Ollama requests in flight, and each caller's future resolves as soon as
+    its answer is ready.
+    """
+    max_batch_size: int = 16
+    max_wait: float = 0.005
+    max_concurrent_generations: int = 2
+    engine: Optional[RetrievalEngine] = None
+
+    def __post_init__(self):
+        self._pending: List[_QueryRequest] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def submit(
+        self,
+        question: str,
+        chat_history: List[Tuple[str, str]] = None,
+        history_summary: str = "",
+        documents: List[Document] = None,
+        usage: TokenUsage = None,
+        embedding: List[float] = None,
+        previous_documents: List[Document] = None,
+    ) -> Tuple[str, List[Document]]:
+        """Answer `question`, returning the answer and the documents it was generated from.
+
+        Passing `documents` skips retrieval, e.g. to reuse an earlier turn's context,
+        and passing the question's `embedding` skips embedding it again. Retrieved
+        documents are followed by `previous_documents` they don't already include.
+        The tokens spent are added to `usage`.
+        """
+        request = _QueryRequest(
+            question=question,
+            future=asyncio.get_running_loop().create_future(),
+            chat_history=chat_history or [],
+            history_summary=history_summary,
+            documents=documents,
+            usage=usage,
+            embedding=embedding,
+            previous_documents=previous_documents or [],
+        )
+        if documents is not None:
+            self._spawn(self._generate(self.engine or get_engine(), request))
+            return await request.future
+        self._pending.append(request)
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._dispatch_later())
+        return await request.future
+
+    async def _dispatch_later(self) -> None:
+        await asyncio.sleep(self.max_wait)
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        if batch:
+            self._spawn(self._run_batch(batch))
+        if self._pending and (self._timer is None or self._timer.done()):
+            self._timer = asyncio.create_task(self._dispatch_later())
+
+    async def _run_batch(self, batch: List[_QueryRequest]) -> None:
+        engine = self.engine or get_engine()
+        try:
+            documents_per_question = await asyncio.to_thread(
+                engine.retrieve_batch,
+                [request.question for request in batch],
+                [request.embedding for request in batch],
+            )
+        except Exception as exc:
+            print(traceback.format_exc())
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(exc)
+            return
+        print(f"Retrieved context for a batch of {len(batch)} questions")
+        for request, documents in zip(batch, documents_per_question):
+            request.documents = merge_documents(documents, request.previous_documents)
+            self._spawn(self._generate(engine, request))
+
+    async def _generate(self, engine: RetrievalEngine, request: _QueryRequest) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_generations)
+        try:
+            async with self._semaphore:
+                answer = await engine.agenerate(
+                    request.question,
+                    request.documents,
+                    request.chat_history,
+                    history_summary=request.history_summary,
+                    usage=request.usage,
+                )
+        except Exception as exc:
+            if not request.future.done():
+                request.future.set_exception(exc)
+            return
+        if not request.future.done():
+            request.future.set_result((answer, request.documents))
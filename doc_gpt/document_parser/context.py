@@ -0,0 +1,207 @@
+import re
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document
+
+from .config import get_env
+from .feature_store import TicketFeatureStore
+from .utils import COLUMNS_TO_EMBED, CONTEXT_COLUMNS, TIMESTAMP_SUFFIX
+
+FIELD_PATTERN = re.compile(rf"(?:^|,)({'|'.join(map(re.escape, COLUMNS_TO_EMBED))}): ")
+MAX_OVERLAP = 200
+
+
+@lru_cache(maxsize=1)
+def get_token_counter() -> Callable[[str], int]:
+    """Token counter for the generation model's tokenizer (`TOKENIZER_NAME`)."""
+    from tokenizers import Tokenizer
+
+    tokenizer_name = get_env("TOKENIZER_NAME", "mistralai/Mistral-7B-v0.1")
+    try:
+        tokenizer = Tokenizer.from_pretrained(tokenizer_name)
+    except Exception as exc:
+        # Keep answering without a tokenizer download, at the cost of a rougher budget.
+        print(f"Could not load tokenizer {tokenizer_name}: {exc}; estimating 4 characters per token")
+        return lambda text: (len(text) + 3) // 4
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+@dataclass
+class ContextReport:
+    chunks: int = 0
+    tickets: int = 0
+    tickets_dropped: int = 0
+    history_turns: int = 0
+    history_turns_summarized: int = 0
+    naive_tokens: int = 0
+    prompt_tokens: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.naive_tokens - self.prompt_tokens
+
+    def dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "saved_tokens": self.saved_tokens}
+
+
+def merge_overlapping(texts: Sequence[str]) -> str:
+    """Join chunk texts of one ticket, dropping duplicates and the text the splitter repeated between chunks."""
+    merged = ""
+    for text in texts:
+        text = text.strip()
+        if not text or text in merged:
+            continue
+        if merged in text:
+            merged = text
+            continue
+        overlap = next(
+            (size for size in range(min(len(merged), len(text), MAX_OVERLAP), 0, -1) if merged.endswith(text[:size])),
+            0,
+        )
+        if overlap:
+            merged += text[overlap:]
+        else:
+            leading = next(
+                (size for size in range(min(len(merged), len(text), MAX_OVERLAP), 0, -1) if text.endswith(merged[:size])),
+                0,
+            )
+            merged = text + merged[leading:] if leading else f"{merged}\n{text}"
+    return merged
+
+
+def _format_timestamp(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%A %d %B %Y, %H:%M UTC")
+
+
+def render_ticket(text: str, metadata: Dict[str, Any], columns: Sequence[str] = CONTEXT_COLUMNS) -> str:
+    """Render only `columns` of a ticket, with readable dates.
+
+    Values in `metadata` win over the chunk text, which a splitter may have
+    cut mid-field; the description only lives in the text.
+    """
+    matches = list(FIELD_PATTERN.finditer(text))
+    if not matches:
+        return text
+    # A ticket retrieved without its first chunk starts in the middle of a field.
+    fields = {"excerpt": text[:matches[0].start()].strip()}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        fields[match.group(1)] = text[match.end():next_match.start() if next_match else len(text)].strip()
+    lines = [f"excerpt: {fields['excerpt']}"] if fields["excerpt"] else []
+    for column in columns:
+        timestamp = metadata.get(f"{column}{TIMESTAMP_SUFFIX}")
+        if timestamp is not None:
+            lines.append(f"{column}: {_format_timestamp(timestamp)}")
+        elif metadata.get(column) not in (None, ""):
+            lines.append(f"{column}: {metadata[column]}")
+        elif fields.get(column):
+            lines.append(f"{column}: {fields[column]}")
+    return "\n".join(lines)
+
+
+def _truncate_to_budget(text: str, budget: int, count_tokens: Callable[[str], int]) -> str:
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def assemble_context(
+    documents: List[Document],
+    token_budget: int,
+    count_tokens: Callable[[str], int],
+    report: ContextReport,
+    features: TicketFeatureStore = None,
+) -> str:
+    """Merge retrieved chunks per ticket (in retrieval order) and keep whole tickets within `token_budget`.
+
+    A ticket's fields come from its `features` row when it has one, else from the chunk metadata.
+    """
+    tickets: Dict[Any, Tuple[List[str], Dict[str, Any]]] = {}
+    for index, document in enumerate(documents):
+        ticket_id = document.metadata.get("id", f"chunk-{index}")
+        if ticket_id not in tickets:
+            row = features.get(ticket_id) if features is not None and isinstance(ticket_id, int) else None
+            tickets[ticket_id] = ([], row or document.metadata)
+        tickets[ticket_id][0].append(document.page_content)
+
+    report.chunks = len(documents)
+    rendered, used_tokens = [], 0
+    for texts, metadata in tickets.values():
+        ticket_text = render_ticket(merge_overlapping(texts), metadata)
+        ticket_tokens = count_tokens(ticket_text)
+        if used_tokens + ticket_tokens > token_budget:
+            if rendered:
+                report.tickets_dropped += 1
+                continue
+            ticket_text = _truncate_to_budget(ticket_text, token_budget, count_tokens)
+            ticket_tokens = count_tokens(ticket_text)
+        rendered.append(ticket_text)
+        used_tokens += ticket_tokens
+    report.tickets = len(rendered)
+    return "\n\n".join(rendered)
+
+
+def assemble_history(
+    turns: Optional[List[Tuple[str, str]]],
+    token_budget: int,
+    count_tokens: Callable[[str], int],
+    report: ContextReport,
+    summary: str = "",
+) -> str:
+    """Keep the most recent (question, answer) turns that fit; older turns are reduced to their questions."""
+    turns = turns or []
+    report.history_turns = len(turns)
+    kept: List[str] = []
+    used_tokens = count_tokens(summary) if summary else 0
+    index = len(turns)
+    for question, answer in reversed(turns):
+        turn = f"User: {question}\nAssistant: {answer}"
+        turn_tokens = count_tokens(turn)
+        if used_tokens + turn_tokens > token_budget:
+            break
+        kept.insert(0, turn)
+        used_tokens += turn_tokens
+        index -= 1
+    older = turns[:index]
+    report.history_turns_summarized = len(older)
+    if older:
+        asked = "; ".join(question for question, _ in older)
+        summary = f"{summary} Earlier the user asked: {asked}".strip()
+        summary = _truncate_to_budget(summary, max(token_budget - used_tokens, 0), count_tokens)
+    return "\n".join(([f"Summary: {summary}"] if summary else []) + kept)
+
+
+def build_budgeted_prompt(
+    prompt_template,
+    question: str,
+    documents: List[Document],
+    chat_history: Optional[List[Tuple[str, str]]] = None,
+    history_summary: str = "",
+    features: TicketFeatureStore = None,
+) -> Tuple[str, ContextReport]:
+    """Format `prompt_template` with deduplicated, budgeted context and history."""
+    count_tokens = get_token_counter()
+    report = ContextReport()
+    context = assemble_context(
+        documents, int(get_env("CONTEXT_TOKEN_BUDGET", "1500")), count_tokens, report, features
+    )
+    history = assemble_history(
+        chat_history, int(get_env("HISTORY_TOKEN_BUDGET", "500")), count_tokens, report, history_summary
+    )
+    prompt = prompt_template.format(context=context, chat_history=history, question=question)
+    naive_history = "\n".join(f"User: {asked}\nAssistant: {answer}" for asked, answer in chat_history or [])
+    naive_prompt = prompt_template.format(
+        context="\n\n".join(document.page_content for document in documents),
+        chat_history=f"{history_summary}\n{naive_history}".strip(),
+        question=question,
+    )
+    report.naive_tokens = count_tokens(naive_prompt)
+    report.prompt_tokens = count_tokens(prompt)
+    return prompt, report
@@ -0,0 +1,288 @@
+import hashlib
+import os
+import threading
+from abc import abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from .config import get_env
+
+
+@dataclass
+class EmbeddingCache:
+    """Embeddings keyed by a hash of the chunk text.
+
+    Vectors live in a memory-mapped float32 matrix (`vectors.f32`) and the
+    hash -> row mapping in an append-only text file (`index.txt`), so adding
+    a batch only writes that batch.
+    """
+    directory: str
+    dimension: int
+    initial_capacity: int = 1024
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._matrix_path = os.path.join(self.directory, "vectors.f32")
+        self._index_path = os.path.join(self.directory, "index.txt")
+        self._index: Dict[str, int] = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as index_file:
+                for line in index_file:
+                    text_hash, row = line.split()
+                    self._index[text_hash] = int(row)
+        row_bytes = self.dimension * 4
+        capacity = os.path.getsize(self._matrix_path) // row_bytes if os.path.exists(self._matrix_path) else 0
+        self._open(max(capacity, self.initial_capacity, len(self._index)))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _open(self, capacity: int) -> None:
+        size = capacity * self.dimension * 4
+        with open(self._matrix_path, "ab") as matrix_file:
+            if matrix_file.tell() < size:
+                matrix_file.truncate(size)
+        self._capacity = capacity
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+
+    @staticmethod
+    def hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, text_hash: str) -> Optional[np.ndarray]:
+        # Under the lock since `put_many` closes and reopens the memmap when it grows.
+        with self._lock:
+            row = self._index.get(text_hash)
+            return None if row is None else np.array(self._matrix[row])
+
+    def put_many(self, text_hashes: List[str], vectors: np.ndarray) -> None:
+        with self._lock:
+            new = [(text_hash, vector) for text_hash, vector in zip(text_hashes, vectors) if text_hash not in self._index]
+            if not new:
+                return
+            first_row = len(self._index)
+            if first_row + len(new) > self._capacity:
+                self._matrix.flush()
+                del self._matrix
+                self._open(max(self._capacity * 2, first_row + len(new)))
+            for offset, (_, vector) in enumerate(new):
+                self._matrix[first_row + offset] = vector
+            self._matrix.flush()
+            # The index is only appended once the vectors are on disk, so a
+            # crash can at worst leave unused rows behind.
+            with open(self._index_path, "a") as index_file:
+                for offset, (text_hash, _) in enumerate(new):
+                    self._index[text_hash] = first_row + offset
+                    index_file.write(f"{text_hash} {first_row + offset}\n")
+
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+# Pre-exported ONNX graphs published alongside sentence-transformers models on the Hugging Face hub.
+ONNX_HUB_FILES = {
+    "onnx": ["onnx/model.onnx"],
+    "onnx-int8": ["onnx/model_qint8_avx512.onnx", "onnx/model_quint8_avx2.onnx"],
+}
+
+
+@dataclass
+class EmbeddingService(Embeddings):
+    """Batched embeddings with thread control and a disk cache, on top of a pluggable backend.
+
+    Drop-in replacement for `HuggingFaceEmbeddings`. Chunk texts already in
+    the cache are never re-encoded. Subclasses load the model in `_load`
+    and encode in `_encode`.
+    """
+    model_name: str
+    batch_size: int = 64
+    num_threads: Optional[int] = None
+    num_processes: int = 1
+    cache_directory: Optional[str] = None
+
+    backend = ""
+
+    def __post_init__(self):
+        self.dimension = self._load()
+        self._cache = EmbeddingCache(self.cache_directory, self.dimension) if self.cache_directory else None
+
+    @property
+    def identity(self) -> str:
+        """Model and backend, which together determine the vectors."""
+        return f"{self.model_name}@{self.backend}"
+
+    @abstractmethod
+    def _load(self) -> int:
+        """Load the model and return its embedding dimension."""
+
+    @abstractmethod
+    def _encode(self, texts: List[str], bulk: bool = False) -> np.ndarray:
+        """Encode `texts`; `bulk` marks large indexing batches that may use worker processes."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace("\n", " ") for text in texts]
+        if self._cache is None:
+            return self._encode(texts, bulk=True).astype(np.float32).tolist()
+
+        text_hashes = [EmbeddingCache.hash(text) for text in texts]
+        vectors = [self._cache.get(text_hash) for text_hash in text_hashes]
+        missing = [index for index, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self._encode([texts[index] for index in missing], bulk=True).astype(np.float32)
+            self._cache.put_many([text_hashes[index] for index in missing], encoded)
+            for index, vector in zip(missing, encoded):
+                vectors[index] = vector
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Encode questions in one forward pass, bypassing the chunk cache."""
+        texts = [text.replace("\n", " ") for text in texts]
+        return self._encode(texts).astype(np.float32).tolist()
+
+    def close(self) -> None:
+        pass
+
+
+@dataclass
+class TorchEmbeddingService(EmbeddingService):
+    """Full-precision sentence-transformers (PyTorch) embeddings.
+
+    When `num_processes` > 1 and enough texts miss the cache, they are
+    sharded over a pool of CPU worker processes.
+    """
+    _pool: Optional[dict] = field(default=None, init=False, repr=False)
+
+    backend = "torch"
+
+    def _load(self) -> int:
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str], bulk: bool = False) -> np.ndarray:
+        if bulk and self.num_processes > 1 and len(texts) >= self.batch_size * self.num_processes:
+            if self._pool is None:
+                self._pool = self._model.start_multi_process_pool(target_devices=["cpu"] * self.num_processes)
+            return self._model.encode_multi_process(texts, self._pool, batch_size=self.batch_size)
+        return self._model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+
+@dataclass
+class OnnxEmbeddingService(EmbeddingService):
+    """ONNX Runtime embeddings for mean-pooled, normalized sentence-transformers models such as the default.
+
+    Uses `onnx_path` if given, otherwise the ONNX export published with the
+    model on the Hugging Face hub. With `quantized`, an int8 graph is used
+    instead. PyTorch is never imported.
+    """
+    quantized: bool = False
+    onnx_path: Optional[str] = None
+    max_length: int = 256
+
+    @property
+    def backend(self) -> str:
+        return "onnx-int8" if self.quantized else "onnx"
+
+    @property
+    def repo_id(self) -> str:
+        return self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+
+    def _model_path(self) -> str:
+        if self.onnx_path:
+            return self.onnx_path
+        from huggingface_hub import hf_hub_download
+
+        errors = []
+        for filename in ONNX_HUB_FILES[self.backend]:
+            try:
+                return hf_hub_download(self.repo_id, filename)
+            except Exception as exc:
+                errors.append(f"{filename}: {exc}")
+        raise ValueError(
+            f"No {self.backend} export of {self.repo_id} found ({'; '.join(errors)}); "
+            f"set EMBEDDINGS_ONNX_PATH to a local model"
+        )
+
+    def _load(self) -> int:
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = onnxruntime.InferenceSession(
+            self._model_path(), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_pretrained(self.repo_id)
+        self._tokenizer.enable_truncation(max_length=self.max_length)
+        self._tokenizer.enable_padding()
+        return int(self._encode_batch(["dimension probe"]).shape[1])
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        token_embeddings = self._session.run(
+            None, {name: value for name, value in inputs.items() if name in self._input_names}
+        )[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def _encode(self, texts: List[str], bulk: bool = False) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        # Sorting by length keeps padding within each batch small.
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        encoded = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            encoded[batch] = self._encode_batch([texts[index] for index in batch])
+        return encoded
+
+
+def get_embedding_service(cache_root: str) -> EmbeddingService:
+    model_name = get_env("EMBEDDINGS_MODEL_NAME", "all-MiniLM-L6-v2")
+    backend = get_env("EMBEDDINGS_BACKEND", "torch")
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"EMBEDDINGS_BACKEND must be one of {EMBEDDING_BACKENDS}, got {backend!r}")
+    cache_directory = get_env("EMBEDDINGS_CACHE_DIR", os.path.join(cache_root, "embedding_cache"))
+    if cache_directory:
+        # Backends produce slightly different vectors, so each gets its own cache.
+        model_directory = model_name.replace("/", "__") + ("" if backend == "torch" else f"__{backend}")
+        cache_directory = os.path.join(cache_directory, model_directory)
+    num_threads = get_env("EMBEDDINGS_NUM_THREADS")
+    settings = dict(
+        model_name=model_name,
+        batch_size=int(get_env("EMBEDDINGS_BATCH_SIZE", "64")),
+        num_threads=int(num_threads) if num_threads else None,
+        cache_directory=cache_directory or None,
+    )
+    if backend == "torch":
+        return TorchEmbeddingService(num_processes=int(get_env("EMBEDDINGS_NUM_PROCESSES", "1")), **settings)
+    return OnnxEmbeddingService(
+        quantized=backend == "onnx-int8",
+        onnx_path=get_env("EMBEDDINGS_ONNX_PATH") or None,
+        max_length=int(get_env("EMBEDDINGS_MAX_LENGTH", "256")),
+        **settings,
+    )
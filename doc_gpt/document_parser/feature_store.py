@@ -0,0 +1,221 @@
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .utils import TIMESTAMP_FIELDS, TIMESTAMP_SUFFIX
+
+FEATURE_STORE_FILE_NAME = "ticket_features.npz"
+MISSING = -1
+INTEGER_COLUMNS = [
+    "id",
+    "assignee_id",
+    "brand_id",
+    "group_id",
+    "organization_id",
+    "requester_id",
+    "submitter_id",
+    "problem_id",
+    "forum_topic_id",
+    "custom_status_id",
+]
+# Dictionary encoded; values outside the initial vocabulary are appended as they show up.
+ENUM_VOCABULARIES = {
+    "status": ["new", "open", "pending", "hold", "solved", "closed"],
+    "priority": ["low", "normal", "high", "urgent"],
+    "type": ["question", "incident", "problem", "task"],
+    "channel": ["email", "web", "api"],
+}
+BOOLEAN_COLUMNS = ["is_public", "has_incidents", "allow_channelback", "allow_attachments", "from_messaging_channel"]
+TEXT_COLUMNS = ["subject", "url", "external_id"]
+
+
+def to_timestamp(value: Any) -> Optional[int]:
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_ticket(json_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """The ticket's filterable fields as Chroma-compatible scalars; missing, empty and nested values are dropped."""
+    row: Dict[str, Any] = {}
+    for column in INTEGER_COLUMNS:
+        value = json_dict.get(column)
+        if isinstance(value, int) and not isinstance(value, bool):
+            row[column] = value
+        elif isinstance(value, str) and value.isdigit():
+            row[column] = int(value)
+    for column in TIMESTAMP_FIELDS:
+        timestamp = to_timestamp(json_dict.get(column))
+        if timestamp is not None:
+            row[f"{column}{TIMESTAMP_SUFFIX}"] = timestamp
+    enums = {**json_dict, "channel": (json_dict.get("via") or {}).get("channel")}
+    for column in ENUM_VOCABULARIES:
+        if isinstance(enums.get(column), str) and enums[column]:
+            row[column] = enums[column]
+    for column in BOOLEAN_COLUMNS:
+        if isinstance(json_dict.get(column), bool):
+            row[column] = json_dict[column]
+    for column in TEXT_COLUMNS:
+        if isinstance(json_dict.get(column), str) and json_dict[column]:
+            row[column] = json_dict[column]
+    return row
+
+
+def get_feature_store_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, FEATURE_STORE_FILE_NAME)
+
+
+@dataclass
+class TicketFeatureStore:
+    """Typed columnar copy of every indexed ticket's normalized fields, one row per ticket.
+
+    Ids and timestamps are int64 arrays, enums int16 codes into a per-column
+    vocabulary, booleans int8, with -1 marking a missing value. It is kept
+    in step with the vector store by `sync_index` and read by the prompt
+    builder and the metadata filters, so tickets are parsed once at
+    ingestion.
+    """
+    path: str
+    initial_capacity: int = 1024
+
+    def __post_init__(self):
+        self.version = 0
+        self.clear()
+
+    def clear(self) -> None:
+        capacity = self.initial_capacity
+        self._rows: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._size = 0
+        self.vocabularies = {column: list(values) for column, values in ENUM_VOCABULARIES.items()}
+        self._codes = {column: {value: code for code, value in enumerate(values)} for column, values in self.vocabularies.items()}
+        self._numbers = {
+            **{column: np.full(capacity, MISSING, dtype=np.int64) for column in INTEGER_COLUMNS},
+            **{f"{column}{TIMESTAMP_SUFFIX}": np.full(capacity, MISSING, dtype=np.int64) for column in TIMESTAMP_FIELDS},
+            **{column: np.full(capacity, MISSING, dtype=np.int16) for column in ENUM_VOCABULARIES},
+            **{column: np.full(capacity, MISSING, dtype=np.int8) for column in BOOLEAN_COLUMNS},
+        }
+        self._text: Dict[str, List[str]] = {column: [""] * capacity for column in TEXT_COLUMNS}
+
+    @classmethod
+    def load(cls, path: str) -> "TicketFeatureStore":
+        store = cls(path)
+        if not os.path.exists(path):
+            return store
+        with np.load(path) as arrays:
+            ids = arrays["id"]
+            store.version = int(arrays["version"])
+            store.vocabularies = {column: arrays[f"vocabulary_{column}"].tolist() for column in ENUM_VOCABULARIES}
+            store._codes = {
+                column: {value: code for code, value in enumerate(values)} for column, values in store.vocabularies.items()
+            }
+            store._numbers = {column: arrays[column].copy() for column in store._numbers}
+            store._text = {column: arrays[column].tolist() for column in TEXT_COLUMNS}
+        store._size = len(ids)
+        store._rows = {int(ticket_id): row for row, ticket_id in enumerate(ids)}
+        return store
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        live = np.fromiter(sorted(self._rows.values()), dtype=np.int64, count=len(self._rows))
+        arrays = {column: values[live] for column, values in self._numbers.items()}
+        arrays.update({column: np.array([values[row] for row in live], dtype=str) for column, values in self._text.items()})
+        arrays.update({f"vocabulary_{column}": np.array(values, dtype=str) for column, values in self.vocabularies.items()})
+        temp_path = f"{self.path}.tmp.npz"
+        np.savez(temp_path, version=np.int64(self.version), **arrays)
+        os.replace(temp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, ticket_id: int) -> bool:
+        return int(ticket_id) in self._rows
+
+    def _grow(self, capacity: int) -> None:
+        for column, values in self._numbers.items():
+            grown = np.full(capacity, MISSING, dtype=values.dtype)
+            grown[:len(values)] = values
+            self._numbers[column] = grown
+        for values in self._text.values():
+            values.extend([""] * (capacity - len(values)))
+
+    def _encode(self, column: str, value: str) -> int:
+        code = self._codes[column].get(value)
+        if code is None:
+            code = self._codes[column][value] = len(self.vocabularies[column])
+            self.vocabularies[column].append(value)
+        return code
+
+    def upsert(self, row: Dict[str, Any]) -> None:
+        """Store a `normalize_ticket` row, replacing the ticket's previous one."""
+        ticket_id = int(row["id"])
+        index = self._rows.get(ticket_id)
+        if index is None:
+            if self._free:
+                index = self._free.pop()
+            else:
+                index = self._size
+                self._size += 1
+                if index >= len(self._numbers["id"]):
+                    self._grow(max(len(self._numbers["id"]) * 2, index + 1))
+            self._rows[ticket_id] = index
+        for column, values in self._numbers.items():
+            value = row.get(column)
+            if value is None:
+                values[index] = MISSING
+            elif column in self._codes:
+                values[index] = self._encode(column, value)
+            else:
+                values[index] = int(value)
+        for column, values in self._text.items():
+            values[index] = row.get(column, "")
+
+    def delete(self, ticket_id: int) -> None:
+        index = self._rows.pop(int(ticket_id), None)
+        if index is not None:
+            for values in self._numbers.values():
+                values[index] = MISSING
+            for values in self._text.values():
+                values[index] = ""
+            self._free.append(index)
+
+    def get(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        """The ticket's row decoded back to `normalize_ticket` form, or None."""
+        index = self._rows.get(int(ticket_id))
+        if index is None:
+            return None
+        row: Dict[str, Any] = {}
+        for column, values in self._numbers.items():
+            value = int(values[index])
+            if value == MISSING:
+                continue
+            if column in self.vocabularies:
+                row[column] = self.vocabularies[column][value]
+            elif column in BOOLEAN_COLUMNS:
+                row[column] = bool(value)
+            else:
+                row[column] = value
+        for column, values in self._text.items():
+            if values[index]:
+                row[column] = values[index]
+        return row
+
+    def column_types(self) -> Dict[str, str]:
+        """Self-query attribute type of every column that has at least one value."""
+        live = np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        types = {}
+        for column, values in self._numbers.items():
+            if not len(live) or not (values[live] != MISSING).any():
+                continue
+            if column in self.vocabularies:
+                types[column] = "string"
+            elif column in BOOLEAN_COLUMNS:
+                types[column] = "boolean"
+            else:
+                types[column] = "integer"
+        types.update({column: "string" for column, values in self._text.items() if any(values[row] for row in live)})
+        return types
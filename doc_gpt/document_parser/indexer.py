@@ -0,0 +1,229 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, Iterable, List
+
+from langchain.docstore.document import Document
+from langchain.vectorstores import Chroma
+
+from .config import get_env
+from .feature_store import TicketFeatureStore, normalize_ticket
+from .lexical_index import BM25Index
+
+MANIFEST_FILE_NAME = "ticket_manifest.json"
+
+
+@dataclass
+class IndexSyncReport:
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    chunks_upserted: int = 0
+    chunks_deleted: int = 0
+    version: int = 0
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+    def dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class TicketManifest:
+    """Persisted record of which ticket version is embedded and under which chunk ids."""
+    path: str
+
+    def __post_init__(self):
+        self.version = 0
+        self.schema_version = None
+        self.tickets: Dict[str, Dict[str, Any]] = {}
+        self.exists = os.path.exists(self.path)
+        if self.exists:
+            with open(self.path) as manifest_file:
+                manifest = json.load(manifest_file)
+            self.version = manifest.get("version", 0)
+            self.schema_version = manifest.get("schema_version")
+            self.tickets = manifest.get("tickets", {})
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(
+                {"version": self.version, "schema_version": self.schema_version, "tickets": self.tickets},
+                manifest_file,
+            )
+        os.replace(temp_path, self.path)
+        self.exists = True
+
+
+def get_manifest_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, MANIFEST_FILE_NAME)
+
+
+def get_chunk_ids(ticket_id: str, chunks: List[Document]) -> List[str]:
+    return [f"{ticket_id}:{index}" for index in range(len(chunks))]
+
+
+def _reset_untracked_collection(db: Chroma) -> int:
+    # A store built before the manifest existed has random chunk ids we can't
+    # map back to tickets, so it has to be re-embedded once.
+    existing_ids = db.get()["ids"]
+    if existing_ids:
+        db.delete(ids=existing_ids)
+    return len(existing_ids)
+
+
+def sync_index(
+    db: Chroma,
+    json_dicts: Iterable[Dict[str, Any]],
+    to_chunks: Callable[[Dict[str, Any], Dict[str, Any]], List[Document]],
+    manifest_path: str,
+    batch_size: int = None,
+    schema_version: int | str = None,
+    lexical_index: BM25Index = None,
+    feature_store: TicketFeatureStore = None,
+) -> IndexSyncReport:
+    """Bring `db` in line with `json_dicts`, embedding only new or changed tickets.
+
+    Tickets are matched on `id` and compared on `updated_at` against the
+    manifest at `manifest_path`. `json_dicts` is consumed lazily: chunks are
+    embedded and written in batches of `batch_size` before more tickets are
+    read. Tickets with status "deleted", and tickets missing from
+    `json_dicts`, have their chunks deleted. When `schema_version` differs
+    from the manifest's, every ticket is rebuilt.
+
+    Each changed ticket is normalized once (`normalize_ticket`); the row is
+    passed to `to_chunks` as the chunks' metadata and stored in
+    `feature_store`.
+
+    `lexical_index` receives the same upserts and deletes; if it was not in
+    step with the manifest it is rebuilt from the vector store afterwards.
+    A `feature_store` out of step is refilled from `json_dicts` as they are
+    read.
+    """
+    batch_size = batch_size or int(get_env("INDEX_BATCH_SIZE", "256"))
+    report = IndexSyncReport()
+    report.timings = {"read": 0.0, "added": 0.0, "updated": 0.0, "removed": 0.0}
+    manifest = TicketManifest(manifest_path)
+    if not manifest.exists:
+        report.chunks_deleted += _reset_untracked_collection(db)
+    schema_changed = manifest.schema_version != schema_version
+    manifest.schema_version = schema_version
+    lexical_in_step = lexical_index is not None and manifest.exists and lexical_index.version == manifest.version
+    lexical_mirror = lexical_index if lexical_in_step else None
+    features_in_step = (
+        feature_store is not None and manifest.exists and not schema_changed
+        and feature_store.version == manifest.version
+    )
+    if feature_store is not None and not features_in_step:
+        feature_store.clear()
+
+    seen_ids, added_ids = set(), set()
+    pending_chunks: List[Document] = []
+    pending_ids: List[str] = []
+    pending_kinds: List[str] = []
+    pending_tickets = set()
+
+    def flush() -> None:
+        if not pending_chunks:
+            return
+        start_time = time.time()
+        db.add_documents(pending_chunks, ids=pending_ids)
+        if lexical_mirror is not None:
+            lexical_mirror.add_documents(pending_ids, pending_chunks)
+        elapsed = time.time() - start_time
+        for kind in ("added", "updated"):
+            report.timings[kind] += elapsed * pending_kinds.count(kind) / len(pending_kinds)
+        report.chunks_upserted += len(pending_chunks)
+        pending_chunks.clear()
+        pending_ids.clear()
+        pending_kinds.clear()
+        pending_tickets.clear()
+
+    def delete_chunks(ticket_id: str) -> None:
+        if ticket_id in pending_tickets:
+            flush()
+        chunk_ids = manifest.tickets[ticket_id]["chunks"]
+        if feature_store is not None:
+            feature_store.delete(ticket_id)
+        if chunk_ids:
+            db.delete(ids=chunk_ids)
+            if lexical_mirror is not None:
+                lexical_mirror.delete(chunk_ids)
+        report.chunks_deleted += len(chunk_ids)
+
+    read_start_time = time.time()
+    for json_dict in json_dicts:
+        ticket_id = str(json_dict["id"])
+        seen_ids.add(ticket_id)
+        entry = manifest.tickets.get(ticket_id)
+        report.timings["read"] += time.time() - read_start_time
+
+        if json_dict.get("status") == "deleted":
+            start_time = time.time()
+            if entry:
+                delete_chunks(ticket_id)
+                del manifest.tickets[ticket_id]
+                report.removed += 1
+            report.timings["removed"] += time.time() - start_time
+        elif entry and not schema_changed and entry["updated_at"] == json_dict.get("updated_at"):
+            report.unchanged += 1
+            if feature_store is not None and not features_in_step:
+                feature_store.upsert(normalize_ticket(json_dict))
+        else:
+            kind = "updated" if entry else "added"
+            start_time = time.time()
+            if entry:
+                delete_chunks(ticket_id)
+            metadata = normalize_ticket(json_dict)
+            if feature_store is not None:
+                feature_store.upsert(metadata)
+            chunks = to_chunks(json_dict, metadata)
+            chunk_ids = get_chunk_ids(ticket_id, chunks)
+            manifest.tickets[ticket_id] = {"updated_at": json_dict.get("updated_at"), "chunks": chunk_ids}
+            pending_chunks.extend(chunks)
+            pending_ids.extend(chunk_ids)
+            pending_kinds.extend([kind] * len(chunks))
+            pending_tickets.add(ticket_id)
+            # A ticket repeated within one export only counts once.
+            if kind == "added":
+                added_ids.add(ticket_id)
+                report.added += 1
+            elif ticket_id not in added_ids:
+                report.updated += 1
+            report.timings[kind] += time.time() - start_time
+            if len(pending_chunks) >= batch_size:
+                flush()
+        read_start_time = time.time()
+    flush()
+
+    start_time = time.time()
+    for ticket_id in [ticket_id for ticket_id in manifest.tickets if ticket_id not in seen_ids]:
+        delete_chunks(ticket_id)
+        del manifest.tickets[ticket_id]
+        report.removed += 1
+    report.timings["removed"] += time.time() - start_time
+
+    if report.changed or schema_changed or not manifest.exists:
+        manifest.version += 1
+        manifest.save()
+    report.version = manifest.version
+
+    if lexical_index is not None and (lexical_index.version != manifest.version or lexical_mirror is None):
+        start_time = time.time()
+        if lexical_mirror is None:
+            lexical_index.rebuild_from_chroma(db)
+            report.timings["lexical_rebuild"] = time.time() - start_time
+        lexical_index.version = manifest.version
+        lexical_index.save()
+
+    if feature_store is not None and (feature_store.version != manifest.version or not features_in_step):
+        feature_store.version = manifest.version
+        feature_store.save()
+    return report
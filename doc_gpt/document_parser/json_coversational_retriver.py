@@ -1,90 +1,182 @@
 import json
 import os
-from typing import Dict, List, Any
+from typing import Dict, Any, Iterable, Iterator, TextIO, Tuple
 
 from langchain import PromptTemplate
 from langchain.chains import ConversationalRetrievalChain
 from langchain.docstore.document import Document
-from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
 from langchain.llms import Ollama
 from langchain.memory import ConversationBufferMemory
+from langchain.schema import BaseRetriever
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores import Chroma
 
 from .config import get_env
-from .utils import EXCLUDE_METADATA_FIELDS, COLUMNS_TO_EMBED, TEMPLATE
+from .embeddings import get_embedding_service
+from .feature_store import TicketFeatureStore, normalize_ticket
+from .indexer import IndexSyncReport, get_manifest_path, sync_index
+from .lexical_index import BM25Index
+from .utils import (
+    COLUMNS_TO_EMBED,
+    DOCUMENT_SCHEMA_VERSION,
+    TEMPLATE,
+)
 
+SOURCE_FILES_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'source_files'))
+SOURCE_FILE_PATH = get_env("SOURCE_FILE_PATH") or next(
+    (
+        path for path in (os.path.join(SOURCE_FILES_PATH, name) for name in ("zendesk.jsonl", "zendesk.json"))
+        if os.path.exists(path)
+    ),
+    os.path.join(SOURCE_FILES_PATH, "zendesk.json"),
+)
+CHROMA_DB_PATH = get_env("CHROMA_DB_PATH", "./chroma_db")
 
-def get_json_dict_list(filename: str) -> List[Dict[str, Any]]:
+
+def _iter_json_array(jsonfile: TextIO, chunk_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    # Incrementally decodes a top level JSON array so that only one element
+    # plus one read chunk is held in memory at a time.
+    decoder = json.JSONDecoder()
+    buffer, position = "", 0
+    opened, eof = False, False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer):
+            if not opened:
+                if buffer[position] != "[":
+                    raise ValueError(f"{jsonfile.name} is not a JSON array")
+                opened, position = True, position + 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                json_dict, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield json_dict
+                continue
+        if eof:
+            if opened:
+                raise ValueError(f"{jsonfile.name} ended before the JSON array was closed")
+            return
+        chunk = jsonfile.read(chunk_size)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+
+def iter_json_dicts(filename: str) -> Iterator[Dict[str, Any]]:
+    """Yield tickets one at a time from a JSON Lines export or a legacy JSON array file.
+
+    JSON Lines files may repeat a ticket id; records are yielded in file
+    order and consumers keep the last one.
+    """
     with open(filename) as jsonfile:
-        return json.load(jsonfile)
+        if filename.endswith(".jsonl"):
+            for line in jsonfile:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_json_array(jsonfile)
+
+
+def get_embedding_function() -> Embeddings:
+    return get_embedding_service(CHROMA_DB_PATH)
 
 
-def get_db(documents: List[Document]):
+def get_db(embedding_function: Embeddings = None, persist_directory: str = CHROMA_DB_PATH) -> Chroma:
     # return Chroma.from_documents(documents, GPT4AllEmbeddings())
-    file_path = "./chroma_db"
-    embedding_function = HuggingFaceEmbeddings(
-        model_name=get_env("EMBEDDINGS_MODEL_NAME", "all-MiniLM-L6-v2")
+    return Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding_function or get_embedding_function()
     )
-    print(os.path.exists(file_path))
-    if os.path.exists(file_path):
-        return Chroma(persist_directory=file_path, embedding_function=embedding_function)
-    return Chroma.from_documents(
-        documents,
-        embedding_function,
-        persist_directory=file_path
+
+
+def get_document_from_json_dict(json_dict: Dict[str, Any], metadata: Dict[str, Any] = None) -> Document:
+    """Embedding text of a ticket, with its `normalize_ticket` row (computed if not given) as metadata."""
+    to_embed = ",".join(
+        f"{k.strip()}: {v.strip() if isinstance(v, str) else v}"
+        for k, v in json_dict.items()
+        if k in COLUMNS_TO_EMBED
     )
+    to_embed += "\n"
+    return Document(page_content=to_embed, metadata=normalize_ticket(json_dict) if metadata is None else metadata)
 
 
-def get_documents_from_json(filename: str = None) -> List[Document]:
-    docs = []
-    for json_dict in get_json_dict_list(filename):
-        to_metadata = {}
-        values_to_embed = {}
-        for key, value in json_dict.items():
-            if key not in EXCLUDE_METADATA_FIELDS and value:
-                to_metadata[key] = value
-            if key in COLUMNS_TO_EMBED:
-                values_to_embed[key] = value
-        to_embed = ",".join(
-            f"{k.strip()}: {v.strip() if isinstance(v, str) else v}"
-            for k, v in values_to_embed.items()
-        )
-        to_embed += "\n"
-        docs.append(Document(page_content=to_embed, metadata=to_metadata))
-
-    return docs
-
-
-def load_json_dict_list_to_db(filename: str = None) -> Chroma:
-    splitter = CharacterTextSplitter(
+def get_text_splitter() -> CharacterTextSplitter:
+    return CharacterTextSplitter(
         separator="\n", chunk_size=490, chunk_overlap=50, length_function=len
     )
-    documents = splitter.split_documents(
-        get_documents_from_json(filename)
+
+
+def get_index_schema_version(embedding_function: Embeddings) -> str:
+    """Chunks are rebuilt when the document layout or the embedding model or backend changes."""
+    identity = getattr(embedding_function, "identity", type(embedding_function).__name__)
+    return f"{DOCUMENT_SCHEMA_VERSION}:{identity}"
+
+
+def load_json_dict_list_to_db(
+    filename: str = None,
+    embedding_function: Embeddings = None,
+    persist_directory: str = CHROMA_DB_PATH,
+    lexical_index: BM25Index = None,
+    feature_store: TicketFeatureStore = None,
+    json_dicts: Iterable[Dict[str, Any]] = None,
+) -> Tuple[Chroma, IndexSyncReport]:
+    """Sync the vector store in `persist_directory` with the tickets of `filename` (or `json_dicts`)."""
+    db = get_db(embedding_function, persist_directory)
+    splitter = get_text_splitter()
+    report = sync_index(
+        db,
+        iter_json_dicts(filename) if json_dicts is None else json_dicts,
+        lambda json_dict, metadata: splitter.split_documents([get_document_from_json_dict(json_dict, metadata)]),
+        get_manifest_path(persist_directory),
+        schema_version=get_index_schema_version(db._embedding_function),
+        lexical_index=lexical_index,
+        feature_store=feature_store,
     )
-    return get_db(documents)
+    print("Index sync:", report.dict())
+    return db, report
 
 
-def get_conversational_retriever_chain():
-    source_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'source_files/zendesk.json'))
-    print(source_file_path)
-    db = load_json_dict_list_to_db(source_file_path)
-    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-    llm = Ollama(
+def get_llm() -> Ollama:
+    return Ollama(
         model=get_env("MODEL", "mistral"),
+        base_url=get_env("OLLAMA_BASE_URL", "http://localhost:11434"),
         # verbose=True,
         # callback_manager=CallbackManager([]),
     )
-    print("=" * 50)
-    print("testing RetrievalQA")
-    prompt = PromptTemplate(
+
+
+def get_prompt() -> PromptTemplate:
+    return PromptTemplate(
         input_variables=["context", "chat_history", "question"],
         template=TEMPLATE
     )
+
+
+def get_memory() -> ConversationBufferMemory:
+    return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+
+
+def get_conversational_retriever_chain(
+    db: Chroma = None,
+    llm: Ollama = None,
+    prompt: PromptTemplate = None,
+    memory: ConversationBufferMemory = None,
+    retriever: BaseRetriever = None,
+):
+    if db is None and retriever is None:
+        print(SOURCE_FILE_PATH)
+        db, _ = load_json_dict_list_to_db(SOURCE_FILE_PATH)
+    print("=" * 50)
+    print("testing RetrievalQA")
     return ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=db.as_retriever(),
-        memory=memory,
-        combine_docs_chain_kwargs={"prompt": prompt}
+        llm=llm or get_llm(),
+        retriever=retriever or db.as_retriever(),
+        memory=memory or get_memory(),
+        combine_docs_chain_kwargs={"prompt": prompt or get_prompt()}
     )
@@ -0,0 +1,220 @@
+import heapq
+import math
+import os
+import pickle
+import re
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+from langchain.vectorstores import Chroma
+
+LEXICAL_INDEX_FILE_NAME = "bm25.pkl"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def get_lexical_index_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, LEXICAL_INDEX_FILE_NAME)
+
+
+@dataclass
+class BM25Index:
+    """In-process BM25 inverted index over chunk text.
+
+    Postings are kept per term as parallel `array('I')` doc numbers and
+    `array('H')` term frequencies. Removed or replaced chunks are tombstoned
+    and dropped the next time the index is compacted. `version` mirrors the
+    ticket manifest version the index was last synced to.
+    """
+    path: Optional[str] = None
+    k1: float = 1.2
+    b: float = 0.75
+
+    def __post_init__(self):
+        self.version: Optional[int] = None
+        self._chunk_ids: List[Optional[str]] = []
+        self._doc_numbers: Dict[str, int] = {}
+        self._doc_lengths = array("I")
+        self._terms: Dict[str, int] = {}
+        self._postings: List[array] = []
+        self._frequencies: List[array] = []
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_numbers)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls(path=path)
+        if os.path.exists(path):
+            with open(path, "rb") as index_file:
+                state = pickle.load(index_file)
+            index.__dict__.update(state)
+            index.path = path
+        return index
+
+    def save(self) -> None:
+        if self.tombstones > len(self) // 4:
+            self.compact()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as index_file:
+            state = {key: value for key, value in self.__dict__.items() if key != "path"}
+            pickle.dump(state, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    @property
+    def tombstones(self) -> int:
+        return len(self._chunk_ids) - len(self._doc_numbers)
+
+    def clear(self) -> None:
+        path, version = self.path, self.version
+        self.__post_init__()
+        self.path, self.version = path, version
+
+    def add(self, chunk_id: str, text: str) -> None:
+        self.remove(chunk_id)
+        doc_number = len(self._chunk_ids)
+        tokens = tokenize(text)
+        self._chunk_ids.append(chunk_id)
+        self._doc_numbers[chunk_id] = doc_number
+        self._doc_lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        for term, frequency in Counter(tokens).items():
+            term_number = self._terms.get(term)
+            if term_number is None:
+                term_number = self._terms[term] = len(self._postings)
+                self._postings.append(array("I"))
+                self._frequencies.append(array("H"))
+            self._postings[term_number].append(doc_number)
+            self._frequencies[term_number].append(min(frequency, 0xFFFF))
+
+    def add_documents(self, chunk_ids: List[str], documents: List[Document]) -> None:
+        for chunk_id, document in zip(chunk_ids, documents):
+            self.add(chunk_id, document.page_content)
+
+    def remove(self, chunk_id: str) -> None:
+        doc_number = self._doc_numbers.pop(chunk_id, None)
+        if doc_number is not None:
+            self._chunk_ids[doc_number] = None
+            self._total_length -= self._doc_lengths[doc_number]
+
+    def delete(self, chunk_ids: List[str]) -> None:
+        for chunk_id in chunk_ids:
+            self.remove(chunk_id)
+
+    def compact(self) -> None:
+        live = [
+            (chunk_id, self._doc_lengths[doc_number])
+            for doc_number, chunk_id in enumerate(self._chunk_ids) if chunk_id is not None
+        ]
+        renumber = {
+            old: new for new, old in enumerate(
+                doc_number for doc_number, chunk_id in enumerate(self._chunk_ids) if chunk_id is not None
+            )
+        }
+        terms, postings, frequencies = {}, [], []
+        for term, term_number in self._terms.items():
+            term_postings, term_frequencies = array("I"), array("H")
+            for doc_number, frequency in zip(self._postings[term_number], self._frequencies[term_number]):
+                if doc_number in renumber:
+                    term_postings.append(renumber[doc_number])
+                    term_frequencies.append(frequency)
+            if term_postings:
+                terms[term] = len(postings)
+                postings.append(term_postings)
+                frequencies.append(term_frequencies)
+        self._chunk_ids = [chunk_id for chunk_id, _ in live]
+        self._doc_numbers = {chunk_id: doc_number for doc_number, chunk_id in enumerate(self._chunk_ids)}
+        self._doc_lengths = array("I", (length for _, length in live))
+        self._terms, self._postings, self._frequencies = terms, postings, frequencies
+
+    def rebuild_from_chroma(self, db: Chroma, batch_size: int = 1000) -> None:
+        self.clear()
+        offset = 0
+        while True:
+            batch = db.get(include=["documents"], limit=batch_size, offset=offset)
+            for chunk_id, text in zip(batch["ids"], batch["documents"]):
+                self.add(chunk_id, text or "")
+            if len(batch["ids"]) < batch_size:
+                break
+            offset += batch_size
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        document_count = len(self)
+        if not document_count:
+            return []
+        average_length = self._total_length / document_count
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            term_number = self._terms.get(term)
+            if term_number is None:
+                continue
+            postings = self._postings[term_number]
+            # Tombstoned postings still count towards document frequency until compaction.
+            document_frequency = min(len(postings), document_count)
+            idf = math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            for doc_number, frequency in zip(postings, self._frequencies[term_number]):
+                if self._chunk_ids[doc_number] is None:
+                    continue
+                length_norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_number] / average_length)
+                scores[doc_number] = scores.get(doc_number, 0.0) + idf * frequency * (self.k1 + 1) / (
+                    frequency + length_norm
+                )
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self._chunk_ids[doc_number], score) for doc_number, score in best]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _to_documents(ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]) -> Dict[str, Document]:
+    return {
+        chunk_id: Document(page_content=text or "", metadata=metadata or {})
+        for chunk_id, text, metadata in zip(ids, texts, metadatas)
+    }
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses BM25 and vector rankings with reciprocal rank fusion."""
+    vectorstore: Chroma
+    lexical_index: BM25Index
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = self.vectorstore._embedding_function.embed_query(query)
+        vector_result = self.vectorstore._collection.query(
+            query_embeddings=[embedding],
+            n_results=self.fetch_k,
+            include=["documents", "metadatas"],
+        )
+        vector_ids = vector_result["ids"][0]
+        documents = _to_documents(vector_ids, vector_result["documents"][0], vector_result["metadatas"][0])
+        lexical_ids = [chunk_id for chunk_id, _ in self.lexical_index.search(query, self.fetch_k)]
+        fused_ids = [
+            chunk_id for chunk_id, _ in reciprocal_rank_fusion([vector_ids, lexical_ids], self.rrf_k)[:self.k]
+        ]
+        missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in documents]
+        if missing_ids:
+            result = self.vectorstore.get(ids=missing_ids)
+            documents.update(_to_documents(result["ids"], result["documents"], result["metadatas"]))
+        return [documents[chunk_id] for chunk_id in fused_ids if chunk_id in documents]
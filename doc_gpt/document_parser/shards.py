@@ -0,0 +1,384 @@
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.schema import BaseRetriever
+from langchain.vectorstores import Chroma
+
+from .config import get_env
+from .feature_store import TicketFeatureStore, get_feature_store_path
+from .indexer import IndexSyncReport, get_manifest_path
+from .json_coversational_retriver import CHROMA_DB_PATH, load_json_dict_list_to_db
+from .lexical_index import BM25Index, HybridRetriever, get_lexical_index_path
+
+PARTITION_KEYS = ("brand_id", "organization_id")
+SHARDS_DIRECTORY_NAME = "shards"
+# Tickets without a value for the partition key.
+UNASSIGNED_SHARD = "unassigned"
+
+
+def get_partition_key() -> Optional[str]:
+    """`INDEX_PARTITION_KEY`: the ticket field the index is sharded by, or None for a single index."""
+    partition_key = get_env("INDEX_PARTITION_KEY") or None
+    if partition_key is not None and partition_key not in PARTITION_KEYS:
+        raise ValueError(f"INDEX_PARTITION_KEY must be one of {PARTITION_KEYS}, got {partition_key!r}")
+    return partition_key
+
+
+def get_shard_name(value: Any) -> str:
+    if value is None or value == "":
+        return UNASSIGNED_SHARD
+    return re.sub(r"[^\w.-]", "_", str(value))
+
+
+def get_shards_directory(persist_directory: str, partition_key: str) -> str:
+    return os.path.join(persist_directory, SHARDS_DIRECTORY_NAME, partition_key)
+
+
+def _iter_shard_file(path: str, name: str, latest: Dict[Any, Tuple[str, int]]) -> Iterator[Dict[str, Any]]:
+    with open(path) as shard_file:
+        for line in shard_file:
+            position, json_dict = json.loads(line)
+            if latest.get(json_dict["id"]) == (name, position):
+                yield json_dict
+
+
+@contextmanager
+def split_by_shard(
+    json_dicts: Iterable[Dict[str, Any]], partition_key: str, names: Collection[str] = None
+) -> Iterator[Dict[str, Iterable[Dict[str, Any]]]]:
+    """Group tickets by shard (only the shards in `names`, if given), keeping the last record of each ticket id.
+
+    Tickets are streamed to one temporary JSON Lines file per shard, so only
+    each ticket's latest shard and position are held in memory. Reading a
+    shard skips records superseded later in the stream, so a ticket that
+    moved to another brand or organization is indexed in its new shard only
+    (and removed from the old one as unseen). The files are deleted on exit.
+    """
+    with tempfile.TemporaryDirectory(prefix="shards-") as directory:
+        latest: Dict[Any, Tuple[str, int]] = {}
+        paths: Dict[str, str] = {}
+        shard_files = {}
+        try:
+            for position, json_dict in enumerate(json_dicts):
+                name = get_shard_name(json_dict.get(partition_key))
+                latest[json_dict["id"]] = (name, position)
+                if names is not None and name not in names:
+                    continue
+                shard_file = shard_files.get(name)
+                if shard_file is None:
+                    paths[name] = os.path.join(directory, f"{len(paths)}.jsonl")
+                    shard_file = shard_files[name] = open(paths[name], "w")
+                shard_file.write(json.dumps([position, json_dict]) + "\n")
+        finally:
+            for shard_file in shard_files.values():
+                shard_file.close()
+        yield {name: _iter_shard_file(path, name, latest) for name, path in paths.items()}
+
+
+def shard_names_from_filter(where: Optional[Dict[str, Any]], partition_key: str) -> Optional[List[str]]:
+    """Shards a `where` clause restricts the partition key to, or None if it doesn't."""
+    if not where:
+        return None
+    conditions = where.get("$and", [where])
+    for condition in conditions:
+        value = condition.get(partition_key)
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            values = value.get("$in") or ([value["$eq"]] if "$eq" in value else None)
+            if values is None:
+                continue
+            return [get_shard_name(item) for item in values]
+        return [get_shard_name(value)]
+    return None
+
+
+@dataclass
+class IndexShard:
+    name: str
+    directory: str
+    db: Chroma
+    report: IndexSyncReport
+    feature_store: TicketFeatureStore
+    lexical_index: Optional[BM25Index] = None
+
+    def __post_init__(self):
+        self.size = self.db._collection.count()
+        self.retired = False
+        self._readers = 0
+        self._idle = threading.Condition()
+
+    @contextmanager
+    def reading(self) -> Iterator[bool]:
+        """Hold the shard open for a search; yields False if it was retired and must be skipped."""
+        with self._idle:
+            available = not self.retired
+            if available:
+                self._readers += 1
+        if not available:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with self._idle:
+                self._readers -= 1
+                self._idle.notify_all()
+
+    def retire(self) -> None:
+        """Refuse new searches and wait for those running, so the collection can be deleted."""
+        with self._idle:
+            self.retired = True
+            self._idle.wait_for(lambda: not self._readers)
+
+
+def load_shard(
+    name: str,
+    directory: str,
+    json_dicts: Iterable[Dict[str, Any]],
+    embedding_function: Embeddings,
+    lexical: bool = False,
+) -> IndexShard:
+    """Sync one shard's vector store (and its BM25 index and feature store) with its tickets."""
+    lexical_index = BM25Index.load(get_lexical_index_path(directory)) if lexical else None
+    feature_store = TicketFeatureStore.load(get_feature_store_path(directory))
+    db, report = load_json_dict_list_to_db(
+        embedding_function=embedding_function,
+        persist_directory=directory,
+        lexical_index=lexical_index,
+        feature_store=feature_store,
+        json_dicts=json_dicts,
+    )
+    return IndexShard(name, directory, db, report, feature_store, lexical_index)
+
+
+@dataclass
+class ShardedIndex:
+    """One Chroma collection per value of `partition_key`, each in its own directory with its own manifest.
+
+    Searches run on the shards a query is routed to, in parallel on a
+    thread pool (hnswlib releases the GIL), and the per-shard hits are
+    merged into one top-k.
+
+    `shards` is replaced rather than changed once the index is loaded, so
+    searches can read it without a lock while a shard is rebuilt.
+    """
+    partition_key: str
+    shards: Dict[str, IndexShard] = field(default_factory=dict)
+    max_workers: int = int(get_env("SHARD_SEARCH_WORKERS", "8"))
+
+    def __post_init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="shard-search")
+        # Bumped when a rebuild takes a shard out and again when it swaps the new one in: the fresh
+        # manifest starts the shard's version over, and the index version must never repeat.
+        self.generation = 0
+        self.closed = False
+        # Searches using the thread pool, so `close` can wait for them before shutting it down.
+        self._searches = 0
+        self._idle = threading.Condition()
+
+    def close(self) -> None:
+        """Retire every shard and shut the search pool down once the searches using it finish.
+
+        Searches holding the index after that skip its shards instead of failing.
+        """
+        with self._idle:
+            self.closed = True
+            self._idle.wait_for(lambda: not self._searches)
+        for shard in self.shards.values():
+            shard.retire()
+        self._executor.shutdown(wait=False)
+
+    @property
+    def version(self) -> Tuple[int, Tuple[Tuple[str, int], ...]]:
+        return self.generation, tuple(sorted((name, shard.report.version) for name, shard in self.shards.items()))
+
+    @property
+    def report(self) -> IndexSyncReport:
+        """The shards' sync reports added up."""
+        total = IndexSyncReport()
+        for shard in self.shards.values():
+            for report_field in fields(IndexSyncReport):
+                if report_field.name == "timings":
+                    for stage, seconds in shard.report.timings.items():
+                        total.timings[stage] = total.timings.get(stage, 0.0) + seconds
+                elif report_field.name == "version":
+                    total.version = max(total.version, shard.report.version)
+                else:
+                    name = report_field.name
+                    setattr(total, name, getattr(total, name) + getattr(shard.report, name))
+        return total
+
+    def column_types(self) -> Dict[str, str]:
+        types: Dict[str, str] = {}
+        for shard in self.shards.values():
+            types.update(shard.feature_store.column_types())
+        return types
+
+    def route(self, where: Optional[Dict[str, Any]] = None) -> List[IndexShard]:
+        """Non-empty shards a query with this `where` clause can match.
+
+        A partition key value with no shard falls back to every shard, like
+        an unmatched filter, so a misread id never leaves the LLM without context.
+        """
+        shards = self.shards
+        names = shard_names_from_filter(where, self.partition_key)
+        routed = [shards[name] for name in names or [] if name in shards]
+        return [shard for shard in routed or shards.values() if shard.size]
+
+    def _map(self, function: Callable[[IndexShard], Any], shards: List[IndexShard]) -> List[Any]:
+        with self._idle:
+            pooled = len(shards) > 1 and not self.closed
+            if pooled:
+                self._searches += 1
+        if not pooled:
+            return [function(shard) for shard in shards]
+        try:
+            return list(self._executor.map(function, shards))
+        finally:
+            with self._idle:
+                self._searches -= 1
+                self._idle.notify_all()
+
+    def search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        shards: List[IndexShard],
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """The `k` nearest chunks per query embedding across `shards`."""
+        return [
+            [document for _, _, document in hits]
+            for hits in self.search_hits(query_embeddings, k, shards, where)
+        ]
+
+    def search_hits(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        shards: List[IndexShard],
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Tuple[str, float, Document]]]:
+        """`search` as (chunk id, distance, document) triples."""
+
+        def query(shard: IndexShard) -> Optional[Dict[str, Any]]:
+            with shard.reading() as available:
+                if not available:
+                    return None
+                return shard.db._collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=min(k, shard.size),
+                    where=where or None,
+                    include=["documents", "metadatas", "distances"],
+                )
+
+        results = [result for result in self._map(query, shards) if result is not None]
+        merged = []
+        for index in range(len(query_embeddings)):
+            hits = [
+                (chunk_id, distance, Document(page_content=text, metadata=metadata or {}))
+                for result in results
+                for chunk_id, text, metadata, distance in zip(
+                    result["ids"][index],
+                    result["documents"][index],
+                    result["metadatas"][index],
+                    result["distances"][index],
+                )
+            ]
+            hits.sort(key=lambda hit: hit[1])
+            merged.append(hits[:k])
+        return merged
+
+    def hybrid_search(self, question: str, k: int, shards: List[IndexShard], fetch_k: int = 20) -> List[Document]:
+        """BM25 + vector fusion per shard; fused scores aren't comparable across shards, so ranks are interleaved."""
+
+        def search(shard: IndexShard) -> List[Document]:
+            with shard.reading() as available:
+                if not available:
+                    return []
+                return HybridRetriever(
+                    vectorstore=shard.db, lexical_index=shard.lexical_index, k=k, fetch_k=fetch_k
+                ).get_relevant_documents(question)
+
+        rankings = self._map(search, shards)
+        merged = []
+        for rank in range(k):
+            merged.extend(ranking[rank] for ranking in rankings if rank < len(ranking))
+        return merged[:k]
+
+    def rebuild(
+        self,
+        name: str,
+        json_dicts: Iterable[Dict[str, Any]],
+        embedding_function: Embeddings,
+        directory: str,
+    ) -> IndexShard:
+        """Drop shard `name`'s collection, manifest and side indexes and embed `json_dicts` into it from scratch.
+
+        The old shard is taken out of rotation first and deleted once the
+        searches already running on it finish; until the new one is swapped
+        in, searches skip it. Rebuilds of one index must not overlap.
+        """
+        shards = dict(self.shards)
+        shard = shards.pop(name, None)
+        # Results without the shard are cached under a version of their own.
+        self.generation += 1
+        self.shards = shards
+        lexical = shard is not None and shard.lexical_index is not None
+        if shard is not None:
+            shard.retire()
+            shard.db.delete_collection()
+        for path in (get_manifest_path(directory), get_lexical_index_path(directory), get_feature_store_path(directory)):
+            if os.path.exists(path):
+                os.remove(path)
+        shard = load_shard(name, directory, json_dicts, embedding_function, lexical)
+        self.generation += 1
+        self.shards = {**self.shards, name: shard}
+        return shard
+
+
+def load_sharded_index(
+    json_dicts: Iterable[Dict[str, Any]],
+    embedding_function: Embeddings,
+    partition_key: str,
+    persist_directory: str = CHROMA_DB_PATH,
+    lexical: bool = False,
+) -> ShardedIndex:
+    """Sync every shard with `json_dicts`; shards whose tickets are all gone are emptied."""
+    shards_directory = get_shards_directory(persist_directory, partition_key)
+    existing = [
+        name for name in (os.listdir(shards_directory) if os.path.isdir(shards_directory) else [])
+        if os.path.isdir(os.path.join(shards_directory, name))
+    ]
+    index = ShardedIndex(partition_key)
+    with split_by_shard(json_dicts, partition_key) as tickets_by_shard:
+        for name in sorted(set(tickets_by_shard) | set(existing)):
+            index.shards[name] = load_shard(
+                name,
+                os.path.join(shards_directory, name),
+                tickets_by_shard.get(name, []),
+                embedding_function,
+                lexical,
+            )
+    return index
+
+
+class ShardedRetriever(BaseRetriever):
+    """LangChain retriever over a `ShardedIndex`, delegating to a routing `retrieve` function."""
+    retrieve: Callable[[str], List[Document]]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.retrieve(query)
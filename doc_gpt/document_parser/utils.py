@@ -12,7 +12,13 @@ COLUMNS_TO_EMBED = [
     "url",
     "is_public",
 ]
-EXCLUDE_METADATA_FIELDS = ["via", "tags"]
+# Fields of COLUMNS_TO_EMBED the answer actually needs; the rest is left out of the prompt.
+CONTEXT_COLUMNS = ["subject", "status", "description", "url", "created_at", "updated_at"]
+# Stored in metadata as epoch seconds (under `<field>_ts`) so they can be range filtered.
+TIMESTAMP_FIELDS = ["created_at", "updated_at", "due_at"]
+TIMESTAMP_SUFFIX = "_ts"
+# Bump when the shape of indexed documents changes so existing chunks get rebuilt.
+DOCUMENT_SCHEMA_VERSION = 3
 TEMPLATE = """
 ### System:
 You are an respectful and honest assistant. You have to answer the user's \
@@ -0,0 +1,431 @@
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+from langchain.vectorstores import Chroma
+
+from .document_parser.config import get_env
+from .document_parser.context import ContextReport, build_budgeted_prompt
+from .document_parser.json_coversational_retriver import (
+    CHROMA_DB_PATH,
+    SOURCE_FILE_PATH,
+    get_embedding_function,
+    get_prompt,
+    iter_json_dicts,
+    load_json_dict_list_to_db,
+)
+from .document_parser.feature_store import TicketFeatureStore, get_feature_store_path
+from .document_parser.indexer import IndexSyncReport
+from .document_parser.lexical_index import BM25Index, HybridRetriever, get_lexical_index_path
+from .document_parser.shards import (
+    ShardedIndex,
+    ShardedRetriever,
+    get_partition_key,
+    get_shards_directory,
+    load_sharded_index,
+    split_by_shard,
+)
+from .llm_pool import OLLAMA_POOL, OllamaPool, TokenUsage
+from .metrics import METRICS, PROFILER
+from .retrieval_cache import RetrievalCache
+from .self_query_retriever.filters import build_where_filter
+from .self_query_retriever.retriever import MetadataFilteredRetriever
+from .self_query_retriever.utils import create_metadata_field_info_from_columns
+
+RETRIEVAL_MODES = ("vector", "filtered", "hybrid")
+# Candidates each side of a hybrid search contributes to the fusion, per result kept.
+HYBRID_FETCH_FACTOR = 5
+
+
+class _FirstTokenTimer:
+    """Records the time from the LLM call to its first streamed token (prefill latency)."""
+
+    def __init__(self):
+        self._start_time = time.perf_counter()
+        self._seen = False
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if not self._seen:
+            self._seen = True
+            METRICS.observe("llm_first_token", time.perf_counter() - self._start_time)
+
+
+@dataclass
+class RetrievalEngine:
+    """Process-wide holder of the embedder, vector store and prompt.
+
+    The expensive pieces are built once by `load` and reused by every query;
+    answers are generated by `agenerate` through `llm_pool`.
+    """
+    source_file_path: str = SOURCE_FILE_PATH
+    retrieval_mode: str = get_env("RETRIEVAL_MODE", "vector")
+    retrieval_k: int = int(get_env("RETRIEVAL_K", "4"))
+    partition_key: Optional[str] = get_partition_key()
+    llm_pool: OllamaPool = field(default_factory=lambda: OLLAMA_POOL)
+    retrieval_cache: RetrievalCache = field(
+        default_factory=lambda: RetrievalCache(
+            max_entries=int(get_env("RETRIEVAL_CACHE_MAX_ENTRIES", "2048")),
+            quantization_step=float(get_env("RETRIEVAL_CACHE_QUANTIZATION_STEP", "0.01")),
+        )
+    )
+    _lock: threading.RLock = field(default_factory=threading.RLock, init=False, repr=False)
+    # Serializes shard rebuilds and reloads; taken before `_lock`, never inside it.
+    _rebuild_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        self.embedding_function = None
+        self.db = None
+        self.prompt = None
+        self.index_report = None
+        self.retriever = None
+        self.lexical_index = None
+        self.feature_store = None
+        self.shards: Optional[ShardedIndex] = None
+        self.metadata_field_info = []
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"RETRIEVAL_MODE must be one of {RETRIEVAL_MODES}, got {self.retrieval_mode!r}")
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.db is not None or self.shards is not None
+
+    def load(self) -> "RetrievalEngine":
+        with self._lock:
+            if self.is_loaded:
+                return self
+            start_time = time.time()
+            self._load_models()
+            self._install(self._build_index())
+            print("Retrieval engine loaded in: ", time.time() - start_time)
+            return self
+
+    def _load_models(self) -> None:
+        if self.embedding_function is None:
+            self.embedding_function = get_embedding_function()
+        if self.prompt is None:
+            self.prompt = get_prompt()
+
+    def _build_index(self) -> Dict[str, Any]:
+        """Sync the vector store (or shards) and side indexes against the source file.
+
+        Nothing is assigned, so `reload` can build the next index while queries
+        use the current one; `_install` swaps it in.
+        """
+        if self.partition_key is not None:
+            shards = load_sharded_index(
+                iter_json_dicts(self.source_file_path),
+                self.embedding_function,
+                self.partition_key,
+                lexical=self.retrieval_mode == "hybrid",
+            )
+            # Filtered retrieval may filter on any column; otherwise only the partition key is read, for routing.
+            column_types = shards.column_types() if self.retrieval_mode == "filtered" else {}
+            print(f"Index shards by {self.partition_key}:", {name: shard.size for name, shard in shards.shards.items()})
+            return {
+                "shards": shards,
+                "index_report": shards.report,
+                "metadata_field_info": create_metadata_field_info_from_columns(
+                    {**column_types, self.partition_key: "integer"}
+                ),
+                "retriever": ShardedRetriever(retrieve=self.retrieve),
+            }
+        lexical_index = (
+            BM25Index.load(get_lexical_index_path(CHROMA_DB_PATH)) if self.retrieval_mode == "hybrid" else None
+        )
+        feature_store = TicketFeatureStore.load(get_feature_store_path(CHROMA_DB_PATH))
+        db, index_report = load_json_dict_list_to_db(
+            self.source_file_path,
+            self.embedding_function,
+            lexical_index=lexical_index,
+            feature_store=feature_store,
+        )
+        return {
+            "db": db,
+            "index_report": index_report,
+            "lexical_index": lexical_index,
+            "feature_store": feature_store,
+            "retriever": self._get_retriever(db, lexical_index, feature_store),
+        }
+
+    def _install(self, index: Dict[str, Any]) -> None:
+        """Swap in an index built by `_build_index`; an empty one unloads the engine. Call under `_lock`."""
+        self.db = index.get("db")
+        self.shards = index.get("shards")
+        self.index_report = index.get("index_report")
+        self.retriever = index.get("retriever")
+        self.lexical_index = index.get("lexical_index")
+        self.feature_store = index.get("feature_store")
+        self.metadata_field_info = index.get("metadata_field_info", [])
+
+    def rebuild_shard(self, shard_name: str) -> IndexSyncReport:
+        """Re-embed one shard from scratch, leaving the others untouched.
+
+        Runs outside the engine lock, so queries keep being answered (without
+        this shard) while it is re-embedded.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                self.load()
+                shards = self.shards
+            if shards is None:
+                raise ValueError("The index is not partitioned; set INDEX_PARTITION_KEY")
+            with split_by_shard(
+                iter_json_dicts(self.source_file_path), self.partition_key, names=[shard_name]
+            ) as tickets_by_shard:
+                if shard_name not in tickets_by_shard and shard_name not in shards.shards:
+                    raise KeyError(shard_name)
+                shard = shards.rebuild(
+                    shard_name,
+                    tickets_by_shard.get(shard_name, []),
+                    self.embedding_function,
+                    os.path.join(get_shards_directory(CHROMA_DB_PATH, self.partition_key), shard_name),
+                )
+            with self._lock:
+                self.index_report = shards.report
+                self.retrieval_cache.clear()
+            return shard.report
+
+    def _get_retriever(
+        self, db: Chroma, lexical_index: Optional[BM25Index], feature_store: TicketFeatureStore
+    ) -> BaseRetriever:
+        if self.retrieval_mode == "filtered" and len(feature_store):
+            return MetadataFilteredRetriever(
+                vectorstore=db,
+                metadata_field_info=create_metadata_field_info_from_columns(feature_store.column_types()),
+                search_kwargs={"k": self.retrieval_k},
+            )
+        if self.retrieval_mode == "hybrid":
+            return HybridRetriever(
+                vectorstore=db,
+                lexical_index=lexical_index,
+                k=self.retrieval_k,
+                fetch_k=HYBRID_FETCH_FACTOR * self.retrieval_k,
+            )
+        return db.as_retriever(search_kwargs={"k": self.retrieval_k})
+
+    @property
+    def index_version(self) -> int | Tuple | None:
+        if self.shards is not None:
+            return self.shards.version
+        return self.index_report.version if self.index_report else None
+
+    def invalidate(self) -> None:
+        # The embedder and prompt don't depend on the ticket corpus,
+        # so only the vector store is dropped; the next load re-syncs it
+        # incrementally against the source file.
+        with self._lock:
+            shards = self.shards
+            self._install({})
+            self.retrieval_cache.clear()
+        if shards is not None:
+            # Waits for searches that took their snapshot before the swap.
+            shards.close()
+
+    def reload(self) -> "RetrievalEngine":
+        """Re-sync the index against the source file.
+
+        The new index is built outside the engine lock, so queries keep being
+        answered from the current one until it is swapped in.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                if not self.is_loaded:
+                    return self.load()
+                self._load_models()
+            index = self._build_index()
+            with self._lock:
+                shards = self.shards
+                self._install(index)
+                self.retrieval_cache.clear()
+            if shards is not None:
+                shards.close()
+            return self
+
+    def embed_queries(
+        self, questions: List[str], known: List[Optional[List[float]]] = None
+    ) -> List[List[float]]:
+        """Embed `questions`, except those whose embedding is already `known` (e.g. from the answer cache)."""
+        embeddings = list(known) if known else [None] * len(questions)
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+        texts = [questions[index] for index in missing]
+        embed_queries = getattr(self.embedding_function, "embed_queries", None)
+        if embed_queries is not None:
+            computed = embed_queries(texts)
+        else:
+            computed = [self.embedding_function.embed_query(text) for text in texts]
+        for index, embedding in zip(missing, computed):
+            embeddings[index] = embedding
+        return embeddings
+
+    def retrieve_batch(
+        self, questions: List[str], query_embeddings: List[Optional[List[float]]] = None
+    ) -> List[List[Document]]:
+        """Retrieve context for several questions, embedding and searching them together when possible.
+
+        Questions with an embedding in `query_embeddings` aren't embedded again.
+        """
+        # One consistent view of the index: `reload` and `invalidate` swap these under the lock.
+        with self._lock:
+            self.load()
+            db, retriever, shards = self.db, self.retriever, self.shards
+            index_version, metadata_field_info = self.index_version, self.metadata_field_info
+        METRICS.increment("retrieval_batches_total", help="Retrieval batches run.")
+        METRICS.increment("retrieval_questions_total", len(questions), help="Questions retrieved for.")
+        with PROFILER.profile("retrieve"):
+            if shards is not None:
+                return self._retrieve_from_shards(
+                    shards, questions, query_embeddings, index_version, metadata_field_info
+                )
+            if self.retrieval_mode != "vector":
+                with METRICS.span("retrieve"):
+                    return [retriever.get_relevant_documents(question) for question in questions]
+            with METRICS.span("embed"):
+                query_embeddings = self.embed_queries(questions, query_embeddings)
+            return self._search_cached(
+                query_embeddings, lambda embeddings: self._search_hits(db, embeddings), index_version
+            )
+
+    def _search_hits(self, db, query_embeddings: List[List[float]]) -> List[List[Tuple[str, float, Document]]]:
+        result = db._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=self.retrieval_k,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [
+                (chunk_id, distance, Document(page_content=text, metadata=metadata or {}))
+                for chunk_id, text, metadata, distance in zip(*hits)
+            ]
+            for hits in zip(result["ids"], result["documents"], result["metadatas"], result["distances"])
+        ]
+
+    def _search_cached(
+        self,
+        query_embeddings: List[List[float]],
+        search: Callable[[List[List[float]]], List[List[Tuple[str, float, Document]]]],
+        index_version: Any,
+        scope: Any = None,
+    ) -> List[List[Document]]:
+        """Answer each embedding from the retrieval cache, running `search` only for the misses."""
+        cache = self.retrieval_cache
+        documents = [
+            cache.get(embedding, index_version, scope) if cache.enabled else None for embedding in query_embeddings
+        ]
+        missing = [index for index, cached in enumerate(documents) if cached is None]
+        if missing:
+            with METRICS.span("vector_search"):
+                results = search([query_embeddings[index] for index in missing])
+            for index, hits in zip(missing, results):
+                cache.put(query_embeddings[index], index_version, hits, scope)
+                documents[index] = [document for _, _, document in hits]
+        return documents
+
+    def _retrieve_from_shards(
+        self,
+        shards: ShardedIndex,
+        questions: List[str],
+        query_embeddings: List[Optional[List[float]]],
+        index_version: Any,
+        metadata_field_info: list,
+    ) -> List[List[Document]]:
+        # Questions naming a brand/organization are searched in that shard only, the rest in all shards at once.
+        wheres = [build_where_filter(question, metadata_field_info) for question in questions]
+        if self.retrieval_mode == "hybrid":
+            with METRICS.span("retrieve"):
+                return [
+                    shards.hybrid_search(
+                        question, self.retrieval_k, shards.route(where), HYBRID_FETCH_FACTOR * self.retrieval_k
+                    )
+                    for question, where in zip(questions, wheres)
+                ]
+        with METRICS.span("embed"):
+            query_embeddings = self.embed_queries(questions, query_embeddings)
+        documents: List[List[Document]] = [[] for _ in questions]
+        if self.retrieval_mode == "filtered":
+            with METRICS.span("vector_search"):
+                for index, where in enumerate(wheres):
+                    routed = shards.route(where)
+                    documents[index] = shards.search([query_embeddings[index]], self.retrieval_k, routed, where)[0]
+                    if where and not documents[index]:
+                        documents[index] = shards.search([query_embeddings[index]], self.retrieval_k, routed)[0]
+            return documents
+        groups: Dict[Tuple[str, ...], Tuple[list, List[int]]] = {}
+        for index, where in enumerate(wheres):
+            routed = shards.route(where)
+            groups.setdefault(tuple(shard.name for shard in routed), (routed, []))[1].append(index)
+        for names, (routed, indexes) in groups.items():
+            if not names:
+                continue
+            results = self._search_cached(
+                [query_embeddings[index] for index in indexes],
+                lambda embeddings: shards.search_hits(embeddings, self.retrieval_k, routed),
+                index_version,
+                scope=names,
+            )
+            for index, result in zip(indexes, results):
+                documents[index] = result
+        return documents
+
+    def retrieve(self, question: str, embedding: List[float] = None) -> List[Document]:
+        return self.retrieve_batch([question], [embedding])[0]
+
+    def build_prompt(
+        self,
+        question: str,
+        documents: List[Document],
+        chat_history: List[Tuple[str, str]] = None,
+        history_summary: str = "",
+    ) -> Tuple[str, ContextReport]:
+        # The CPU-bound part of generation; `agenerate` runs it in a worker thread, which cProfile can sample
+        # on its own, while the completion itself is awaited on the event loop.
+        with PROFILER.profile("prompt_build"):
+            return build_budgeted_prompt(
+                self.prompt, question, documents, chat_history, history_summary, features=self.feature_store
+            )
+
+    async def agenerate(
+        self,
+        question: str,
+        documents: List[Document],
+        chat_history: List[Tuple[str, str]] = None,
+        on_token: Callable[[str], None] = None,
+        history_summary: str = "",
+        usage: TokenUsage = None,
+    ) -> str:
+        """Answer `question` from `documents`: the prompt is built in a worker thread and completed by `llm_pool`.
+
+        The prompt and answer token counts are added to `usage`.
+        """
+        if not self.is_loaded:
+            await asyncio.to_thread(self.load)
+        with METRICS.span("prompt_build"):
+            prompt, report = await asyncio.to_thread(
+                self.build_prompt, question, documents, chat_history, history_summary
+            )
+        print("Prompt context:", report.dict())
+        METRICS.increment("prompt_tokens_total", report.prompt_tokens, help="Prompt tokens sent to the LLM.")
+        if usage is not None:
+            usage.prompt_tokens += report.prompt_tokens
+        first_token_timer = _FirstTokenTimer()
+
+        def forward(token: str) -> None:
+            first_token_timer.on_llm_new_token(token)
+            if on_token is not None:
+                on_token(token)
+
+        with METRICS.span("llm_completion"):
+            return await self.llm_pool.generate(prompt, on_token=forward, usage=usage)
+
+
+_engine = RetrievalEngine()
+
+
+def get_engine() -> RetrievalEngine:
+    return _engine
@@ -1,14 +1,195 @@
+import asyncio
+import json
 import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from .document_parser.json_coversational_retriver import get_conversational_retriever_chain
+from .answer_cache import AnswerCache
+from .batcher import QueryBatcher
+from .document_parser.config import get_env
+from .engine import get_engine
+from .llm_pool import OLLAMA_POOL, TokenUsage
+from .metrics import METRICS
+from .sessions import SessionStore, is_follow_up, merge_documents
 
+ANSWER_CACHE = AnswerCache(
+    max_entries=int(get_env("ANSWER_CACHE_MAX_ENTRIES", "512")),
+    ttl_seconds=float(get_env("ANSWER_CACHE_TTL_SECONDS", "3600")),
+    similarity_threshold=float(get_env("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")),
+)
+QUERY_BATCHER = QueryBatcher(
+    max_batch_size=int(get_env("QUERY_BATCH_MAX_SIZE", "16")),
+    max_wait=float(get_env("QUERY_BATCH_MAX_WAIT_MS", "5")) / 1000,
+    max_concurrent_generations=int(get_env("LLM_MAX_CONCURRENCY") or OLLAMA_POOL.capacity),
+)
 
-async def run_query_prompt(query: str = "show me tickets with 2fa issues.") -> str:
+SESSIONS = SessionStore(
+    max_sessions=int(get_env("SESSION_MAX", "1000")),
+    window=int(get_env("SESSION_WINDOW", "4")),
+    idle_seconds=float(get_env("SESSION_IDLE_SECONDS", "1800")),
+)
+
+_background_tasks = set()
+
+
+def _lookup_cached_answer(query: str) -> Tuple[Optional[str], Optional[List[float]]]:
+    engine = get_engine().load()
+    with METRICS.span("cache_lookup"):
+        answer = ANSWER_CACHE.get_exact(query, engine.index_version)
+        if answer is not None:
+            return answer, None
+        embedding = engine.embedding_function.embed_query(query)
+        return ANSWER_CACHE.get_similar(embedding, engine.index_version), embedding
+
+
+async def get_cached_answer(query: str) -> Tuple[Optional[str], Optional[List[float]]]:
+    """The cached answer to `query`; on a miss, None and the query embedding to pass to `run_query_prompt`."""
+    return await asyncio.to_thread(_lookup_cached_answer, query)
+
+
+async def run_query_prompt(
+    query: str = "show me tickets with 2fa issues.",
+    session_id: str = None,
+    usage: TokenUsage = None,
+    owner: str = "",
+    embedding: List[float] = None,
+) -> str:
+    """Answer `query`, within the conversation `session_id` (which must belong to `owner`) if given.
+
+    An `embedding` from a `get_cached_answer` miss skips the answer cache lookup.
+    """
     start_time = time.time()
     print(start_time)
-    qa_chain = get_conversational_retriever_chain()
-    chain_output = qa_chain({"question": query})
-    result = chain_output["answer"]
+    if session_id:
+        return await _run_session_query(query, session_id, start_time, usage, owner)
+    if embedding is None:
+        answer, embedding = await asyncio.to_thread(_lookup_cached_answer, query)
+        if answer is not None:
+            print("Answer cache hit, time taken: ", time.time() - start_time)
+            return answer
+    index_version = get_engine().index_version
+    # The embedding from the cache lookup is reused for retrieval rather than computed twice.
+    result, _ = await QUERY_BATCHER.submit(query, usage=usage, embedding=embedding)
+    ANSWER_CACHE.put(query, result, index_version, embedding)
     print(result)
     print("Total time taken: ", time.time() - start_time)
     return result
+
+
+async def _run_session_query(
+    query: str, session_id: str, start_time: float, usage: TokenUsage = None, owner: str = ""
+) -> str:
+    session = await SESSIONS.get(session_id, owner)
+    async with session.lock:
+        embedding = None
+        if not session.turns and not session.summary:
+            answer, embedding = await asyncio.to_thread(_lookup_cached_answer, query)
+            if answer is not None:
+                print("Answer cache hit, time taken: ", time.time() - start_time)
+                # The cached answer's tickets aren't known, so follow-ups search afresh.
+                await SESSIONS.record(session, query, answer, [])
+                return answer
+        documents = session.last_documents if session.last_documents and is_follow_up(query) else None
+        result, documents = await QUERY_BATCHER.submit(
+            query,
+            chat_history=list(session.turns),
+            history_summary=session.summary,
+            documents=documents,
+            usage=usage,
+            embedding=embedding,
+            previous_documents=session.last_documents,
+        )
+        await SESSIONS.record(session, query, result, documents)
+    print(result)
+    print("Total time taken: ", time.time() - start_time)
+    return result
+
+
+async def stream_query_prompt(
+    query: str,
+    on_complete: Callable[[str], Awaitable[None]] = None,
+    session_id: str = None,
+    usage: TokenUsage = None,
+    owner: str = "",
+) -> AsyncIterator[str]:
+    """Yield answer tokens as Ollama generates them.
+
+    `on_complete` is awaited with the full answer once generation finishes,
+    even if the consumer stops iterating early (e.g. the client disconnects).
+    With a `session_id` (owned by `owner`) the answer takes the session's
+    earlier turns and tickets into account, and follow-up questions reuse
+    the previous turn's tickets instead of searching.
+    """
+    session = await SESSIONS.get(session_id, owner) if session_id else None
+    if session is not None:
+        await session.lock.acquire()
+    lock_handed_off = False
+    try:
+        has_history = session is not None and bool(session.turns or session.summary)
+        answer, embedding = (None, None) if has_history else await asyncio.to_thread(_lookup_cached_answer, query)
+        if answer is not None:
+            if session is not None:
+                await SESSIONS.record(session, query, answer, [])
+            if on_complete:
+                await on_complete(answer)
+            yield answer
+            return
+
+        engine = get_engine()
+        index_version = engine.index_version
+        tokens: asyncio.Queue = asyncio.Queue()
+        end_of_stream = object()
+        chat_history = list(session.turns) if session else None
+        history_summary = session.summary if session else ""
+        previous_documents = session.last_documents if session is not None else []
+        reuse_documents = bool(previous_documents) and is_follow_up(query)
+
+        async def run_generation() -> Tuple[str, list]:
+            try:
+                if reuse_documents:
+                    documents = previous_documents
+                else:
+                    documents = await asyncio.to_thread(engine.retrieve, query, embedding)
+                    documents = merge_documents(documents, previous_documents)
+                answer = await engine.agenerate(
+                    query,
+                    documents,
+                    chat_history,
+                    on_token=tokens.put_nowait,
+                    history_summary=history_summary,
+                    usage=usage,
+                )
+                return answer, documents
+            finally:
+                tokens.put_nowait(end_of_stream)
+
+        async def finish(generation: Awaitable[Tuple[str, list]]) -> str:
+            try:
+                result, documents = await generation
+                if session is not None:
+                    await SESSIONS.record(session, query, result, documents)
+                else:
+                    ANSWER_CACHE.put(query, result, index_version, embedding)
+            finally:
+                if session is not None:
+                    session.lock.release()
+            if on_complete:
+                await on_complete(result)
+            return result
+
+        finish_task = asyncio.create_task(finish(run_generation()))
+        # From here on `finish` owns the session lock.
+        lock_handed_off = True
+        _background_tasks.add(finish_task)
+        finish_task.add_done_callback(_background_tasks.discard)
+    finally:
+        if session is not None and not lock_handed_off:
+            session.lock.release()
+
+    while (token := await tokens.get()) is not end_of_stream:
+        yield token
+    await asyncio.shield(finish_task)
+
+
+def format_sse(data: Dict[str, Any], event: str = None) -> str:
+    message = f"event: {event}\n" if event else ""
+    return f"{message}data: {json.dumps(data)}\n\n"
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import weakref
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from .document_parser.config import get_env
+from .metrics import METRICS
+
+_DONE = object()
+# Put on an attempt's queue once it holds a backend slot; its first-token deadline starts then.
+_STARTED = object()
+
+
+class OllamaError(Exception):
+    pass
+
+
+@dataclass
+class TokenUsage:
+    """Tokens a query cost; filled in as its prompt is built and its answer generated."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class OllamaBackend:
+    url: str
+    max_concurrency: int = 2
+
+    def __post_init__(self):
+        self.url = self.url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def load(self) -> float:
+        return self.outstanding / self.max_concurrency
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+@dataclass
+class OllamaPool:
+    """Async Ollama client spreading generations over several servers.
+
+    Requests go to the healthy backend with the fewest outstanding requests
+    relative to its `max_concurrency`, over one pooled `httpx.AsyncClient`
+    per event loop. A backend is ejected after `eject_after_failures`
+    consecutive failures (or a failed health check) and readmitted once
+    `GET /api/tags` answers again. A request with no token after
+    `hedge_after` seconds is duplicated on another backend and the first to
+    answer wins; one with no token `first_token_timeout` seconds after it
+    got a backend slot is retried, up to `max_attempts` in all. Time spent
+    waiting for a slot on a busy backend is not a failure. Once tokens have
+    been handed out a request is never retried, so callers never see
+    repeated text.
+    """
+    urls: List[str]
+    model: str = "mistral"
+    max_concurrency_per_backend: int = 2
+    first_token_timeout: float = 120
+    read_timeout: float = 60
+    hedge_after: float = 0
+    max_attempts: int = 2
+    eject_after_failures: int = 3
+    health_check_interval: float = 10
+    health_check_timeout: float = 2
+
+    def __post_init__(self):
+        self.backends = [OllamaBackend(url, self.max_concurrency_per_backend) for url in self.urls]
+        if not self.backends:
+            raise ValueError("OllamaPool needs at least one URL")
+        # httpx clients are bound to the loop they are first used on, so one is kept per loop.
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def capacity(self) -> int:
+        return sum(backend.max_concurrency for backend in self.backends)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=5),
+                limits=httpx.Limits(max_connections=self.capacity + len(self.backends)),
+            )
+        return client
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [backend.status() for backend in self.backends]
+
+    def start(self) -> None:
+        """Start the periodic health checks on the running loop (no-op if already running there)."""
+        task = self._health_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def _eject(self, backend: OllamaBackend, reason: Any) -> None:
+        if backend.healthy:
+            backend.healthy = False
+            METRICS.increment("llm_backend_ejections_total", help="Ollama backends taken out of rotation.")
+            print(f"Ejecting Ollama backend {backend.url}: {reason}")
+
+    def _record_failure(self, backend: OllamaBackend, error: Any) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.eject_after_failures:
+            self._eject(backend, error)
+
+    async def check_health(self, backend: OllamaBackend) -> bool:
+        try:
+            response = await self.client.get(f"{backend.url}/api/tags", timeout=self.health_check_timeout)
+            healthy = response.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        if not healthy:
+            self._eject(backend, "health check failed")
+        elif not backend.healthy:
+            backend.healthy = True
+            backend.consecutive_failures = 0
+            print(f"Readmitting Ollama backend {backend.url}")
+        return healthy
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self.check_health(backend) for backend in self.backends))
+            await asyncio.sleep(self.health_check_interval)
+
+    def _pick(self, tried: Set[str]) -> OllamaBackend:
+        # Ejected or already tried backends are only used when nothing else is left.
+        candidates = [backend for backend in self.backends if backend.url not in tried] or self.backends
+        candidates = [backend for backend in candidates if backend.healthy] or candidates
+        return min(candidates, key=lambda backend: (backend.load, backend.requests))
+
+    async def _stream(self, backend: OllamaBackend, payload: Dict[str, Any], queue: asyncio.Queue) -> None:
+        """Put `_STARTED` and the backend's tokens on `queue`, then `_DONE` or the error that ended the stream."""
+        try:
+            async with backend.semaphore:
+                queue.put_nowait(_STARTED)
+                async with self.client.stream("POST", f"{backend.url}/api/generate", json=payload) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        raise OllamaError(f"{backend.url} answered {response.status_code}: {body[:200]!r}")
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise OllamaError(f"{backend.url}: {chunk['error']}")
+                        if chunk.get("response"):
+                            queue.put_nowait(chunk["response"])
+                        if chunk.get("done"):
+                            break
+            backend.consecutive_failures = 0
+            queue.put_nowait(_DONE)
+        except (httpx.HTTPError, OllamaError, ValueError) as exc:
+            self._record_failure(backend, exc)
+            queue.put_nowait(exc)
+
+    async def _first_response(
+        self, payload: Dict[str, Any], tried: Set[str]
+    ) -> Tuple[asyncio.Task, asyncio.Queue, Any]:
+        """Start the request (hedging it if slow) and return the winning attempt and its first item."""
+        loop = asyncio.get_running_loop()
+        attempts: Dict[asyncio.Task, Tuple[OllamaBackend, asyncio.Queue]] = {}
+        getters: Dict[asyncio.Task, asyncio.Task] = {}
+        # When each attempt got its backend slot; only from then on can it time out.
+        started_at: Dict[asyncio.Task, float] = {}
+
+        def launch() -> None:
+            backend = self._pick(tried)
+            tried.add(backend.url)
+            # Counted from the moment it is picked so concurrent picks see each other.
+            backend.outstanding += 1
+            backend.requests += 1
+            queue: asyncio.Queue = asyncio.Queue()
+            attempt = asyncio.create_task(self._stream(backend, payload, queue))
+            attempt.add_done_callback(lambda _: setattr(backend, "outstanding", backend.outstanding - 1))
+            attempts[attempt] = (backend, queue)
+            getters[asyncio.create_task(queue.get())] = attempt
+
+        winner = None
+        start_time = loop.time()
+        launch()
+        try:
+            error: Optional[Exception] = None
+            while getters:
+                can_hedge = (
+                    self.hedge_after > 0 and len(attempts) == 1
+                    and any(backend.healthy and backend.url not in tried for backend in self.backends)
+                )
+                # Waiting for a slot doesn't count: the deadline runs from the first attempt to get one.
+                deadline = min(started_at.values()) + self.first_token_timeout if started_at else None
+                wake_times = [] if deadline is None else [deadline]
+                if can_hedge:
+                    wake_times.append(start_time + self.hedge_after)
+                timeout = max(min(wake_times) - loop.time(), 0) if wake_times else None
+                done, _ = await asyncio.wait(getters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if can_hedge and (deadline is None or loop.time() < deadline):
+                        METRICS.increment(
+                            "llm_hedged_requests_total", help="Generations duplicated on a second backend."
+                        )
+                        launch()
+                        continue
+                    for attempt, (backend, _) in attempts.items():
+                        if attempt in started_at:
+                            self._record_failure(backend, "no response in time")
+                    raise asyncio.TimeoutError(f"No response within {self.first_token_timeout} seconds")
+                for getter in done:
+                    attempt = getters.pop(getter)
+                    item = getter.result()
+                    if item is _STARTED:
+                        started_at[attempt] = loop.time()
+                        getters[asyncio.create_task(attempts[attempt][1].get())] = attempt
+                    elif isinstance(item, Exception):
+                        error = item
+                    elif winner is None:
+                        winner = (attempt, attempts[attempt][1], item)
+                if winner is not None:
+                    return winner
+            raise error
+        finally:
+            for getter in getters:
+                getter.cancel()
+            for attempt in attempts:
+                if winner is None or attempt is not winner[0]:
+                    attempt.cancel()
+
+    async def generate(
+        self, prompt: str, on_token: Callable[[str], None] = None, usage: TokenUsage = None
+    ) -> str:
+        """Complete `prompt`, calling `on_token` with each token as it streams in.
+
+        Ollama streams one token per chunk, so `usage.completion_tokens` is the chunk count.
+        """
+        self.start()
+        payload = {"model": self.model, "prompt": prompt, "stream": True}
+        tried: Set[str] = set()
+        error: Optional[Exception] = None
+        for attempt_number in range(self.max_attempts):
+            if attempt_number:
+                METRICS.increment("llm_retries_total", help="Generations retried on another backend.")
+            try:
+                attempt, queue, item = await self._first_response(payload, tried)
+            except (httpx.HTTPError, OllamaError, ValueError, asyncio.TimeoutError) as exc:
+                print(f"Ollama attempt {attempt_number + 1} failed: {exc}")
+                error = exc
+                continue
+            try:
+                tokens = []
+                while item is not _DONE:
+                    if isinstance(item, Exception):
+                        raise item
+                    tokens.append(item)
+                    if on_token:
+                        on_token(item)
+                    item = await queue.get()
+                if usage is not None:
+                    usage.completion_tokens += len(tokens)
+                return "".join(tokens)
+            finally:
+                attempt.cancel()
+        raise OllamaError(f"Generation failed after {self.max_attempts} attempts: {error}") from error
+
+
+def get_ollama_urls() -> List[str]:
+    """`OLLAMA_URLS` (comma separated), else the single `OLLAMA_BASE_URL`."""
+    urls = get_env("OLLAMA_URLS") or get_env("OLLAMA_BASE_URL", "http://localhost:11434")
+    return [url.strip() for url in urls.split(",") if url.strip()]
+
+
+OLLAMA_POOL = OllamaPool(
+    urls=get_ollama_urls(),
+    model=get_env("MODEL", "mistral"),
+    max_concurrency_per_backend=int(get_env("OLLAMA_MAX_CONCURRENCY", "2")),
+    first_token_timeout=float(get_env("OLLAMA_FIRST_TOKEN_TIMEOUT", "120")),
+    read_timeout=float(get_env("OLLAMA_READ_TIMEOUT", "60")),
+    hedge_after=float(get_env("OLLAMA_HEDGE_AFTER_MS", "0")) / 1000,
+    max_attempts=int(get_env("OLLAMA_MAX_ATTEMPTS", "2")),
+    eject_after_failures=int(get_env("OLLAMA_EJECT_AFTER_FAILURES", "3")),
+    health_check_interval=float(get_env("OLLAMA_HEALTH_CHECK_INTERVAL", "10")),
+)
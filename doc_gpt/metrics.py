@@ -0,0 +1,170 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .document_parser.config import get_env
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+@dataclass
+class Histogram:
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += count
+            yield bound, total
+
+
+@dataclass
+class MetricsRegistry:
+    """Per-stage latency histograms, counters and callback gauges rendered in the Prometheus text format.
+
+    Stages are timed with `span`, which is safe to use from worker threads.
+    Gauges are read when `/metrics` is scraped, so they cost nothing between
+    scrapes.
+    """
+    namespace: str = "docgpt"
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._counters: Dict[str, float] = {}
+        self._help: Dict[str, str] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def increment(self, name: str, value: float = 1, help: str = "") -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def gauge(self, name: str, read: Callable[[], float], help: str = "") -> None:
+        self._gauges[name] = read
+        if help:
+            self._help[name] = help
+
+    def render(self) -> str:
+        name = f"{self.namespace}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each stage of the query path.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                for bound, total in histogram.cumulative():
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {total}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+            counters = dict(self._counters)
+        for counter, value in sorted(counters.items()):
+            lines += self._header(counter, "counter") + [f"{self.namespace}_{counter} {value}"]
+        for gauge, read in sorted(self._gauges.items()):
+            try:
+                value = float(read())
+            except Exception:
+                continue
+            lines += self._header(gauge, "gauge") + [f"{self.namespace}_{gauge} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str, kind: str) -> List[str]:
+        help = self._help.get(name)
+        return ([f"# HELP {self.namespace}_{name} {help}"] if help else []) + [f"# TYPE {self.namespace}_{name} {kind}"]
+
+
+@dataclass
+class SlowRequestProfiler:
+    """Opt-in cProfile sampling of slow work.
+
+    A `sample_rate` fraction of `profile` blocks run under cProfile; the
+    ones slower than `threshold` seconds have their stats written to
+    `directory` and their top functions printed.
+    """
+    threshold: Optional[float] = None
+    sample_rate: float = 0.1
+    directory: str = "./profiles"
+    top: int = 20
+    _written: int = field(default=0, init=False)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another block is already being profiled (one profiler at a time on Python 3.12+).
+            yield
+            return
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= self.threshold:
+                self._report(name, profiler, elapsed)
+
+    def _report(self, name: str, profiler: cProfile.Profile, elapsed: float) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._written}.prof")
+        self._written += 1
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(self.top)
+        print(f"Slow {name} ({elapsed:.2f}s), profile saved to {path}\n{summary.getvalue()}")
+
+
+def get_profiler() -> SlowRequestProfiler:
+    threshold_ms = get_env("PROFILE_SLOW_MS")
+    return SlowRequestProfiler(
+        threshold=float(threshold_ms) / 1000 if threshold_ms else None,
+        sample_rate=float(get_env("PROFILE_SAMPLE_RATE", "0.1")),
+        directory=get_env("PROFILE_DIR", "./profiles"),
+    )
+
+
+METRICS = MetricsRegistry()
+PROFILER = get_profiler()
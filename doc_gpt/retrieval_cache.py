@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+# (chunk id, distance) pairs in rank order.
+Hits = List[Tuple[str, float]]
+
+
+@dataclass
+class RetrievalCache:
+    """LRU cache of vector search results keyed by quantized query embedding.
+
+    Embeddings are rounded to multiples of `quantization_step`, so the same
+    question (or one differing only in float noise) maps to the same key.
+    Entries hold chunk ids and distances; the chunks themselves live once in
+    an id -> Document map shared by all entries and are dropped when no
+    entry refers to them. Everything is dropped when the index version
+    changes.
+    """
+    max_entries: int = 2048
+    quantization_step: float = 0.01
+
+    def __post_init__(self):
+        self._entries: OrderedDict[Tuple[Hashable, bytes], Hits] = OrderedDict()
+        self._documents: Dict[str, Document] = {}
+        self._references: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._index_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def documents(self) -> int:
+        return len(self._documents)
+
+    def key(self, embedding: List[float], scope: Hashable = None) -> Tuple[Hashable, bytes]:
+        quantized = np.rint(np.asarray(embedding, dtype=np.float32) / self.quantization_step).astype(np.int16)
+        return scope, quantized.tobytes()
+
+    def _check_version(self, index_version: Any) -> None:
+        if index_version != self._index_version:
+            self._entries.clear()
+            self._documents.clear()
+            self._references.clear()
+            self._index_version = index_version
+
+    def _release(self, hits: Hits) -> None:
+        for chunk_id, _ in hits:
+            self._references[chunk_id] -= 1
+            if not self._references[chunk_id]:
+                del self._references[chunk_id]
+                del self._documents[chunk_id]
+
+    def get(self, embedding: List[float], index_version: Any, scope: Hashable = None) -> Optional[List[Document]]:
+        """The cached documents for `embedding` in rank order, or None.
+
+        `scope` separates searches whose results differ for the same
+        embedding, e.g. searches routed to different index shards.
+        """
+        with self._lock:
+            self._check_version(index_version)
+            key = self.key(embedding, scope)
+            hits = self._entries.get(key)
+            if hits is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [self._documents[chunk_id] for chunk_id, _ in hits]
+
+    def put(
+        self,
+        embedding: List[float],
+        index_version: Any,
+        results: List[Tuple[str, float, Document]],
+        scope: Hashable = None,
+    ) -> None:
+        """Cache search `results` as (chunk id, distance, document) triples."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_version(index_version)
+            key = self.key(embedding, scope)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._release(previous)
+            for chunk_id, _, document in results:
+                self._documents.setdefault(chunk_id, document)
+                self._references[chunk_id] = self._references.get(chunk_id, 0) + 1
+            self._entries[key] = [(chunk_id, distance) for chunk_id, distance, _ in results]
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._release(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._documents.clear()
+            self._references.clear()
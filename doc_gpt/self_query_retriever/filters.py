@@ -0,0 +1,116 @@
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from langchain.chains.query_constructor.schema import AttributeInfo
+
+from ..document_parser.utils import TIMESTAMP_SUFFIX
+
+TICKET_NOUN = r"(?:tickets?|requests?|cases?)"
+STATUS_WORDS = {
+    "new": r"new",
+    "open": r"open",
+    "pending": r"pending",
+    "hold": r"on[- ]hold",
+    "solved": r"solved|resolved",
+    "closed": r"closed",
+}
+ANY_STATUS_WORD = "|".join(STATUS_WORDS.values())
+
+
+def _status_pattern(word: str) -> str:
+    """`word` only where it describes tickets, so "can't open the app" or "a new user" isn't a filter."""
+    return "|".join((
+        # "open tickets", also as part of a list: "solved or closed tickets".
+        rf"\b(?:{word})(?:\s*(?:,|or|and)\s*(?:{ANY_STATUS_WORD}))*\s+(?:tickets|requests|cases)\b",
+        rf"\bstatus\s*(?:is\s+|of\s+|=\s*|:\s*)?(?:{word})\b",
+        rf"\b(?:{word})\s+status\b",
+        rf"\b{TICKET_NOUN}\s+(?:(?:that|which)\s+(?:are|were|is|was|ha(?:ve|s) been)\s+"
+        rf"|(?:still|currently|marked(?: as)?|set to)\s+)?(?:{word})\b",
+    ))
+
+
+STATUS_PATTERNS = {status: _status_pattern(word) for status, word in STATUS_WORDS.items()}
+PRIORITY_PATTERN = r"\b(low|normal|high|urgent)\b(?:[- ]priority\b)|\bpriority (?:is |of )?(low|normal|high|urgent)\b"
+DATE_PATTERN = r"(\d{4}-\d{2}-\d{2})"
+DAY = 24 * 60 * 60
+
+
+def _integer_fields(metadata_field_info: List[AttributeInfo]) -> List[str]:
+    return [field.name for field in metadata_field_info if field.type == "integer"]
+
+
+def _timestamp_field(query: str, field_names: List[str]) -> Optional[str]:
+    field_name = "updated_at" if re.search(r"\b(updated|modified|changed)\b", query) else "created_at"
+    return field_name if field_name in field_names else None
+
+
+def _utc_date(value: str) -> datetime:
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+def _time_range(query: str, now: float) -> Dict[str, int]:
+    """Epoch bounds for the dates in `query`; days are UTC days, like the indexed timestamps."""
+    today = datetime.fromtimestamp(now, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    time_range = {}
+    if re.search(r"\btoday\b", query):
+        time_range["$gte"] = int(today)
+    elif re.search(r"\byesterday\b", query):
+        time_range.update({"$gte": int(today - DAY), "$lt": int(today)})
+    elif match := re.search(r"\b(?:last|past) (\d+) (day|week|month)s?\b", query):
+        days = {"day": 1, "week": 7, "month": 30}[match.group(2)] * int(match.group(1))
+        time_range["$gte"] = int(now - days * DAY)
+    elif match := re.search(r"\b(?:last|past|this) (day|week|month|year)\b", query):
+        time_range["$gte"] = int(now - {"day": 1, "week": 7, "month": 30, "year": 365}[match.group(1)] * DAY)
+    if match := re.search(rf"\b(?:since|after|from) {DATE_PATTERN}", query):
+        time_range["$gte"] = int(_utc_date(match.group(1)).timestamp())
+    if match := re.search(rf"\b(?:before|until|to) {DATE_PATTERN}", query):
+        time_range["$lt"] = int((_utc_date(match.group(1)) + timedelta(days=1)).timestamp())
+    return time_range
+
+
+def build_where_filter(
+    query: str,
+    metadata_field_info: List[AttributeInfo],
+    now: float = None,
+) -> Optional[Dict[str, Any]]:
+    """Turn the structured parts of a question into a Chroma `where` clause.
+
+    Only attributes present in `metadata_field_info` are filtered on: status
+    keywords that clearly refer to tickets ("open tickets", "status: pending",
+    "tickets that are closed"), priority keywords, "<attribute> <number>"
+    mentions of integer id attributes (e.g. "brand 360001234", "group_id 42")
+    and relative or absolute date ranges (UTC days) on created_at/updated_at.
+    """
+    query = query.lower()
+    field_names = [field.name for field in metadata_field_info]
+    conditions = []
+
+    if "status" in field_names:
+        statuses = [status for status, pattern in STATUS_PATTERNS.items() if re.search(pattern, query)]
+        if len(statuses) == 1:
+            conditions.append({"status": statuses[0]})
+        elif statuses:
+            conditions.append({"status": {"$in": statuses}})
+
+    if "priority" in field_names and (match := re.search(PRIORITY_PATTERN, query)):
+        conditions.append({"priority": match.group(1) or match.group(2)})
+
+    for field_name in _integer_fields(metadata_field_info):
+        if not field_name.endswith("_id") or field_name == "id":
+            continue
+        label = re.escape(field_name[:-len("_id")]).replace("_", "[_ ]")
+        if match := re.search(rf"\b{label}(?:[_ ]id)?\s*(?:#|=|:|is)?\s*(\d+)\b", query):
+            conditions.append({field_name: int(match.group(1))})
+    if "id" in field_names and (match := re.search(r"\bticket (?:id\s*)?#?(\d+)\b", query)):
+        conditions.append({"id": int(match.group(1))})
+
+    timestamp_field = _timestamp_field(query, field_names)
+    time_range = _time_range(query, now or time.time()) if timestamp_field else {}
+    for operator, value in time_range.items():
+        conditions.append({f"{timestamp_field}{TIMESTAMP_SUFFIX}": {operator: value}})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
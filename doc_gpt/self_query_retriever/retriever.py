@@ -0,0 +1,34 @@
+from typing import Any, Dict, List
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.chains.query_constructor.schema import AttributeInfo
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+from langchain.vectorstores import Chroma
+
+from .filters import build_where_filter
+
+
+class MetadataFilteredRetriever(BaseRetriever):
+    """Similarity search restricted by a `where` clause parsed from the question.
+
+    Falls back to an unfiltered search when the filter matches nothing, so a
+    misread attribute never leaves the LLM without context.
+    """
+    vectorstore: Chroma
+    metadata_field_info: List[AttributeInfo]
+    search_kwargs: Dict[str, Any] = {"k": 4}
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        where = build_where_filter(query, self.metadata_field_info)
+        print("Retrieval filter:", where)
+        if where:
+            documents = self.vectorstore.similarity_search(query, filter=where, **self.search_kwargs)
+            if documents:
+                return documents
+        return self.vectorstore.similarity_search(query, **self.search_kwargs)
@@ -1,7 +1,9 @@
-from typing import List
+from typing import Dict, List
 
 from langchain.chains.query_constructor.schema import AttributeInfo
 
+from ..document_parser.utils import TIMESTAMP_SUFFIX
+
 DOCUMENT_CONTENT_DESCRIPTION = "Collection of Zendesk tickets in JSON"
 METADATA_DESCRIPTION_DICT = {
     "assignee_id": "assignee id in integer of the zendesk ticket",
@@ -44,16 +46,38 @@ METADATA_DESCRIPTION_DICT = {
 }
 
 
+def get_attribute_type(value) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    return "integer" if isinstance(value, int) else "string"
+
+
 def create_metadata_field_info(json_dict_list) -> List[AttributeInfo]:
     metadata_field_info = []
     for json_dict_key, json_dict_value in json_dict_list[0].items():
+        if json_dict_key not in METADATA_DESCRIPTION_DICT:
+            continue
         metadata_field_info.append(
             AttributeInfo(
                 **{
                     "name": json_dict_key,
                     "description": METADATA_DESCRIPTION_DICT[json_dict_key],
-                    "type": "integer" if isinstance(json_dict_value, int) else "string",
+                    "type": get_attribute_type(json_dict_value),
                 }
             )
         )
     return metadata_field_info
+
+
+def create_metadata_field_info_from_columns(column_types: Dict[str, str]) -> List[AttributeInfo]:
+    """Field info for the columns of a `TicketFeatureStore`; `<field>_ts` columns are described as `<field>`."""
+    metadata_field_info = []
+    for column, attribute_type in column_types.items():
+        if column.endswith(TIMESTAMP_SUFFIX):
+            column, attribute_type = column[:-len(TIMESTAMP_SUFFIX)], "string"
+        if column not in METADATA_DESCRIPTION_DICT:
+            continue
+        metadata_field_info.append(
+            AttributeInfo(name=column, description=METADATA_DESCRIPTION_DICT[column], type=attribute_type)
+        )
+    return metadata_field_info
@@ -0,0 +1,162 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+# Only phrases that can't stand on their own: a question merely containing "it" or "they" is searched as usual.
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(?:(?:that|this) (?:one|ticket)|(?:those|these) (?:ones|tickets)"
+    r"|the (?:first|second|third|fourth|fifth|last|previous|same) (?:one|ones|ticket|tickets)"
+    r"|(?:which|any|all|each|none|some|one) of (?:them|those|these)"
+    r"|tell me more|more about (?:it|that|this|them|those|these))\b",
+    re.IGNORECASE,
+)
+
+
+class SessionNotFoundError(Exception):
+    """Raised for a session id owned by another user, which is treated as unknown."""
+
+
+@dataclass
+class ConversationSession:
+    session_id: str
+    owner: str = ""
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    summary: str = ""
+    last_documents: List[Document] = field(default_factory=list)
+    last_active: float = field(default_factory=time.time)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            "_id": self.session_id,
+            "owner": self.owner,
+            "turns": [list(turn) for turn in self.turns],
+            "summary": self.summary,
+            "last_active": self.last_active,
+        }
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "ConversationSession":
+        return cls(
+            session_id=document["_id"],
+            owner=document.get("owner", ""),
+            turns=[tuple(turn) for turn in document.get("turns", [])],
+            summary=document.get("summary", ""),
+            last_active=document.get("last_active", time.time()),
+        )
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether `question` only makes sense about the previous turn's tickets ("tell me more", "the first one")."""
+    return bool(FOLLOW_UP_PATTERN.search(question))
+
+
+def merge_documents(documents: List[Document], previous: List[Document]) -> List[Document]:
+    """`documents` followed by up to as many of the `previous` turn's that aren't among them.
+
+    The context budget keeps tickets in order, so the previous turn's only
+    fill what room the new search leaves.
+    """
+    seen = {(document.page_content, document.metadata.get("id")) for document in documents}
+    carried = [
+        document for document in previous
+        if (document.page_content, document.metadata.get("id")) not in seen
+    ]
+    return documents + carried[:max(len(documents), 1)]
+
+
+@dataclass
+class SessionStore:
+    """In-process LRU of hot conversation sessions backed by a persistent store.
+
+    Each session keeps its last `window` turns verbatim; older turns are
+    folded into a bounded summary. Sessions idle for `idle_seconds`, or
+    pushed out of the `max_sessions` LRU, are dropped from memory and
+    reloaded from `load` on their next turn (without their cached retrieval
+    results); sessions in use are never dropped. A session belongs to the
+    user who started it and is unknown to everyone else; callers without
+    an email can't hold one.
+    """
+    max_sessions: int = 1000
+    window: int = 4
+    idle_seconds: float = 1800
+    max_summary_chars: int = 2000
+    load: Optional[Callable[[str], Awaitable[Optional[Dict[str, Any]]]]] = None
+    save: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None
+
+    def __post_init__(self):
+        self._sessions: OrderedDict[str, ConversationSession] = OrderedDict()
+        # Loads in flight, so concurrent first requests for a session share one object (and lock).
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def evict_idle(self) -> None:
+        idle_before = time.time() - self.idle_seconds
+        for session_id in [
+            session_id for session_id, session in self._sessions.items()
+            if session.last_active < idle_before and not session.lock.locked()
+        ]:
+            del self._sessions[session_id]
+
+    def _evict_overflow(self, keep: str) -> None:
+        overflow = len(self._sessions) - self.max_sessions
+        if overflow <= 0:
+            return
+        for session_id in [
+            session_id for session_id, session in self._sessions.items()
+            if session_id != keep and not session.lock.locked()
+        ][:overflow]:
+            del self._sessions[session_id]
+
+    async def _load(self, session_id: str, owner: str) -> ConversationSession:
+        try:
+            document = await self.load(session_id) if self.load else None
+            session = (
+                ConversationSession.from_document(document) if document else ConversationSession(session_id, owner)
+            )
+            self._sessions[session_id] = session
+            self._evict_overflow(keep=session_id)
+            return session
+        finally:
+            del self._loading[session_id]
+
+    async def get(self, session_id: str, owner: str = "") -> ConversationSession:
+        """The session `session_id`, loading or starting it for `owner` if it isn't in memory.
+
+        Raises `SessionNotFoundError` if the session belongs to someone else
+        or has no owner, and for callers without an `owner`.
+        """
+        if not owner:
+            raise SessionNotFoundError("Conversations need a signed-in user with an email")
+        self.evict_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            loading = self._loading.get(session_id)
+            if loading is None:
+                loading = self._loading[session_id] = asyncio.ensure_future(self._load(session_id, owner))
+            session = await asyncio.shield(loading)
+        # Sessions stored before they had owners can't be told apart, so nobody gets them.
+        if session.owner != owner:
+            raise SessionNotFoundError(f"No session {session_id}")
+        if session_id in self._sessions:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    async def record(
+        self, session: ConversationSession, question: str, answer: str, documents: List[Document]
+    ) -> None:
+        session.turns.append((question, answer))
+        while len(session.turns) > self.window:
+            old_question, _ = session.turns.pop(0)
+            session.summary = f"{session.summary} Asked: {old_question}.".strip()[-self.max_summary_chars:]
+        session.last_documents = documents
+        session.last_active = time.time()
+        if self.save:
+            await self.save(session.to_document())
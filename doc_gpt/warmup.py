@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class WarmupFailedError(Exception):
+    pass
+
+
+@dataclass
+class Warmup:
+    """Runs named warm-up steps on a background thread and reports readiness.
+
+    Steps run in order, once. Until all of them finish, `status` says which
+    one is running and how long the finished ones took, and `wait` lets
+    requests that need the warmed-up state hold off without blocking the
+    event loop.
+    """
+    steps: List[Tuple[str, Callable[[], Any]]] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.timings: Dict[str, float] = {}
+        self.current: Optional[str] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self.error is None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "current_step": self.current,
+            "error": self.error,
+            "timings": dict(self.timings),
+            "seconds_to_ready": self.ready_at - self.started_at if self.ready_at and self.started_at else None,
+        }
+
+    def run(self) -> None:
+        self.started_at = time.perf_counter()
+        try:
+            for name, step in self.steps:
+                self.current = name
+                start_time = time.perf_counter()
+                step()
+                self.timings[name] = time.perf_counter() - start_time
+            self.current = None
+            self.ready_at = time.perf_counter()
+            print("Warm-up finished:", self.timings)
+        except Exception as exc:
+            print(traceback.format_exc())
+            self.error = f"{self.current}: {exc}"
+        finally:
+            self._done.set()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    async def wait(self, timeout: float = None) -> None:
+        """Wait until warm-up finishes; raises `WarmupFailedError` if it failed."""
+        self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._done.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"Still warming up ({self.current})")
+            await asyncio.sleep(0.05)
+        if self.error:
+            raise WarmupFailedError(f"Warm-up failed at {self.error}")
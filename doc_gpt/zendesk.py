@@ -1,25 +1,145 @@
-import os
+import argparse
 import json
-from zenpy import Zenpy
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
 
 CREDS = {
     "email": os.getenv("ZENDESK_EMAIL"),
     "token": os.getenv("ZENDESK_API_KEY"),
     "subdomain": os.getenv("ZENDESK_SUBDOMAIN"),
 }
+SOURCE_FILES_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "source_files"))
+EXPORT_FILE_PATH = os.path.join(SOURCE_FILES_PATH, "zendesk.jsonl")
+STATE_FILE_PATH = os.path.join(SOURCE_FILES_PATH, "zendesk_export_state.json")
+INCREMENTAL_EXPORT_PATH = "/api/v2/incremental/tickets/cursor.json"
+
+
+class ZendeskExportError(Exception):
+    pass
+
+
+@dataclass
+class ExportState:
+    path: str = STATE_FILE_PATH
+
+    def __post_init__(self):
+        self.cursor: Optional[str] = None
+        self.exported: int = 0
+        if os.path.exists(self.path):
+            with open(self.path) as state_file:
+                state = json.load(state_file)
+            self.cursor = state.get("cursor")
+            self.exported = state.get("exported", 0)
+
+    def save(self) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump({"cursor": self.cursor, "exported": self.exported, "saved_at": time.time()}, state_file)
+        os.replace(temp_path, self.path)
+
+
+@dataclass
+class ZendeskExporter:
+    """Streams tickets from the Zendesk incremental export API into a JSON Lines file.
+
+    Every page is appended and flushed to `output_path` before the cursor in
+    `state` is advanced, so an interrupted run resumes from the last written
+    page. Re-exported tickets are appended again; readers keep the last
+    record per ticket id.
+    """
+    base_url: str
+    email: Optional[str] = None
+    token: Optional[str] = None
+    output_path: str = EXPORT_FILE_PATH
+    state_path: str = STATE_FILE_PATH
+    per_page: int = 1000
+    max_retries: int = 5
+    backoff_seconds: float = 1.0
+    timeout: float = 60
+
+    def __post_init__(self):
+        self._session = requests.Session()
+        if self.email and self.token:
+            self._session.auth = (f"{self.email}/token", self.token)
+
+    def _get(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.base_url.rstrip('/')}{INCREMENTAL_EXPORT_PATH}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._session.get(url, params=params, timeout=self.timeout)
+            except requests.ConnectionError as connection_error:
+                if attempt == self.max_retries:
+                    raise ZendeskExportError(str(connection_error)) from connection_error
+                time.sleep(self.backoff_seconds * 2 ** attempt)
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == self.max_retries:
+                    break
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after else self.backoff_seconds * 2 ** attempt
+                print(f"Zendesk answered {response.status_code}, retrying in {delay}s")
+                time.sleep(delay)
+                continue
+            if response.status_code != 200:
+                raise ZendeskExportError(f"Zendesk answered {response.status_code}: {response.text}")
+            return response.json()
+        raise ZendeskExportError(f"Gave up after {self.max_retries} retries")
+
+    def iter_pages(self, state: ExportState, start_time: int = 0) -> Iterator[Dict[str, Any]]:
+        while True:
+            params = {"per_page": self.per_page}
+            if state.cursor:
+                params["cursor"] = state.cursor
+            else:
+                params["start_time"] = start_time
+            page = self._get(params)
+            yield page
+            if page.get("end_of_stream") or not page.get("after_cursor"):
+                return
+
+    def export(self, start_time: int = 0) -> int:
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        state = ExportState(self.state_path)
+        exported = 0
+        with open(self.output_path, "a") as output_file:
+            for page in self.iter_pages(state, start_time):
+                tickets: List[Dict[str, Any]] = page.get("tickets", [])
+                output_file.writelines(json.dumps(ticket) + "\n" for ticket in tickets)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                exported += len(tickets)
+                state.exported += len(tickets)
+                state.cursor = page.get("after_cursor") or state.cursor
+                state.save()
+                print(f"Exported {exported} tickets")
+        return exported
+
 
+def get_base_url() -> str:
+    return os.getenv("ZENDESK_BASE_URL") or f"https://{CREDS['subdomain']}.zendesk.com"
 
-print(1)
-zenpy_client = Zenpy(**CREDS)
-print(2)
-tickets = zenpy_client.search(type="ticket")
-print(3)
-ticket_list = []
 
-for ticket in tickets:
-    print(4)
-    ticket_list.append(ticket.to_dict())
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export Zendesk tickets to a JSON Lines file.")
+    parser.add_argument("--output", default=EXPORT_FILE_PATH)
+    parser.add_argument("--state", default=STATE_FILE_PATH)
+    parser.add_argument("--start-time", type=int, default=0, help="unix time to start from on the first run")
+    parser.add_argument("--per-page", type=int, default=1000)
+    args = parser.parse_args(argv)
+    exporter = ZendeskExporter(
+        base_url=get_base_url(),
+        email=CREDS["email"],
+        token=CREDS["token"],
+        output_path=args.output,
+        state_path=args.state,
+        per_page=args.per_page,
+    )
+    exporter.export(start_time=args.start_time)
 
 
-with open("source_files/zendesk.json", "w+") as zendesk_json_file:
-    zendesk_json_file.write(json.dumps(ticket_list, indent=2))
+if __name__ == "__main__":
+    main()
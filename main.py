@@ -1,140 +1,378 @@
 import asyncio
 import json
+import math
 import os
-import threading
 import traceback
 import uuid
 from contextlib import asynccontextmanager
-from datetime import datetime
+from types import ModuleType
 from typing import Annotated
 
 import httpx
 from bson import ObjectId
-from fastapi import FastAPI, Request, HTTPException, Header
-from google.auth.exceptions import GoogleAuthError
-from google.auth.transport import requests
-from google.oauth2 import id_token
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
-from slowapi.util import get_remote_address
+from fastapi import Depends, FastAPI, Request, HTTPException, Header
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import RedirectResponse
+from starlette.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 
-from database import MongoDB
-from doc_gpt.json_gpt import run_query_prompt
+from auth import VERIFIER, AuthenticationError, get_admin_user, get_current_user
+from database import BulkWriter, MongoDB
+from doc_gpt.llm_pool import OLLAMA_POOL, TokenUsage
+from doc_gpt.metrics import METRICS
+from doc_gpt.warmup import Warmup, WarmupFailedError
 from models.auth import OAuthToken
 from models.query import QueryResponse, Query
+from scheduler import PRIORITY_CLASSES, JobQueue, QueueClosedError, QueueFullError, QuotaExceededError
 
-threads = set()
+JOB_QUEUE = JobQueue()
 
 
 @asynccontextmanager
-async def thread_cleanup(app: FastAPI):
+async def lifespan(app: FastAPI):
+    VERIFIER.check_configured()
+    await DB.setup()
+    # Serve immediately; queries wait for the warm-up and GET /ready reports when it's done.
+    WARMUP.start()
+    await JOB_QUEUE.start()
+    OLLAMA_POOL.start()
     yield
-    for thread in threads:
-        print(thread.name)
-        thread.join(10)
+    await JOB_QUEUE.drain(timeout=float(os.getenv("QUERY_QUEUE_DRAIN_TIMEOUT", "30")))
+    await WRITER.close()
+    await OLLAMA_POOL.aclose()
 
 
-limiter = Limiter(key_func=get_remote_address)
-app = FastAPI(lifespan=thread_cleanup)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(SessionMiddleware, secret_key=uuid.uuid4(), max_age=None)
 DB = MongoDB()
+WRITER = BulkWriter(DB)
+
+
+async def load_session(session_id: str) -> dict | None:
+    return await DB.find("sessions", {"_id": session_id}, find_one=True)
+
+
+async def save_session(session: dict) -> None:
+    session_id = session.pop("_id")
+    await WRITER.update("sessions", {"_id": session_id}, data=session, upsert=True)
+
+
+def query_api() -> ModuleType:
+    """`doc_gpt.json_gpt`, imported on first use since it pulls in langchain and chromadb."""
+    from doc_gpt import json_gpt
+
+    return json_gpt
+
+
+def get_engine():
+    from doc_gpt.engine import get_engine
+
+    return get_engine()
+
+
+def import_query_api() -> None:
+    json_gpt = query_api()
+    json_gpt.SESSIONS.load = load_session
+    json_gpt.SESSIONS.save = save_session
+    answer_cache, sessions = json_gpt.ANSWER_CACHE, json_gpt.SESSIONS
+    METRICS.gauge("answer_cache_hits", lambda: answer_cache.hits, "Answer cache hits since startup.")
+    METRICS.gauge("answer_cache_misses", lambda: answer_cache.misses, "Answer cache misses since startup.")
+    METRICS.gauge(
+        "answer_cache_hit_ratio",
+        lambda: answer_cache.hits / max(answer_cache.hits + answer_cache.misses, 1),
+        "Share of cache lookups answered without the LLM.",
+    )
+    METRICS.gauge("answer_cache_entries", lambda: len(answer_cache), "Answers currently cached.")
+    METRICS.gauge("sessions_in_memory", lambda: len(sessions), "Conversation sessions held in memory.")
+    retrieval_cache = get_engine().retrieval_cache
+    METRICS.gauge("retrieval_cache_hits", lambda: retrieval_cache.hits, "Vector searches answered from the cache.")
+    METRICS.gauge("retrieval_cache_misses", lambda: retrieval_cache.misses, "Vector searches run against Chroma.")
+    METRICS.gauge("retrieval_cache_entries", lambda: len(retrieval_cache), "Search results currently cached.")
+    METRICS.gauge(
+        "retrieval_cache_documents", lambda: retrieval_cache.documents, "Chunks held for cached search results."
+    )
+
+
+def warm_retrieval() -> None:
+    from doc_gpt.document_parser.context import get_token_counter
+
+    get_engine().retrieve("warm up")
+    get_token_counter()
+
+
+WARMUP = Warmup([
+    ("import", import_query_api),
+    ("index", lambda: get_engine().load()),
+    ("retrieval", warm_retrieval),
+])
+
+
+async def ready_query_api() -> ModuleType:
+    try:
+        await WARMUP.wait()
+    except WarmupFailedError as warmup_error:
+        raise HTTPException(503, str(warmup_error))
+    return query_api()
+
+
+METRICS.gauge("query_queue_depth", lambda: JOB_QUEUE.depth, "Queries waiting for a worker.")
+for priority_class in PRIORITY_CLASSES:
+    METRICS.gauge(
+        f"query_queue_depth_{priority_class}",
+        lambda priority_class=priority_class: JOB_QUEUE.depth_of(priority_class),
+        f"{priority_class.capitalize()} queries waiting for a worker.",
+    )
+METRICS.gauge("query_queue_capacity", lambda: JOB_QUEUE.max_size, "Queries allowed to wait before 503s.")
+METRICS.gauge("query_workers_busy", lambda: JOB_QUEUE.busy_workers, "Workers currently answering a query.")
+METRICS.gauge(
+    "query_worker_utilisation", lambda: JOB_QUEUE.busy_workers / JOB_QUEUE.workers, "Busy share of the worker pool."
+)
+METRICS.gauge("bulk_writer_pending", lambda: WRITER.pending, "Mongo operations buffered by the bulk writer.")
+METRICS.gauge("ready", lambda: WARMUP.ready, "1 once the models and index are warmed up.")
+METRICS.gauge("auth_claims_cache_hits", lambda: VERIFIER.hits, "ID tokens answered from the claims cache.")
+METRICS.gauge("auth_claims_cache_misses", lambda: VERIFIER.misses, "ID tokens whose signature was checked.")
+METRICS.gauge(
+    "llm_backends_healthy",
+    lambda: sum(backend.healthy for backend in OLLAMA_POOL.backends),
+    "Ollama backends in rotation.",
+)
+METRICS.gauge(
+    "llm_requests_outstanding",
+    lambda: sum(backend.outstanding for backend in OLLAMA_POOL.backends),
+    "Ollama requests in flight or waiting for a backend slot.",
+)
 
 
 async def task_done_callback(object_id: str, result: str) -> None:
-    print("INSIDE task_done_callback " * 10)
-    print(result, type(result), dir(result))
     print("INITIATING Task done callback")
-    print(DB)
-    db = MongoDB()
-    document_to_update = await db.find(
+    with METRICS.span("result_write"):
+        await WRITER.update(
+            "queries",
+            {"_id": ObjectId(object_id)},
+            data={"response": result, "status": "done"},
+        )
+    print("Updated DB:", object_id)
+
+
+async def task_failed_callback(object_id: str, error: Exception) -> None:
+    await WRITER.update(
         "queries",
-        {"id": object_id},
-        find_one=True
+        {"_id": ObjectId(object_id)},
+        data={"status": "failed", "error": str(error) or type(error).__name__},
     )
-    print("Document to update: ", document_to_update)
-    document_to_update = await document_to_update
-    print("Document to update: ", document_to_update)
-    if not document_to_update:
-        document_to_update = QueryResponse(**{"id": object_id}).dict()
-    document_to_update = {
-        **document_to_update,
-        "response": result,
-    }
-    print("Updated document to update:", document_to_update)
-    updated_db = await db.update(
-        "queries",
-        {"id": object_id},
-        data=document_to_update,
+
+
+def queue_full_exception(queue_full_error: QueueFullError) -> HTTPException:
+    return HTTPException(
+        503,
+        {"error": str(queue_full_error), "queue_position": JOB_QUEUE.depth + 1},
+        headers={"Retry-After": os.getenv("QUERY_QUEUE_RETRY_AFTER", "30")},
+    )
+
+
+def quota_exceeded_exception(quota_error: QuotaExceededError) -> HTTPException:
+    return HTTPException(
+        429,
+        {"error": str(quota_error), "quota": quota_error.quota},
+        headers={"Retry-After": str(math.ceil(quota_error.retry_after))},
     )
-    print("Updated DB:", await updated_db)
 
 
 @app.post("/", response_model=Query)
-@limiter.limit("20/day")
-async def root(request: Request, query: Query, token: Annotated[str | None, Header()]):
+async def root(request: Request, query: Query, user: Annotated[dict, Depends(get_current_user)]):
+    email = user.get("email") or ""
+    if query.session_id and not email:
+        raise HTTPException(400, "Conversations need an account with an email")
 
-    async def task_worker():
+    async def task_worker(usage: TokenUsage):
         print("Starting task worker")
-        print("&" * 100)
         print(query, query.prompt)
+        try:
+            await WARMUP.wait()
+        except WarmupFailedError as warmup_error:
+            await task_failed_callback(query.id, warmup_error)
+            return
+        with METRICS.span("query_total"):
+            result = await query_api().run_query_prompt(
+                query.prompt, session_id=query.session_id, usage=usage, owner=email, embedding=query_embedding
+            )
+            await task_done_callback(query.id, result)
 
-        # async def debug():
-        #     return "debug"
+    if WARMUP.error:
+        raise HTTPException(503, f"Warm-up failed at {WARMUP.error}")
+    queue_position = None
+    # Answers within a conversation depend on its history, so only standalone prompts hit the cache up front.
+    # Before warm-up finishes the query is queued right away rather than loading the models in the request.
+    # On a miss the worker reuses the prompt's embedding instead of looking the cache up again.
+    cached_answer, query_embedding = None, None
+    if WARMUP.ready and not query.session_id:
+        cached_answer, query_embedding = await query_api().get_cached_answer(query.prompt)
+    if cached_answer is not None:
+        query.response = cached_answer
+        query.status = "done"
+    elif JOB_QUEUE.is_full():
+        raise queue_full_exception(QueueFullError(JOB_QUEUE.max_size))
+    else:
+        try:
+            JOB_QUEUE.check_quota(email)
+        except QuotaExceededError as quota_error:
+            raise quota_exceeded_exception(quota_error)
+    query_id = ObjectId(query.id)
+    try:
+        await WRITER.insert("queries", **query.dict(), email=user.get("email"))
+        print(query_id)
+    except Exception as exc:
+        print(traceback.format_exc())
+        raise HTTPException(400, str(exc))
 
-        task = asyncio.ensure_future(run_query_prompt(query.prompt))
-        # task = asyncio.ensure_future(debug())
-        for f in asyncio.as_completed([task]):
-            result_task = await f
-            await task_done_callback(query.id, result_task)
+    if cached_answer is None:
+        # Submitted only once the document exists, so the worker's update can't miss it.
+        try:
+            queue_position = JOB_QUEUE.submit(
+                str(query.id),
+                task_worker,
+                user=email,
+                priority=query.priority,
+                on_error=lambda error: task_failed_callback(query.id, error),
+            )
+        except (QueueFullError, QueueClosedError, QuotaExceededError) as queue_error:
+            await WRITER.update("queries", {"_id": query_id}, data={"error": str(queue_error)})
+            if isinstance(queue_error, QueueFullError):
+                raise queue_full_exception(queue_error)
+            if isinstance(queue_error, QuotaExceededError):
+                raise quota_exceeded_exception(queue_error)
+            raise HTTPException(503, str(queue_error))
 
-    th = threading.Thread(
-        target=lambda: asyncio.run(task_worker()),
-        daemon=True
-    )
-    th.start()
-    threads.add(th)
-    try:
-        await DB.create_collection("queries")
-        document = await DB.insert_document("queries", **query.dict())
-        print(document)
-        print(document.inserted_id)
-        print(query.id, query.dict())
+    return {
+        **query.dict(),
+        "id": query_id,
+        "queue_position": queue_position,
+    }
 
-        result_document = await DB.find(
-            "queries",
-            {"id": document.inserted_id},
-            find_one=True
-        )
-        result = await result_document
 
-        return {
-            **query.dict(),
-            "id": document.inserted_id,
-            "result": result.get("response", query.dict()["response"]) if result else query.dict()["response"]
-        }
+@app.post("/stream")
+async def stream(request: Request, query: Query, user: Annotated[dict, Depends(get_current_user)]):
+    query_id = str(query.id)
+    email = user.get("email") or ""
+    if query.session_id and not email:
+        raise HTTPException(400, "Conversations need an account with an email")
+    json_gpt = await ready_query_api()
+    format_sse = json_gpt.format_sse
+    if JOB_QUEUE.is_full():
+        raise queue_full_exception(QueueFullError(JOB_QUEUE.max_size))
+    try:
+        JOB_QUEUE.check_quota(email)
+    except QuotaExceededError as quota_error:
+        raise quota_exceeded_exception(quota_error)
+    try:
+        await WRITER.insert("queries", **query.dict(), email=user.get("email"))
     except Exception as exc:
         print(traceback.format_exc())
         raise HTTPException(400, str(exc))
 
+    # The job runs on a queue worker like any other query and hands its tokens to the response through
+    # `events`: answer tokens, then the exception if generation failed, then None.
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def stream_worker(usage: TokenUsage):
+        try:
+            # Iterated to the end even if the client has gone, so the worker is held and the usage
+            # charged for the whole answer.
+            async for answer_token in json_gpt.stream_query_prompt(
+                query.prompt,
+                on_complete=lambda result: task_done_callback(query_id, result),
+                session_id=query.session_id,
+                usage=usage,
+                owner=email,
+            ):
+                events.put_nowait(answer_token)
+        except Exception as exc:
+            events.put_nowait(exc)
+            raise
+        finally:
+            events.put_nowait(None)
+
+    try:
+        queue_position = JOB_QUEUE.submit(
+            query_id,
+            stream_worker,
+            user=email,
+            priority=query.priority,
+            on_error=lambda error: task_failed_callback(query_id, error),
+        )
+    except (QueueFullError, QueueClosedError, QuotaExceededError) as queue_error:
+        await WRITER.update("queries", {"_id": ObjectId(query_id)}, data={"error": str(queue_error)})
+        if isinstance(queue_error, QueueFullError):
+            raise queue_full_exception(queue_error)
+        if isinstance(queue_error, QuotaExceededError):
+            raise quota_exceeded_exception(queue_error)
+        raise HTTPException(503, str(queue_error))
+
+    async def event_stream():
+        yield format_sse({"id": query_id, "queue_position": queue_position}, event="start")
+        while (event := await events.get()) is not None:
+            if isinstance(event, Exception):
+                yield format_sse({"id": query_id, "error": str(event)}, event="error")
+                return
+            yield format_sse({"token": event})
+        yield format_sse({"id": query_id}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/ready")
+async def ready():
+    return JSONResponse(WARMUP.status(), status_code=200 if WARMUP.ready else 503)
+
+
+@app.post("/index/reload")
+async def reload_index(user: Annotated[dict, Depends(get_admin_user)]):
+    await asyncio.to_thread(get_engine().reload)
+    return {"loaded": get_engine().is_loaded}
+
+
+@app.post("/index/shards/{shard_name}/rebuild")
+async def rebuild_index_shard(shard_name: str, user: Annotated[dict, Depends(get_admin_user)]):
+    try:
+        report = await asyncio.to_thread(get_engine().rebuild_shard, shard_name)
+    except KeyError:
+        raise HTTPException(404, f"No index shard {shard_name}")
+    except ValueError as value_error:
+        raise HTTPException(409, str(value_error))
+    return {"shard": shard_name, "report": report.dict()}
+
 
 @app.get("/tasks/{query_id}", response_model=QueryResponse)
-async def get_task_by_id(request: Request, query_id: str, token: Annotated[str | None, Header()]):
-    document = await DB.find(
+async def get_task_by_id(
+    request: Request, query_id: str, user: Annotated[dict, Depends(get_current_user)]
+):
+    result = await DB.find(
         "queries",
         {"_id": ObjectId(query_id)},
         find_one=True
     )
-    result = await document
-    print(result)
+    # Other users' queries are reported as missing.
+    if result and result.get("email") not in (None, user.get("email")):
+        result = None
     if result:
         try:
-            return QueryResponse(**{"response": result["response"], "id": result["_id"]}).dict()
+            return QueryResponse(
+                **{
+                    "response": result["response"],
+                    "id": result["_id"],
+                    "error": result.get("error"),
+                    "status": result.get("status"),
+                    "queue_position": JOB_QUEUE.position(query_id),
+                    "queue_eta_seconds": JOB_QUEUE.eta(query_id),
+                }
+            ).dict()
         except HTTPException as http_exc:
             raise http_exc
     raise HTTPException(
@@ -145,6 +383,8 @@ async def get_task_by_id(request: Request, query_id: str, token: Annotated[str |
 
 @app.get("/login", response_class=RedirectResponse, status_code=302)
 async def login(request: Request):
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     # Create the OAuth flow object
     flow = InstalledAppFlow.from_client_secrets_file(
         "credentials-google.json",
@@ -164,17 +404,17 @@ async def login(request: Request):
 @app.post("/validate")
 async def validate(oauth_token: OAuthToken):
     try:
-        response_dict = id_token.verify_oauth2_token(oauth_token.id_token, requests.Request())
-        token_expired_datetime = datetime.fromtimestamp(response_dict.get("exp"))
-        if token_expired_datetime < datetime.now():
-            raise HTTPException(401, "Token has expired. Please login again.")
-        return response_dict
-    except GoogleAuthError as google_auth_error:
-        raise HTTPException(401, str(google_auth_error))
+        # Expired tokens are rejected by the verifier.
+        return await VERIFIER.verify(oauth_token.id_token)
+    except AuthenticationError as auth_error:
+        raise HTTPException(401, str(auth_error))
 
 
 @app.get("/callback")
 async def callback(request: Request):
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+
     flow = InstalledAppFlow.from_client_secrets_file(
         "credentials-google.json",
         scopes=[
@@ -193,21 +433,19 @@ async def callback(request: Request):
         user_info = user_info_service.userinfo().get().execute()
         print(user_info, dir(user_info))
         print(flow.credentials.to_json())
-        await DB.create_collection("users")
-        await DB.create_indexes("users", ["email"])
-        await DB.update(
-            collection_name="users",
-            query={"email": user_info.get("email")},
-            data=user_info,
-            upsert=True
-        )
-        await DB.create_collection("credentials")
-        await DB.create_indexes("credentials", ["email"])
-        await DB.update(
-            collection_name="credentials",
-            query={"email": user_info.get("email")},
-            data=json.loads(flow.credentials.to_json()),
-            upsert=True
+        await asyncio.gather(
+            WRITER.update(
+                collection_name="users",
+                query={"email": user_info.get("email")},
+                data=user_info,
+                upsert=True
+            ),
+            WRITER.update(
+                collection_name="credentials",
+                query={"email": user_info.get("email")},
+                data=json.loads(flow.credentials.to_json()),
+                upsert=True
+            ),
         )
         return {
             "token": flow.credentials.token,
@@ -1,5 +1,5 @@
 import secrets
-from typing import Optional
+from typing import Literal, Optional
 
 from bson import ObjectId
 from pydantic import BaseModel, Field
@@ -12,6 +12,9 @@ class QueryResponse(BaseModel):
     # id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     response: str | None = Field(default="Response not processed yet. Come back later.")
     error: str | None = None
+    status: str | None = None
+    queue_position: int | None = None
+    queue_eta_seconds: float | None = None
 
     class Config:
         allow_population_by_field_name = True
@@ -22,19 +25,29 @@ class QueryResponse(BaseModel):
                 "id": "<mongo id>",
                 "response": "<query response>",
                 "error": "<error response>",
+                "status": "<done or failed once the query has finished>",
+                "queue_position": "<position in the query queue while pending>",
+                "queue_eta_seconds": "<estimated seconds until the answer while pending>",
             }
         }
 
 
 class Query(QueryResponse):
     prompt: str
+    session_id: str | None = None
+    priority: Literal["interactive", "batch"] = "interactive"
 
     class Config(QueryResponse.Config):
         schema_extra = {
             "example": {
                 "id": "<mongo id>",
                 "prompt": "<query prompt>",
+                "session_id": "<optional conversation id shared by follow-up queries>",
+                "priority": "<interactive (default) or batch>",
                 "response": "<query response>",
                 "error": "<error response>",
+                "status": "<done or failed once the query has finished>",
+                "queue_position": "<position in the query queue while pending>",
+                "queue_eta_seconds": "<estimated seconds until the answer while pending>",
             }
         }
@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from doc_gpt.llm_pool import TokenUsage
+from doc_gpt.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Served strictly in this order; within a class users share the workers by weight.
+PRIORITY_CLASSES = ("interactive", "batch")
+
+
+class QueueFullError(Exception):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        super().__init__(f"Query queue is full ({max_size} pending). Try again later.")
+
+
+class QueueClosedError(Exception):
+    pass
+
+
+class QuotaExceededError(Exception):
+    def __init__(self, user: str, quota: int, retry_after: float):
+        self.user = user
+        self.quota = quota
+        self.retry_after = retry_after
+        super().__init__(
+            f"Token quota of {quota} exceeded for {user}. Try again in {math.ceil(retry_after)} seconds."
+        )
+
+
+def parse_user_weights(value: str) -> Dict[str, float]:
+    """`QUERY_USER_WEIGHTS`, e.g. "ops@example.com=4,bot@example.com=0.5"."""
+    weights = {}
+    for item in value.split(","):
+        if "=" in item:
+            user, weight = item.rsplit("=", 1)
+            weights[user.strip()] = float(weight)
+    return weights
+
+
+@dataclass
+class _Job:
+    job_id: str
+    run: Callable[[TokenUsage], Awaitable[None]]
+    user: str
+    priority: str
+    cost: float
+    finish_tag: float
+    sequence: int
+    on_error: Optional[Callable[[Exception], Awaitable[None]]] = None
+    submitted_at: float = field(default_factory=time.time)
+
+    @property
+    def order(self) -> Tuple[int, float, int]:
+        return PRIORITY_CLASSES.index(self.priority), self.finish_tag, self.sequence
+
+
+@dataclass
+class JobQueue:
+    """Bounded, per-user fair queue of background jobs drained by a fixed pool of asyncio workers.
+
+    `workers` bounds how many queries are in retrieval/generation at once
+    (Ollama itself is further limited by the query batcher); anything beyond
+    that waits, and anything beyond `max_size` is rejected so callers can
+    back off.
+
+    Waiting jobs are served by priority class, and within a class by
+    self-clocked weighted fair queuing over users: a job's finish tag is
+    its user's previous tag (or the class's virtual time, if later) plus
+    its cost divided by the user's weight. Costs are token estimates,
+    corrected by the tokens actually spent once a job finishes, so a user
+    sending expensive queries falls back behind the others. A user's
+    prompt and answer tokens over the last `quota_window` seconds (plus
+    estimates for their pending jobs) are capped at `user_token_quota`;
+    0 lifts the cap.
+    """
+    max_size: int = int(os.getenv("QUERY_QUEUE_MAX_SIZE", "100"))
+    workers: int = int(os.getenv("QUERY_WORKERS", "8"))
+    user_token_quota: int = int(os.getenv("QUERY_USER_TOKEN_QUOTA", "200000"))
+    quota_window: float = float(os.getenv("QUERY_QUOTA_WINDOW_SECONDS", "86400"))
+    default_cost: float = float(os.getenv("QUERY_DEFAULT_COST_TOKENS", "2000"))
+    user_weights: Dict[str, float] = field(
+        default_factory=lambda: parse_user_weights(os.getenv("QUERY_USER_WEIGHTS", ""))
+    )
+
+    def __post_init__(self):
+        self._jobs: Dict[str, _Job] = {}
+        self._heaps: Dict[str, List[Tuple[float, int, str]]] = {priority: [] for priority in PRIORITY_CLASSES}
+        self._virtual_time: Dict[str, float] = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self._finish_tags: Dict[Tuple[str, str], float] = {}
+        self._usage: Dict[str, Deque[Tuple[float, int]]] = defaultdict(deque)
+        self._reserved: Dict[str, float] = defaultdict(float)
+        self._sequence = 0
+        self._ready: Optional[asyncio.Semaphore] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._unfinished = 0
+        self._worker_tasks: list[asyncio.Task] = []
+        self._busy = 0
+        self._closed = True
+        # Moving averages of finished jobs, for cost estimates and ETAs.
+        self.average_cost = self.default_cost
+        self.average_seconds: Optional[float] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._jobs)
+
+    def depth_of(self, priority: str) -> int:
+        return len(self._heaps[priority])
+
+    @property
+    def busy_workers(self) -> int:
+        return self._busy
+
+    def is_full(self) -> bool:
+        return self.depth >= self.max_size
+
+    def weight(self, user: str) -> float:
+        return self.user_weights.get(user, 1.0)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based place of a waiting job in the current serving order, None once picked up."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return 1 + sum(other.order < job.order for other in self._jobs.values())
+
+    def eta(self, job_id: str) -> Optional[float]:
+        """Rough seconds until a waiting job finishes, from its position and the average job duration."""
+        position = self.position(job_id)
+        if position is None or self.average_seconds is None:
+            return None
+        return math.ceil(position / self.workers) * self.average_seconds
+
+    def _used_tokens(self, user: str) -> int:
+        usage = self._usage[user]
+        expires_before = time.time() - self.quota_window
+        while usage and usage[0][0] < expires_before:
+            usage.popleft()
+        return sum(tokens for _, tokens in usage)
+
+    def check_quota(self, user: str, cost: float = None) -> None:
+        """Raise `QuotaExceededError` if `user` can't spend `cost` more tokens now."""
+        if not self.user_token_quota:
+            return
+        cost = self.average_cost if cost is None else cost
+        spent = self._used_tokens(user) + self._reserved[user]
+        # A user with nothing spent may always run one query, however large.
+        if spent and spent + cost > self.user_token_quota:
+            usage = self._usage[user]
+            retry_after = usage[0][0] + self.quota_window - time.time() if usage else self.average_seconds or 1
+            METRICS.increment(
+                "jobs_over_quota_total", help="Queries refused because the user's token quota was spent."
+            )
+            raise QuotaExceededError(user, self.user_token_quota, max(retry_after, 1))
+
+    def charge(self, user: str, tokens: int) -> None:
+        """Record tokens `user` spent, counted against their quota."""
+        if tokens:
+            self._usage[user].append((time.time(), tokens))
+        METRICS.increment("query_tokens_total", tokens, help="Prompt and answer tokens spent on queries.")
+
+    async def start(self) -> None:
+        self._ready = asyncio.Semaphore(0)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closed = False
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(), name=f"query-worker-{index}")
+            for index in range(self.workers)
+        ]
+
+    def submit(
+        self,
+        job_id: str,
+        job: Callable[[TokenUsage], Awaitable[None]],
+        user: str = "",
+        priority: str = PRIORITY_CLASSES[0],
+        on_error: Callable[[Exception], Awaitable[None]] = None,
+    ) -> int:
+        """Queue `job`, which is called with a `TokenUsage` to fill in, and return its position.
+
+        If the job raises, `on_error` is awaited with the exception so the failure can be recorded.
+        """
+        if self._closed or self._ready is None:
+            raise QueueClosedError("Query queue is not accepting jobs")
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"priority must be one of {PRIORITY_CLASSES}, got {priority!r}")
+        if self.is_full():
+            METRICS.increment("jobs_rejected_total", help="Queries rejected because the queue was full.")
+            raise QueueFullError(self.max_size)
+        cost = self.average_cost
+        self.check_quota(user, cost)
+        start_tag = max(self._virtual_time[priority], self._finish_tags.get((priority, user), 0.0))
+        finish_tag = self._finish_tags[(priority, user)] = start_tag + cost / self.weight(user)
+        self._sequence += 1
+        self._jobs[job_id] = _Job(job_id, job, user, priority, cost, finish_tag, self._sequence, on_error)
+        heapq.heappush(self._heaps[priority], (finish_tag, self._sequence, job_id))
+        self._reserved[user] += cost
+        self._unfinished += 1
+        self._idle.clear()
+        self._ready.release()
+        return self.position(job_id)
+
+    def _next_job(self) -> _Job:
+        for priority in PRIORITY_CLASSES:
+            heap = self._heaps[priority]
+            if heap:
+                finish_tag, _, job_id = heapq.heappop(heap)
+                self._virtual_time[priority] = finish_tag
+                return self._jobs.pop(job_id)
+        raise RuntimeError("No job waiting")
+
+    def _finish(self, job: _Job, usage: TokenUsage, seconds: float) -> None:
+        self._reserved[job.user] -= job.cost
+        if self._reserved[job.user] < 1e-6:
+            del self._reserved[job.user]
+        self.charge(job.user, usage.total)
+        # The user's next job is tagged as if this one had been estimated right.
+        key = (job.priority, job.user)
+        if key in self._finish_tags:
+            self._finish_tags[key] += (usage.total - job.cost) / self.weight(job.user)
+        if usage.total:
+            self.average_cost = 0.9 * self.average_cost + 0.1 * usage.total
+        self.average_seconds = seconds if self.average_seconds is None else 0.9 * self.average_seconds + 0.1 * seconds
+
+    async def _worker(self) -> None:
+        while True:
+            await self._ready.acquire()
+            job = self._next_job()
+            start_time = time.time()
+            METRICS.observe("queue_wait", start_time - job.submitted_at)
+            usage = TokenUsage()
+            self._busy += 1
+            try:
+                await job.run(usage)
+            except Exception as exc:
+                METRICS.increment("jobs_failed_total", help="Queued queries that raised.")
+                logger.exception("Job %s failed", job.job_id)
+                await self._report_failure(job, exc)
+            finally:
+                self._busy -= 1
+                self._finish(job, usage, time.time() - start_time)
+                self._unfinished -= 1
+                if not self._unfinished:
+                    self._idle.set()
+
+    @staticmethod
+    async def _report_failure(job: _Job, error: Exception) -> None:
+        if job.on_error is None:
+            return
+        try:
+            await job.on_error(error)
+        except Exception:
+            logger.exception("Could not record the failure of job %s", job.job_id)
+
+    async def drain(self, timeout: float = 30) -> None:
+        """Stop accepting jobs, wait up to `timeout` seconds for queued ones, then stop the workers."""
+        self._closed = True
+        if self._idle is None:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Query queue drain timed out with %d pending jobs", self.depth)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
@@ -0,0 +1,94 @@
+import json
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from doc_gpt.zendesk import INCREMENTAL_EXPORT_PATH
+
+
+@dataclass
+class FakeZendesk:
+    """Stand-in for the Zendesk incremental ticket export API.
+
+    Cursors are offsets into `tickets`. The first `rate_limited` requests
+    answer 429 with `retry_after` as their Retry-After header, and once
+    `fail_after_pages` pages have been served every request answers 500,
+    until the attribute is reset.
+    """
+    tickets: List[Dict[str, Any]] = field(default_factory=list)
+    rate_limited: int = 0
+    retry_after: Optional[str] = None
+    fail_after_pages: Optional[int] = None
+    host: str = "127.0.0.1"
+
+    def __post_init__(self):
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.requests: List[Dict[str, str]] = []
+        self.authorizations: List[Optional[str]] = []
+        self.pages_served = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def page(self, params: Dict[str, str]) -> Dict[str, Any]:
+        offset = int(params.get("cursor", 0))
+        per_page = int(params.get("per_page", 1000))
+        next_offset = min(offset + per_page, len(self.tickets))
+        return {
+            "tickets": self.tickets[offset:next_offset],
+            "after_cursor": str(next_offset),
+            "end_of_stream": next_offset >= len(self.tickets),
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict, headers: Dict[str, str] = None) -> None:
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != INCREMENTAL_EXPORT_PATH:
+                    self.send_error(404)
+                    return
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                fake.requests.append(params)
+                fake.authorizations.append(self.headers.get("Authorization"))
+                if fake.rate_limited:
+                    fake.rate_limited -= 1
+                    headers = {"Retry-After": fake.retry_after} if fake.retry_after is not None else {}
+                    self._send_json(429, {"error": "APIRateLimitExceeded"}, headers)
+                    return
+                if fake.fail_after_pages is not None and fake.pages_served >= fake.fail_after_pages:
+                    self._send_json(500, {"error": "InternalError"})
+                    return
+                fake.pages_served += 1
+                self._send_json(200, fake.page(params))
+
+        return Handler
+
+    def start(self) -> "FakeZendesk":
+        self._server = ThreadingHTTPServer((self.host, 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-zendesk", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+from auth import AuthenticationError, CertificateCache, TokenVerifier
+
+AUDIENCE = "client-id.apps.googleusercontent.com"
+
+
+class SigningKey:
+    """A locally generated RSA key with the self-signed certificate Google would publish for it."""
+
+    def __init__(self, key_id: str):
+        self.key_id = key_id
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, key_id)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(private_key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .sign(private_key, hashes.SHA256())
+        )
+        self.certificate = certificate.public_bytes(serialization.Encoding.PEM).decode()
+        private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        self._signer = crypt.RSASigner.from_string(private_pem, key_id=key_id)
+
+    def sign(self, **claims) -> str:
+        now = int(time.time())
+        payload = {
+            "iss": "https://accounts.google.com",
+            "aud": AUDIENCE,
+            "sub": "1234",
+            "email": "user@example.com",
+            "iat": now,
+            "exp": now + 3600,
+            **claims,
+        }
+        return jwt.encode(self._signer, payload).decode()
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return {key_id: SigningKey(key_id) for key_id in ("key-1", "key-2")}
+
+
+class FakeCertsEndpoint:
+    def __init__(self, *keys: SigningKey):
+        self.keys = list(keys)
+        self.fetches = 0
+
+    async def __call__(self, url: str):
+        self.fetches += 1
+        return {key.key_id: key.certificate for key in self.keys}, {"cache-control": "public, max-age=3600"}
+
+
+def make_verifier(endpoint: FakeCertsEndpoint, audience: str = AUDIENCE, **kwargs) -> TokenVerifier:
+    return TokenVerifier(certificates=CertificateCache(fetch=endpoint, **kwargs), audience=audience)
+
+
+def verify(verifier: TokenVerifier, token: str):
+    return asyncio.run(verifier.verify(token))
+
+
+def test_valid_token_is_verified_once_then_cached(keys):
+    endpoint = FakeCertsEndpoint(keys["key-1"])
+    verifier = make_verifier(endpoint)
+    token = keys["key-1"].sign()
+
+    assert verify(verifier, token)["email"] == "user@example.com"
+    assert verify(verifier, token)["email"] == "user@example.com"
+
+    assert (verifier.misses, verifier.hits, endpoint.fetches) == (1, 1, 1)
+
+
+def test_expired_token_is_refused(keys):
+    verifier = make_verifier(FakeCertsEndpoint(keys["key-1"]))
+    now = int(time.time())
+
+    with pytest.raises(AuthenticationError):
+        verify(verifier, keys["key-1"].sign(iat=now - 7200, exp=now - 3600))
+
+
+def test_cached_claims_expire_with_the_token(keys, monkeypatch):
+    verifier = make_verifier(FakeCertsEndpoint(keys["key-1"]))
+    token = keys["key-1"].sign(exp=int(time.time()) + 60)
+    verify(verifier, token)
+
+    later = time.time() + 120
+    monkeypatch.setattr("auth.time.time", lambda: later)
+
+    assert verifier._cached(verifier._cache_key(token)) is None
+
+
+def test_wrong_issuer_is_refused(keys):
+    verifier = make_verifier(FakeCertsEndpoint(keys["key-1"]))
+
+    with pytest.raises(AuthenticationError, match="issuer"):
+        verify(verifier, keys["key-1"].sign(iss="https://evil.example.com"))
+
+
+def test_wrong_audience_is_refused(keys):
+    verifier = make_verifier(FakeCertsEndpoint(keys["key-1"]))
+
+    with pytest.raises(AuthenticationError):
+        verify(verifier, keys["key-1"].sign(aud="another-client.apps.googleusercontent.com"))
+
+
+def test_missing_audience_fails_closed(keys):
+    verifier = make_verifier(FakeCertsEndpoint(keys["key-1"]), audience=None)
+
+    with pytest.raises(RuntimeError):
+        verifier.check_configured()
+    with pytest.raises(AuthenticationError):
+        verify(verifier, keys["key-1"].sign())
+
+
+def test_signature_from_another_key_is_refused(keys):
+    verifier = make_verifier(FakeCertsEndpoint(keys["key-1"]))
+    forged = SigningKey("key-1").sign()
+
+    with pytest.raises(AuthenticationError):
+        verify(verifier, forged)
+
+
+def test_rotated_key_id_refreshes_the_certificates(keys):
+    endpoint = FakeCertsEndpoint(keys["key-1"])
+    verifier = make_verifier(endpoint, min_refresh_interval=0)
+    verify(verifier, keys["key-1"].sign())
+
+    endpoint.keys = [keys["key-1"], keys["key-2"]]
+
+    assert verify(verifier, keys["key-2"].sign(sub="5678"))["sub"] == "5678"
+    assert endpoint.fetches == 2
+
+
+def test_unknown_key_ids_refresh_at_most_once_per_interval(keys):
+    endpoint = FakeCertsEndpoint(keys["key-1"])
+    verifier = make_verifier(endpoint, min_refresh_interval=60)
+    verify(verifier, keys["key-1"].sign())
+
+    for sub in ("a", "b"):
+        with pytest.raises(AuthenticationError):
+            verify(verifier, keys["key-2"].sign(sub=sub))
+
+    assert endpoint.fetches == 1
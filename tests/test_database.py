@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import OperationFailure
+from pymongo.results import BulkWriteResult
+
+import database
+from database import BulkWriter, MongoDB
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(database, "AsyncIOMotorClient", lambda uri, **kwargs: AsyncMongoMockClient())
+    return MongoDB()
+
+
+class SlowFirstWrite:
+    """Collection wrapper whose first `bulk_write` takes longer than the ones after it."""
+
+    def __init__(self, collection, delay: float):
+        self.collection = collection
+        self.delay = delay
+
+    async def bulk_write(self, operations, **kwargs):
+        delay, self.delay = self.delay, 0
+        await asyncio.sleep(delay)
+        return await self.collection.bulk_write(operations, **kwargs)
+
+
+def test_failed_operation_fails_only_its_own_future(db):
+    async def run():
+        await db.insert_document("queries", id="65a000000000000000000001", response="cached")
+        writer = BulkWriter(db, max_delay=0)
+        before = writer.update("queries", {"_id": "first"}, {"response": "a"}, upsert=True)
+        duplicate = writer.insert("queries", id="65a000000000000000000001", response="again")
+        after = writer.update("queries", {"_id": "second"}, {"response": "b"}, upsert=True)
+        await writer.close()
+        results = await asyncio.gather(before, duplicate, after, return_exceptions=True)
+        return results, await db.find("queries", {})
+
+    (before, duplicate, after), documents = asyncio.run(run())
+
+    assert isinstance(before, BulkWriteResult)
+    assert isinstance(duplicate, OperationFailure) and duplicate.code == 11000
+    assert isinstance(after, BulkWriteResult)
+    assert {document["_id"]: document["response"] for document in documents} == {
+        database.ObjectId("65a000000000000000000001"): "cached",
+        "first": "a",
+        "second": "b",
+    }
+
+
+def test_batches_of_a_collection_are_written_in_order(db, monkeypatch):
+    async def run():
+        slow = SlowFirstWrite(await db.get_collection("queries"), delay=0.05)
+
+        async def get_collection(collection_name):
+            return slow
+
+        monkeypatch.setattr(db, "get_collection", get_collection)
+        writer = BulkWriter(db, max_batch_size=1)
+        # Each update fills a batch and starts its own flush; the first one is slow to land.
+        writer.update("queries", {"_id": "query"}, {"status": "pending"}, upsert=True)
+        await asyncio.sleep(0)
+        writer.update("queries", {"_id": "query"}, {"status": "done"}, upsert=True)
+        await writer.close()
+        return await slow.collection.find_one({"_id": "query"})
+
+    assert asyncio.run(run())["status"] == "done"
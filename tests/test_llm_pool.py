@@ -0,0 +1,121 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from benchmarks.fake_ollama import FakeOllama
+from doc_gpt.llm_pool import OllamaError, OllamaPool
+
+
+@pytest.fixture
+def start_fake():
+    fakes = []
+
+    def start(**kwargs) -> FakeOllama:
+        fake = FakeOllama(**{"tokens": 4, "token_latency": 0.01, "first_token_latency": 0.01, **kwargs}).start()
+        fakes.append(fake)
+        return fake
+
+    yield start
+    for fake in fakes:
+        fake.stop()
+
+
+@pytest.fixture
+def dead_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def make_pool(monkeypatch, urls, **kwargs) -> OllamaPool:
+    pool = OllamaPool(urls=urls, **kwargs)
+    # Health checks run only when a test calls `check_health`, so they can't race the requests.
+    monkeypatch.setattr(pool, "start", lambda: None)
+    return pool
+
+
+def run(pool: OllamaPool, *prompts: str) -> list:
+    async def main():
+        try:
+            return await asyncio.gather(*(pool.generate(prompt) for prompt in prompts), return_exceptions=True)
+        finally:
+            await pool.aclose()
+
+    return asyncio.run(main())
+
+
+def test_requests_go_to_the_least_loaded_backend(monkeypatch, start_fake):
+    first, second = start_fake(), start_fake()
+    pool = make_pool(monkeypatch, [first.base_url, second.base_url])
+
+    answers = run(pool, *["question"] * 4)
+
+    assert answers == ["".join(first.answer_tokens())] * 4
+    assert (first.requests, second.requests) == (2, 2)
+
+
+def test_slow_request_is_hedged_on_another_backend(monkeypatch, start_fake):
+    slow, fast = start_fake(first_token_latency=2), start_fake()
+    pool = make_pool(monkeypatch, [slow.base_url, fast.base_url], hedge_after=0.1)
+
+    start_time = time.perf_counter()
+    answers = run(pool, "question")
+
+    assert answers == ["".join(fast.answer_tokens())]
+    assert time.perf_counter() - start_time < 1.5
+    assert (slow.requests, fast.requests) == (1, 1)
+    assert all(backend.healthy and not backend.failures for backend in pool.backends)
+
+
+def test_request_is_retried_after_a_dead_backend(monkeypatch, start_fake, dead_port):
+    fake = start_fake()
+    pool = make_pool(monkeypatch, [f"http://127.0.0.1:{dead_port}", fake.base_url], max_attempts=2)
+
+    assert run(pool, "question") == ["".join(fake.answer_tokens())]
+
+    dead, live = pool.backends
+    assert (dead.failures, dead.healthy) == (1, True)
+    assert (live.requests, live.failures) == (1, 0)
+
+
+def test_backend_is_ejected_after_consecutive_failures(monkeypatch, dead_port):
+    pool = make_pool(monkeypatch, [f"http://127.0.0.1:{dead_port}"], max_attempts=1, eject_after_failures=2)
+    backend = pool.backends[0]
+
+    assert isinstance(run(pool, "question")[0], OllamaError)
+    assert backend.healthy
+    assert isinstance(run(pool, "question")[0], OllamaError)
+    assert not backend.healthy
+
+
+def test_ejected_backend_is_readmitted_by_a_health_check(monkeypatch, start_fake, dead_port):
+    pool = make_pool(monkeypatch, [f"http://127.0.0.1:{dead_port}"])
+    backend = pool.backends[0]
+
+    async def check() -> bool:
+        try:
+            return await pool.check_health(backend)
+        finally:
+            await pool.aclose()
+
+    assert not asyncio.run(check())
+    assert not backend.healthy
+
+    start_fake(port=dead_port)
+
+    assert asyncio.run(check())
+    assert backend.healthy and backend.consecutive_failures == 0
+
+
+def test_waiting_for_a_busy_backend_is_not_a_timeout(monkeypatch, start_fake):
+    fake = start_fake(first_token_latency=0.2)
+    pool = make_pool(monkeypatch, [fake.base_url], max_concurrency_per_backend=1, first_token_timeout=0.5)
+
+    # The third request waits about 0.5s for a slot, longer than the first-token timeout.
+    answers = run(pool, *["question"] * 3)
+
+    assert answers == ["".join(fake.answer_tokens())] * 3
+    backend = pool.backends[0]
+    assert (backend.failures, backend.healthy) == (0, True)
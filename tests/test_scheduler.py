@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from scheduler import JobQueue, QueueFullError, QuotaExceededError
+
+
+def make_queue(**kwargs) -> JobQueue:
+    settings = {"max_size": 100, "workers": 1, "user_token_quota": 0, "default_cost": 1000, "user_weights": {}}
+    return JobQueue(**{**settings, **kwargs})
+
+
+def recorder(order: list, name: str, tokens: int = 0):
+    async def job(usage):
+        order.append(name)
+        usage.completion_tokens += tokens
+
+    return job
+
+
+def run_jobs(queue: JobQueue, jobs: list) -> list:
+    """Submit `(job_id, user, priority)` triples at once, wait for all of them and return the order they ran in."""
+    order = []
+
+    async def main():
+        await queue.start()
+        for job_id, user, priority in jobs:
+            queue.submit(job_id, recorder(order, job_id), user=user, priority=priority)
+        await queue.drain(timeout=5)
+
+    asyncio.run(main())
+    return order
+
+
+def test_users_take_turns():
+    queue = make_queue()
+    jobs = [(f"a{index}", "a", "interactive") for index in range(3)]
+    jobs += [(f"b{index}", "b", "interactive") for index in range(3)]
+
+    assert run_jobs(queue, jobs) == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+
+def test_heavier_user_gets_a_larger_share():
+    queue = make_queue(user_weights={"a": 2})
+    jobs = [(f"a{index}", "a", "interactive") for index in range(4)]
+    jobs += [(f"b{index}", "b", "interactive") for index in range(2)]
+
+    assert run_jobs(queue, jobs) == ["a0", "a1", "b0", "a2", "a3", "b1"]
+
+
+def test_interactive_jobs_are_served_before_batch_jobs():
+    queue = make_queue()
+    jobs = [("batch-a", "a", "batch"), ("batch-b", "b", "batch"), ("interactive-a", "a", "interactive")]
+
+    assert run_jobs(queue, jobs) == ["interactive-a", "batch-a", "batch-b"]
+
+
+def test_expensive_job_pushes_its_users_next_job_back():
+    queue = make_queue()
+    order = []
+
+    async def main():
+        await queue.start()
+        queue.submit("a0", recorder(order, "a0", tokens=9000), user="a")
+        await queue._idle.wait()
+        queue.submit("a1", recorder(order, "a1"), user="a")
+        queue.submit("b0", recorder(order, "b0"), user="b")
+        await queue.drain(timeout=5)
+
+    asyncio.run(main())
+
+    assert order == ["a0", "b0", "a1"]
+
+
+def test_position_and_eta_of_waiting_jobs():
+    queue = make_queue()
+
+    async def main():
+        started, finish = asyncio.Event(), asyncio.Event()
+
+        async def blocking(usage):
+            started.set()
+            await finish.wait()
+
+        await queue.start()
+        queue.submit("running", blocking, user="a")
+        await started.wait()
+        queue.submit("b0", recorder([], "b0"), user="b")
+        queue.submit("c0", recorder([], "c0"), user="c")
+        before = queue.position("running"), queue.position("b0"), queue.position("c0"), queue.eta("c0")
+        queue.average_seconds = 2.0
+        eta = queue.eta("c0")
+        finish.set()
+        await queue.drain(timeout=5)
+        return before, eta
+
+    (running, b_position, c_position, unknown_eta), eta = asyncio.run(main())
+
+    assert (running, b_position, c_position, unknown_eta) == (None, 1, 2, None)
+    assert eta == 4.0
+
+
+def test_spent_quota_is_refused_until_the_window_moves_on():
+    queue = make_queue(user_token_quota=5000, quota_window=60)
+
+    async def main():
+        await queue.start()
+        queue.submit("a0", recorder([], "a0", tokens=4500), user="a")
+        await queue.drain(timeout=5)
+
+    asyncio.run(main())
+
+    with pytest.raises(QuotaExceededError) as quota_error:
+        queue.check_quota("a")
+    assert quota_error.value.quota == 5000
+    assert 55 < quota_error.value.retry_after <= 60
+    # Other users are unaffected, and a user with nothing spent may always run one query.
+    queue.check_quota("b", cost=10_000)
+
+
+def test_full_queue_refuses_jobs():
+    queue = make_queue(max_size=2)
+
+    async def main():
+        await queue.start()
+        queue.submit("a0", recorder([], "a0"), user="a")
+        queue.submit("a1", recorder([], "a1"), user="a")
+        with pytest.raises(QueueFullError):
+            queue.submit("a2", recorder([], "a2"), user="a")
+        await queue.drain(timeout=5)
+
+    asyncio.run(main())
+
+
+def test_failed_job_is_reported_and_the_worker_carries_on():
+    queue = make_queue()
+    order, errors = [], []
+
+    async def failing(usage):
+        raise ValueError("boom")
+
+    async def on_error(error):
+        errors.append(error)
+
+    async def main():
+        await queue.start()
+        queue.submit("failing", failing, user="a", on_error=on_error)
+        queue.submit("next", recorder(order, "next"), user="a")
+        await queue.drain(timeout=5)
+
+    asyncio.run(main())
+
+    assert [str(error) for error in errors] == ["boom"]
+    assert order == ["next"]
+
+
+def test_drain_gives_up_after_its_timeout(caplog):
+    queue = make_queue()
+
+    async def stuck(usage):
+        await asyncio.sleep(60)
+
+    async def main():
+        await queue.start()
+        queue.submit("stuck", stuck, user="a")
+        await asyncio.sleep(0)
+        start_time = time.perf_counter()
+        await queue.drain(timeout=0.1)
+        return time.perf_counter() - start_time
+
+    with caplog.at_level(logging.WARNING, logger="scheduler"):
+        elapsed = asyncio.run(main())
+
+    assert elapsed < 1
+    assert "drain timed out with 0 pending jobs" in caplog.text
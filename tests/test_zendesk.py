@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from doc_gpt import zendesk
+from doc_gpt.zendesk import ExportState, ZendeskExporter, ZendeskExportError
+from tests.fake_zendesk import FakeZendesk
+
+TICKETS = [{"id": ticket_id, "subject": f"Ticket {ticket_id}"} for ticket_id in range(1, 6)]
+
+
+@pytest.fixture
+def fake():
+    fake = FakeZendesk(tickets=list(TICKETS)).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(zendesk.time, "sleep", delays.append)
+    return delays
+
+
+def make_exporter(fake: FakeZendesk, tmp_path, **kwargs) -> ZendeskExporter:
+    return ZendeskExporter(
+        base_url=fake.base_url,
+        output_path=str(tmp_path / "zendesk.jsonl"),
+        state_path=str(tmp_path / "state.json"),
+        per_page=2,
+        backoff_seconds=0,
+        **kwargs,
+    )
+
+
+def read_ids(path) -> list:
+    with open(path) as output_file:
+        return [json.loads(line)["id"] for line in output_file]
+
+
+def test_export_follows_cursor_pages(fake, tmp_path):
+    exporter = make_exporter(fake, tmp_path, email="agent@example.com", token="secret")
+
+    assert exporter.export(start_time=123) == 5
+
+    assert read_ids(exporter.output_path) == [1, 2, 3, 4, 5]
+    assert fake.requests == [
+        {"per_page": "2", "start_time": "123"},
+        {"per_page": "2", "cursor": "2"},
+        {"per_page": "2", "cursor": "4"},
+    ]
+    assert all(authorization.startswith("Basic ") for authorization in fake.authorizations)
+    state = ExportState(exporter.state_path)
+    assert (state.cursor, state.exported) == ("5", 5)
+
+
+def test_export_resumes_from_saved_cursor(fake, tmp_path, sleeps):
+    fake.fail_after_pages = 1
+    with pytest.raises(ZendeskExportError):
+        make_exporter(fake, tmp_path, max_retries=1).export()
+    assert read_ids(tmp_path / "zendesk.jsonl") == [1, 2]
+
+    fake.fail_after_pages = None
+    fake.requests.clear()
+    assert make_exporter(fake, tmp_path).export() == 3
+
+    assert fake.requests[0] == {"per_page": "2", "cursor": "2"}
+    assert read_ids(tmp_path / "zendesk.jsonl") == [1, 2, 3, 4, 5]
+    assert ExportState(str(tmp_path / "state.json")).exported == 5
+
+
+def test_export_waits_for_retry_after_on_rate_limit(fake, tmp_path, sleeps):
+    fake.rate_limited = 2
+    fake.retry_after = "7"
+
+    assert make_exporter(fake, tmp_path).export() == 5
+
+    assert sleeps == [7.0, 7.0]
+    assert len(fake.requests) == 5
+
+
+def test_export_backs_off_without_retry_after(fake, tmp_path, sleeps):
+    fake.rate_limited = 3
+    exporter = make_exporter(fake, tmp_path)
+    exporter.backoff_seconds = 0.5
+
+    exporter.export()
+
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_export_gives_up_after_max_retries(fake, tmp_path, sleeps):
+    fake.rate_limited = 10
+
+    with pytest.raises(ZendeskExportError):
+        make_exporter(fake, tmp_path, max_retries=2).export()
+
+    assert len(fake.requests) == 3
+    assert not ExportState(str(tmp_path / "state.json")).cursor